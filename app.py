@@ -4,118 +4,233 @@ app.py - Study Hub backend
 Primary author: Adrian De Vera (Backend / API)
 """
 
-import sqlite3
+import base64
+import gc
+import hashlib
+import heapq
+import json
+import os
+import re
+import time
 import uuid
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g
-from werkzeug.security import generate_password_hash, check_password_hash
+import click
+from flask import Flask, Response, current_app, render_template, request, redirect, url_for, session, flash, jsonify, g, stream_with_context
+import board
+import bot
+import bulk
+import cache
+import database
+import events
+import gamestore
+import maintenance
+import metrics
+import passwords
+import migrations
+import movelog
+import shards
 
 DATABASE = 'study_hub.db'
 
-app = Flask(__name__)
-app.secret_key = 'dev-secret-key'
+_views = []   # (rule, options, view function), added to every app by create_app()
+
+
+def route(rule, **options):
+    # like app.route, for the app create_app() builds later; endpoint names stay unprefixed
+    def decorator(view):
+        _views.append((rule, options, view))
+        return view
+    return decorator
+
 
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        db = g._database = database.get_pool(current_app).acquire()
     return db
 
 def init_db():
-    db = get_db()
-    cur = db.cursor()
-    # users, studies, games
-    cur.executescript('''
-    CREATE TABLE IF NOT EXISTS users (
-        username TEXT PRIMARY KEY,
-        password TEXT NOT NULL
-    );
-    CREATE TABLE IF NOT EXISTS studies (
-        id TEXT PRIMARY KEY,
-        username TEXT,
-        name TEXT,
-        description TEXT,
-        schedule TEXT,
-        public INTEGER DEFAULT 0,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    CREATE TABLE IF NOT EXISTS games (
-        id TEXT PRIMARY KEY,
-        username TEXT,
-        owner_id TEXT,
-        board TEXT,
-        turn TEXT,
-        status TEXT,
-        opponent TEXT DEFAULT 'human',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    CREATE TABLE IF NOT EXISTS study_members (
-        study_id TEXT,
-        username TEXT,
-        status TEXT DEFAULT 'approved',
-        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        PRIMARY KEY (study_id, username)
-    );
-    ''')
-    db.commit()
-
-    # Ensure columns exist (for older DBs) - rudimentary migration
-    cols = [r['name'] for r in db.execute("PRAGMA table_info(studies)").fetchall()]
-    if 'description' not in cols:
-        db.execute('ALTER TABLE studies ADD COLUMN description TEXT')
-    if 'schedule' not in cols:
-        db.execute('ALTER TABLE studies ADD COLUMN schedule TEXT')
-    if 'public' not in cols:
-        db.execute('ALTER TABLE studies ADD COLUMN public INTEGER DEFAULT 0')
-    # games opponent column migration
-    game_cols = [r['name'] for r in db.execute("PRAGMA table_info(games)").fetchall()]
-    if 'opponent' not in game_cols:
-        try:
-            db.execute("ALTER TABLE games ADD COLUMN opponent TEXT DEFAULT 'human'")
-        except Exception:
-            pass
-    if 'owner_id' not in game_cols:
-        try:
-            db.execute("ALTER TABLE games ADD COLUMN owner_id TEXT")
-        except Exception:
-            pass
-    # ensure study_members has status column
-    member_cols = [r['name'] for r in db.execute("PRAGMA table_info(study_members)").fetchall()]
-    if 'status' not in member_cols:
-        try:
-            db.execute("ALTER TABLE study_members ADD COLUMN status TEXT DEFAULT 'approved'")
-        except Exception:
-            pass
-    db.commit()
+    # versioned migrations (migrations.py); a no-op once the schema is current
+    migrations.migrate(get_db())
+    if current_app.config['GAME_SHARDS'] > 1:
+        for shard in _game_shards():
+            migrations.migrate(get_game_db(shard))
+
+def write(fn):
+    """Run fn(db) as this request's single write transaction; return its result.
+
+    fn must not commit. With DB_GROUP_COMMIT it runs on the writer thread's
+    connection, batched with other requests' units, so it should only use the
+    connection it is given and return plain values.
+    """
+    if current_app.config['DB_GROUP_COMMIT']:
+        return database.get_group_committer(current_app).submit(fn)
+    return database.run_in_transaction(get_db(), fn)
+
+def _game_shards():
+    return range(max(1, current_app.config['GAME_SHARDS']))
+
+
+def game_shard(gid):
+    return shards.shard_for(gid, current_app.config['GAME_SHARDS'])
+
+
+def get_game_db(shard):
+    """This request's connection to a game shard (the main one when unsharded)."""
+    if current_app.config['GAME_SHARDS'] <= 1:
+        return get_db()
+    dbs = g.setdefault('_game_dbs', {})
+    db = dbs.get(shard)
+    if db is None:
+        db = dbs[shard] = database.get_shard_pools(current_app)[shard].acquire()
+    return db
+
+
+def write_games(units):
+    """Run {shard: fn(db)} as this request's game writes; return {shard: result}.
+
+    Unsharded that is write(); otherwise one transaction per shard, committed
+    only once every fn succeeded (shards.run_together).
+    """
+    if current_app.config['GAME_SHARDS'] <= 1:
+        return {shard: write(fn) for shard, fn in units.items()}
+    order = sorted(units)
+    return dict(zip(order, shards.run_together([(get_game_db(shard), units[shard]) for shard in order])))
+
+
+def write_game(gid, fn):
+    shard = game_shard(gid)
+    return write_games({shard: fn})[shard]
+
 
-@app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        database.get_pool(current_app).release(db)
+    dbs = g.pop('_game_dbs', None)
+    if dbs:
+        pools = database.get_shard_pools(current_app)
+        for shard, db in dbs.items():
+            pools[shard].release(db)
+
+
+def get_game_store():
+    # None unless GAME_STORE is on; then moves go through gamestore.GameStore
+    if not current_app.config['GAME_STORE']:
+        return None
+    return gamestore.get_store(current_app)
+
+
+def _flush_games():
+    # SQL readers of games and the move log must not miss moves still held in memory
+    store = get_game_store()
+    if store is not None:
+        store.flush(session.get('username'))
+
+
+def get_broker():
+    broker = current_app.extensions.get('events')
+    if broker is None:
+        factory = current_app.config['EVENT_BROKER_FACTORY']
+        if factory is None:
+            broker = events.LocalBroker(current_app.config['EVENTS_QUEUE_SIZE'])
+        else:
+            broker = factory()
+        broker = current_app.extensions.setdefault('events', broker)
+    return broker
+
+
+def get_cache():
+    rcache = current_app.extensions.get('cache')
+    if rcache is None:
+        factory = current_app.config['RESPONSE_CACHE_FACTORY']
+        if factory is None:
+            rcache = cache.MemoryCache(current_app.config['RESPONSE_CACHE_MAX_BYTES'],
+                                       current_app.config['RESPONSE_CACHE_TTL'])
+        else:
+            rcache = factory()
+        rcache = current_app.extensions.setdefault('cache', rcache)
+    return rcache
+
+
+def _invalidate_studies():
+    # call after commit; cached searches/listings from older generations go dark
+    get_cache().bump('studies')
+
+
+def _tables_changed(table):
+    if table == 'studies':
+        _invalidate_studies()
 
 
-def _serialize_board(board):
-    return ','.join(board)
+def _publish(username, event, data):
+    # call after commit, so subscribers never see state that could roll back
+    if username:
+        get_broker().publish(f'user:{username}', event, data)
+
+
+def _publish_membership(db, study_id, owner, username, status):
+    pending = db.execute('SELECT pending_count FROM studies WHERE id=?', (study_id,)).fetchone()
+    pending = pending[0] if pending else 0
+    data = {'study_id': study_id, 'username': username, 'status': status, 'pending_count': pending}
+    _publish(owner, 'membership', data)
+    if username != owner:
+        _publish(username, 'membership', data)
+
+
+# Keyset pagination: list endpoints return one page as a JSON array and, when
+# more rows exist, an opaque cursor in the X-Next-Cursor header. Clients pass it
+# back as ?cursor=... to continue after the last row they saw.
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _decode_cursor(s):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(s.encode()))
+    except Exception:
+        return None
+    # only scalars SQLite can bind; anything else is a forged cursor
+    if not isinstance(values, list) or not all(type(v) in (str, int, float) for v in values):
+        return None
+    return values
 
 
-def _deserialize_board(s):
-    if s is None or s == '':
-        return ['']*9
-    return s.split(',')
+def _page_limit(default=50, maximum=100):
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        limit = default
+    return max(1, min(limit, maximum))
 
 
-# Initialize DB now inside an application context (safer across Flask versions)
-with app.app_context():
-    init_db()
+# Conditional GET: ETags are built from row versions (migrations._row_versions),
+# so a matching If-None-Match is answered 304 before any JSON is serialized.
+def _etag(*parts):
+    return hashlib.sha1(json.dumps(parts, separators=(',', ':')).encode()).hexdigest()
 
 
-@app.route('/')
+def _conditional(etag, build):
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    else:
+        resp = build()
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+
+def _fts_query(q):
+    # every word must match, each as a prefix ("calc" finds "calculus")
+    terms = re.findall(r'\w+', q)
+    return ' '.join(f'"{t}"*' for t in terms)
+
+
+@route('/')
 def index():
     return render_template('index.html')
 
 
-@app.route('/play')
+@route('/play')
 def play():
     # enforce login to access play page (nav already hides link but this is strict protection)
     if not session.get('username'):
@@ -124,7 +239,17 @@ def play():
     return render_template('play.html')
 
 
-@app.route('/register', methods=['GET','POST'])
+def _busy():
+    # hashing queue is full: shed load instead of queueing without bound
+    return 'Server busy, please try again in a moment', 503, {'Retry-After': '1'}
+
+
+def _games_not_saved(exc):
+    # the game store could not write games a response depends on (gamestore.FlushError)
+    return jsonify({'error':'games could not be saved, retry'}), 503, {'Retry-After': '1'}
+
+
+@route('/register', methods=['GET','POST'])
 def register():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -137,14 +262,17 @@ def register():
         if cur.fetchone():
             flash('Username already exists')
             return redirect(url_for('register'))
-        db.execute('INSERT INTO users(username,password) VALUES(?,?)', (username, generate_password_hash(password)))
-        db.commit()
+        try:
+            pwhash = passwords.get_hasher(current_app).hash(password)
+        except passwords.HasherBusy:
+            return _busy()
+        write(lambda db: db.execute('INSERT INTO users(username,password) VALUES(?,?)', (username, pwhash)).rowcount)
         flash('Registration successful')
         return redirect(url_for('login'))
     return render_template('register.html')
 
 
-@app.route('/login', methods=['GET','POST'])
+@route('/login', methods=['GET','POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -152,7 +280,16 @@ def login():
         db = get_db()
         cur = db.execute('SELECT username,password FROM users WHERE username=?', (username,))
         row = cur.fetchone()
-        if row and check_password_hash(row['password'], password):
+        ok = False
+        if row and password:
+            try:
+                ok, new_hash = passwords.get_hasher(current_app).verify(row['password'], password)
+            except passwords.HasherBusy:
+                return _busy()
+            if new_hash:
+                # hash parameters changed since this password was stored
+                write(lambda db: db.execute('UPDATE users SET password=? WHERE username=?', (new_hash, username)).rowcount)
+        if ok:
             session['username'] = username
             flash('Logged in successfully')
             return redirect(url_for('dashboard'))
@@ -161,34 +298,36 @@ def login():
     return render_template('login.html')
 
 
-@app.route('/logout')
+@route('/logout')
 def logout():
     session.pop('username', None)
     flash('Logged out')
     return redirect(url_for('index'))
 
 
-@app.route('/dashboard')
+@route('/dashboard')
 def dashboard():
     username = session.get('username')
     if not username:
         flash('Please log in')
         return redirect(url_for('login'))
     db = get_db()
-    # owned studies (include pending member count)
-    cur = db.execute('''SELECT s.id,s.name,s.description,s.schedule,s.public,s.created_at,
-                        (SELECT COUNT(*) FROM study_members m WHERE m.study_id=s.id AND m.status='pending') AS pending_count
-                        FROM studies s WHERE s.username=? ORDER BY s.created_at DESC LIMIT 50''', (username,))
-    owned = cur.fetchall()
-    # joined studies
-    cur = db.execute('''SELECT s.id,s.name,s.description,s.schedule,s.public,s.created_at
-                        FROM studies s JOIN study_members m ON s.id=m.study_id
-                        WHERE m.username=? ORDER BY m.joined_at DESC LIMIT 50''', (username,))
-    joined = cur.fetchall()
+    # owned and joined studies in one round trip; counts are the columns kept
+    # current by the study_members triggers, so no per-study COUNT(*)
+    rows = db.execute('''SELECT * FROM (
+                             SELECT 'owned' AS kind,s.id,s.name,s.description,s.schedule,s.public,s.created_at,s.pending_count,s.member_count
+                             FROM studies s WHERE s.username=? ORDER BY s.created_at DESC LIMIT 50)
+                         UNION ALL
+                         SELECT * FROM (
+                             SELECT 'joined',s.id,s.name,s.description,s.schedule,s.public,s.created_at,s.pending_count,s.member_count
+                             FROM study_members m JOIN studies s ON s.id=m.study_id
+                             WHERE m.username=? ORDER BY m.joined_at DESC LIMIT 50)''', (username, username)).fetchall()
+    owned = [r for r in rows if r['kind'] == 'owned']
+    joined = [r for r in rows if r['kind'] == 'joined']
     return render_template('dashboard.html', username=username, owned=owned, joined=joined)
 
 
-@app.route('/add', methods=['POST'])
+@route('/add', methods=['POST'])
 def add():
     # Create a study (advanced fields)
     name = request.form.get('study_name','').strip()
@@ -199,14 +338,17 @@ def add():
         flash('Study name is required')
         return redirect(url_for('dashboard'))
     username = session.get('username')
-    db = get_db()
     if username:
         sid = str(uuid.uuid4())
-        db.execute('INSERT INTO studies(id,username,name,description,schedule,public) VALUES(?,?,?,?,?,?)', (sid, username, name, description, schedule, public))
-        db.commit()
-        # auto-join creator
-        db.execute('INSERT OR IGNORE INTO study_members(study_id,username) VALUES(?,?)', (sid, username))
-        db.commit()
+
+        def create(db):
+            db.execute('INSERT INTO studies(id,username,name,description,schedule,public) VALUES(?,?,?,?,?,?)', (sid, username, name, description, schedule, public))
+            # auto-join creator
+            db.execute('INSERT OR IGNORE INTO study_members(study_id,username) VALUES(?,?)', (sid, username))
+
+        write(create)
+        if public:
+            _invalidate_studies()
         # If client expects JSON (AJAX), return JSON object; otherwise redirect
         if request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return jsonify({'id': sid, 'name': name, 'description': description, 'schedule': schedule, 'public': bool(public), 'pending_count': 0})
@@ -216,14 +358,14 @@ def add():
     return redirect(url_for('login'))
 
 
-@app.route('/clear_history', methods=['POST'])
+@route('/clear_history', methods=['POST'])
 def clear_history():
     session.pop('studies', None)
     flash('Recent studies cleared')
     return redirect(url_for('index'))
 
 
-@app.route('/study/<study_id>/join', methods=['POST'])
+@route('/study/<study_id>/join', methods=['POST'])
 def join_study(study_id):
     username = session.get('username')
     if not username:
@@ -234,41 +376,51 @@ def join_study(study_id):
     s = cur.fetchone()
     if not s:
         return jsonify({'error':'not found'}), 404
-    if s['public']:
-        db.execute('INSERT OR IGNORE INTO study_members(study_id,username,status) VALUES(?,?,?)', (study_id, username, 'approved'))
-        db.commit()
-        return jsonify({'status':'joined'})
-    # private study => create pending request
-    db.execute('INSERT OR IGNORE INTO study_members(study_id,username,status) VALUES(?,?,?)', (study_id, username, 'pending'))
-    db.commit()
-    return jsonify({'status':'pending'})
+    # public studies are joined directly; private ones get a pending request
+    status = 'approved' if s['public'] else 'pending'
+    added = write(lambda db: db.execute('INSERT OR IGNORE INTO study_members(study_id,username,status) VALUES(?,?,?)', (study_id, username, status)).rowcount)
+    if added:
+        _publish_membership(db, study_id, s['username'], username, status)
+    return jsonify({'status': 'joined' if s['public'] else 'pending'})
 
 
-@app.route('/study/<study_id>/leave', methods=['POST'])
+@route('/study/<study_id>/leave', methods=['POST'])
 def leave_study(study_id):
     username = session.get('username')
     if not username:
         return jsonify({'error':'login required'}), 401
     db = get_db()
-    db.execute('DELETE FROM study_members WHERE study_id=? AND username=?', (study_id, username))
-    db.commit()
+    removed = write(lambda db: db.execute('DELETE FROM study_members WHERE study_id=? AND username=?', (study_id, username)).rowcount)
+    if removed:
+        s = db.execute('SELECT username FROM studies WHERE id=?', (study_id,)).fetchone()
+        if s:
+            _publish_membership(db, study_id, s['username'], username, 'removed')
     return jsonify({'status':'left'})
 
 
-@app.route('/study/<study_id>/members')
+@route('/study/<study_id>/members')
 def study_members(study_id):
     # only owner can view/manage
     username = session.get('username')
     if not username:
         return jsonify({'error':'login required'}), 401
     db = get_db()
-    cur = db.execute('SELECT username,status,joined_at FROM study_members WHERE study_id=?', (study_id,))
-    rows = cur.fetchall()
-    out = [{'username':r['username'],'status':r['status'],'joined_at':r['joined_at']} for r in rows]
-    return jsonify(out)
+
+    def build():
+        cur = db.execute('SELECT username,status,joined_at FROM study_members WHERE study_id=?', (study_id,))
+        rows = cur.fetchall()
+        out = [{'username':r['username'],'status':r['status'],'joined_at':r['joined_at']} for r in rows]
+        return jsonify(out)
+
+    # every membership change bumps the study row (counter triggers), so its
+    # version alone tells whether this list changed
+    s = db.execute('SELECT version FROM studies WHERE id=?', (study_id,)).fetchone()
+    if not s:
+        return build()
+    return _conditional(_etag('members', study_id, s['version']), build)
 
 
-@app.route('/study/<study_id>/approve', methods=['POST'])
+@route('/study/<study_id>/approve', methods=['POST'])
 def approve_member(study_id):
     owner = session.get('username')
     if not owner:
@@ -279,12 +431,13 @@ def approve_member(study_id):
     r = cur.fetchone()
     if not r or r['username'] != owner:
         return jsonify({'error':'not authorized'}), 403
-    db.execute('UPDATE study_members SET status=? WHERE study_id=? AND username=?', ('approved', study_id, username))
-    db.commit()
+    updated = write(lambda db: db.execute('UPDATE study_members SET status=? WHERE study_id=? AND username=?', ('approved', study_id, username)).rowcount)
+    if updated:
+        _publish_membership(db, study_id, owner, username, 'approved')
     return jsonify({'status':'approved'})
 
 
-@app.route('/study/<study_id>/deny', methods=['POST'])
+@route('/study/<study_id>/deny', methods=['POST'])
 def deny_member(study_id):
     owner = session.get('username')
     if not owner:
@@ -295,12 +448,13 @@ def deny_member(study_id):
     r = cur.fetchone()
     if not r or r['username'] != owner:
         return jsonify({'error':'not authorized'}), 403
-    db.execute('DELETE FROM study_members WHERE study_id=? AND username=?', (study_id, username))
-    db.commit()
+    removed = write(lambda db: db.execute('DELETE FROM study_members WHERE study_id=? AND username=?', (study_id, username)).rowcount)
+    if removed:
+        _publish_membership(db, study_id, owner, username, 'removed')
     return jsonify({'status':'denied'})
 
 
-@app.route('/study/<study_id>/delete', methods=['POST'])
+@route('/study/<study_id>/delete', methods=['POST'])
 def delete_study(study_id):
     username = session.get('username')
     if not username:
@@ -313,60 +467,174 @@ def delete_study(study_id):
     if not r or r['username'] != username:
         flash('Not authorized')
         return redirect(url_for('dashboard'))
-    db.execute('DELETE FROM studies WHERE id=?', (study_id,))
-    db.execute('DELETE FROM study_members WHERE study_id=?', (study_id,))
-    db.commit()
+
+    def delete(db):
+        db.execute('DELETE FROM studies WHERE id=?', (study_id,))
+        db.execute('DELETE FROM study_members WHERE study_id=?', (study_id,))
+
+    write(delete)
+    _invalidate_studies()
     flash('Study deleted')
     return redirect(url_for('dashboard'))
 
 
-@app.route('/api/studies/search')
+@route('/api/studies/search')
 def api_search_studies():
     q = request.args.get('q','').strip()
+    limit = _page_limit()
+    cursor = None
+    if request.args.get('cursor'):
+        cursor = _decode_cursor(request.args['cursor'])
+        if cursor is None or len(cursor) != 2:
+            return jsonify({'error':'invalid cursor'}), 400
+    match = _fts_query(q)
+    if q and not match:
+        return jsonify([])
+    # same answer for every visitor: serve from the response cache when we can
+    rcache = get_cache()
+    key = f"studies:{rcache.generation('studies')}:search:{match.lower()}:{limit}:{request.args.get('cursor', '')}"
+    hit = rcache.get(key)
+    if hit is not None:
+        return _cached_json(*hit, status='HIT')
     db = get_db()
-    if q:
-        rows = db.execute("SELECT id,name,description,schedule,public FROM studies WHERE public=1 AND (name LIKE ? OR description LIKE ?) LIMIT 50", (f'%{q}%', f'%{q}%')).fetchall()
+    if match:
+        # best bm25 first (lower is better); name hits weigh more than description
+        keyset, params = '', [match]
+        if cursor:
+            keyset, params = 'AND (f.score, f.rowid) > (?, ?)', params + cursor
+        rows = db.execute(f'''SELECT s.id,s.name,s.description,s.schedule,s.public,f.rowid AS rid,f.score AS sortkey
+                              FROM (SELECT rowid, bm25(studies_fts, 10.0, 1.0) AS score FROM studies_fts WHERE studies_fts MATCH ?) f
+                              JOIN studies s ON s.rowid=f.rowid
+                              WHERE s.public=1 {keyset}
+                              ORDER BY f.score, f.rowid LIMIT ?''', params + [limit + 1]).fetchall()
+    elif cursor:
+        rows = db.execute('''SELECT id,name,description,schedule,public,rowid AS rid,created_at AS sortkey FROM studies
+                             WHERE public=1 AND (created_at, rowid) < (?, ?)
+                             ORDER BY created_at DESC, rowid DESC LIMIT ?''', (cursor[0], cursor[1], limit + 1)).fetchall()
     else:
-        rows = db.execute('SELECT id,name,description,schedule,public FROM studies WHERE public=1 ORDER BY created_at DESC LIMIT 50').fetchall()
+        rows = db.execute('''SELECT id,name,description,schedule,public,rowid AS rid,created_at AS sortkey FROM studies
+                             WHERE public=1 ORDER BY created_at DESC, rowid DESC LIMIT ?''', (limit + 1,)).fetchall()
     out = []
-    for r in rows:
+    for r in rows[:limit]:
         out.append({'id':r['id'],'name':r['name'],'description':r['description'],'schedule':r['schedule'],'public':bool(r['public'])})
-    return jsonify(out)
+    body = json.dumps(out, separators=(',', ':')).encode()
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = _encode_cursor([last['sortkey'], last['rid']])
+    rcache.set(key, (body, next_cursor), len(body))
+    return _cached_json(body, next_cursor, status='MISS')
+
+
+def _cached_json(body, next_cursor, status):
+    resp = Response(body, mimetype='application/json')
+    if next_cursor:
+        resp.headers['X-Next-Cursor'] = next_cursor
+    resp.headers['X-Cache'] = status
+    return resp
 
 
-@app.route('/api/owned_studies')
+@route('/api/owned_studies')
 def api_owned_studies():
     username = session.get('username')
     if not username:
         return jsonify({'error':'login required'}), 401
     db = get_db()
-    rows = db.execute('''SELECT s.id,s.name,s.description,s.schedule,s.public,
-                         (SELECT COUNT(*) FROM study_members m WHERE m.study_id=s.id AND m.status='pending') AS pending_count
-                         FROM studies s WHERE s.username=? ORDER BY s.created_at DESC LIMIT 100''', (username,)).fetchall()
-    out = []
-    for r in rows:
-        out.append({'id': r['id'], 'name': r['name'], 'description': r['description'], 'schedule': r['schedule'], 'public': bool(r['public']), 'pending_count': r['pending_count']})
-    return jsonify(out)
+    rows = db.execute('''SELECT id,name,description,schedule,public,pending_count,member_count,version
+                         FROM studies WHERE username=? ORDER BY created_at DESC LIMIT 100''', (username,)).fetchall()
+
+    def build():
+        out = []
+        for r in rows:
+            out.append({'id': r['id'], 'name': r['name'], 'description': r['description'], 'schedule': r['schedule'], 'public': bool(r['public']), 'pending_count': r['pending_count'], 'member_count': r['member_count']})
+        return jsonify(out)
+
+    return _conditional(_etag('owned', [[r['id'], r['version']] for r in rows]), build)
 
 
 ### Games API using DB
 
-@app.route('/api/games', methods=['GET'])
+@route('/api/games', methods=['GET'])
 def api_list_games():
     username = session.get('username')
     if not username:
         return jsonify({'error':'login required'}), 401
-    db = get_db()
-    cur = db.execute('SELECT id,board,turn,status FROM games WHERE username=? ORDER BY created_at DESC', (username,))
-    rows = cur.fetchall()
-    out = []
-    for r in rows:
-        out.append({'id': r['id'], 'board': _deserialize_board(r['board']), 'turn': r['turn'], 'status': r['status']})
-    return jsonify(out)
+    limit = _page_limit(current_app.config['GAMES_PAGE_SIZE'], current_app.config['GAMES_PAGE_MAX'])
+    _flush_games()
+    where, params = ['username=?'], [username]
+    status = request.args.get('status')
+    if status:
+        where.append('status=?')
+        params.append(status)
+    if request.args.get('cursor'):
+        cursor = _decode_cursor(request.args['cursor'])
+        if cursor is None or len(cursor) != 2:
+            return jsonify({'error':'invalid cursor'}), 400
+        where.append('(created_at, id) < (?, ?)')
+        params += cursor
+    # every shard returns its own first page; the merged page is the global one
+    pages = [get_game_db(shard).execute(f'''SELECT id,cells,turn,status,created_at,version,board_rows,board_cols,win_length
+                                             FROM games WHERE {' AND '.join(where)}
+                                             ORDER BY created_at DESC, id DESC LIMIT ?''', params + [limit + 1]).fetchall()
+             for shard in _game_shards()]
+    rows = shards.merge_desc(pages, lambda r: (r['created_at'], r['id']), limit + 1)
+
+    def build():
+        out = []
+        for r in rows[:limit]:
+            out.append(dict(_game_json(_geometry(r), board.from_db(r['cells']), r['turn'], r['status']), id=r['id']))
+        resp = jsonify(out)
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            resp.headers['X-Next-Cursor'] = _encode_cursor([last['created_at'], last['id']])
+        return resp
+
+    # the extra look-ahead row is included: a new older game changes the cursor
+    return _conditional(_etag('games', [[r['id'], r['version']] for r in rows]), build)
+
+
+@route('/api/games', methods=['POST'])
+def api_create_game():
+    data = request.get_json(silent=True) or {}
+    geom = _parse_geometry(data)
+    if geom is None:
+        return jsonify({'error':'invalid board size'}), 400
+    username, owner_id = _game_owner()
+    gid = str(uuid.uuid4())
+    opponent = request.args.get('opponent') or data.get('opponent') or 'human'
+    write_game(gid, lambda db: db.execute(f'INSERT INTO games({_INSERT_COLUMNS}) VALUES(?,?,?,?,?,?,?,?,?,?)',
+                                          (gid, username, owner_id, board.EMPTY, 'X', 'playing', opponent, geom.rows, geom.cols, geom.k)).rowcount)
+    return jsonify({'id': gid, 'game': dict(_game_json(geom, board.EMPTY, 'X', 'playing'), opponent=opponent)})
 
 
-@app.route('/api/games', methods=['POST'])
-def api_create_game():
+_INSERT_COLUMNS = 'id,username,owner_id,cells,turn,status,opponent,board_rows,board_cols,win_length'
+_GAME_COLUMNS = 'id,cells,turn,status,opponent,version,board_rows,board_cols,win_length'
+
+
+def _geometry(r):
+    return board.geometry(r['board_rows'], r['board_cols'], r['win_length'])
+
+
+def _parse_geometry(data):
+    """Board size from a create request (rows, cols, win_length; 3x3x3 by default), or None."""
+    try:
+        rows, cols = int(data.get('rows', 3)), int(data.get('cols', 3))
+        k = int(data.get('win_length', min(rows, cols, 5)))
+    except (TypeError, ValueError):
+        return None
+    if not (3 <= rows <= current_app.config['GAME_MAX_SIDE'] and 3 <= cols <= current_app.config['GAME_MAX_SIDE']):
+        return None
+    if not 3 <= k <= max(rows, cols):
+        return None
+    return board.geometry(rows, cols, k)
+
+
+def _game_json(geom, cells, turn, status):
+    return {'board': geom.to_list(cells), 'turn': turn, 'status': status,
+            'rows': geom.rows, 'cols': geom.cols, 'win_length': geom.k}
+
+
+def _game_owner():
     # allow anonymous creation: use session username if present, otherwise owner_id
     username = session.get('username')
     owner_id = username or session.get('actor_id')
@@ -374,181 +642,479 @@ def api_create_game():
         # create random actor id and store in session
         owner_id = str(uuid.uuid4())
         session['actor_id'] = owner_id
-    gid = str(uuid.uuid4())
-    board = _serialize_board(['']*9)
-    opponent = request.args.get('opponent') or request.json and request.json.get('opponent') or 'human'
-    db = get_db()
-    db.execute('INSERT INTO games(id,username,owner_id,board,turn,status,opponent) VALUES(?,?,?,?,?,?,?)', (gid, username, owner_id, board, 'X', 'playing', opponent))
-    db.commit()
-    return jsonify({'id': gid, 'game': {'board': ['']*9, 'turn': 'X', 'status': 'playing', 'opponent': opponent}})
+    return username, owner_id
+
+
+@route('/api/games/batch', methods=['POST'])
+def api_create_games():
+    # {"games": [{"opponent": "bot"}, ...]} -> one result per game, one commit
+    items = (request.get_json(silent=True) or {}).get('games')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error':'games must be a non-empty list'}), 400
+    if len(items) > current_app.config['GAMES_BATCH_MAX']:
+        return jsonify({'error':f"at most {current_app.config['GAMES_BATCH_MAX']} games per batch"}), 400
+    username, owner_id = _game_owner()
+    rows, results = {}, []
+    for item in items:
+        opponent = item.get('opponent', 'human') if isinstance(item, dict) else None
+        if opponent not in ('human', 'bot'):
+            results.append({'error':'invalid opponent'})
+            continue
+        geom = _parse_geometry(item)
+        if geom is None:
+            results.append({'error':'invalid board size'})
+            continue
+        gid = str(uuid.uuid4())
+        rows.setdefault(game_shard(gid), []).append(
+            (gid, username, owner_id, board.EMPTY, 'X', 'playing', opponent, geom.rows, geom.cols, geom.k))
+        results.append({'id': gid, 'game': dict(_game_json(geom, board.EMPTY, 'X', 'playing'), opponent=opponent)})
+    if rows:
+        write_games({shard: lambda db, params=params: db.executemany(
+            f'INSERT INTO games({_INSERT_COLUMNS}) VALUES(?,?,?,?,?,?,?,?,?,?)', params).rowcount
+            for shard, params in rows.items()})
+    return jsonify({'results': results})
+
+
+@route('/api/games/moves', methods=['POST'])
+def api_batch_moves():
+    # {"moves": [{"game": gid, "pos": 4}, ...]} applied in order, bot replies
+    # included; every game that changed is written in the same transaction
+    username = session.get('username')
+    if not username:
+        return jsonify({'error':'login required'}), 401
+    items = (request.get_json(silent=True) or {}).get('moves')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error':'moves must be a non-empty list'}), 400
+    if len(items) > current_app.config['GAMES_BATCH_MAX']:
+        return jsonify({'error':f"at most {current_app.config['GAMES_BATCH_MAX']} moves per batch"}), 400
+    gids = sorted({item.get('game') for item in items if isinstance(item, dict) and isinstance(item.get('game'), str)})
+    store = get_game_store()
+    if store is not None:
+        store.evict(gids)
+    by_shard = {}
+    for gid in gids:
+        by_shard.setdefault(game_shard(gid), []).append(gid)
+    games = {}
+    for shard, ids in by_shard.items():
+        db = get_game_db(shard)
+        for i in range(0, len(ids), 500):  # stay under SQLite's bound-parameter limit
+            chunk = ids[i:i + 500]
+            marks = ','.join('?' * len(chunk))
+            for r in db.execute(f'SELECT {_GAME_COLUMNS} FROM games WHERE username=? AND id IN ({marks})', [username] + chunk):
+                games[r['id']] = dict(r, cells=board.from_db(r['cells']), geom=_geometry(r), shard=shard)
+
+    # bot replies on searched boards share one budget per request, so a full
+    # batch cannot hold the worker for GAMES_BATCH_MAX * BOT_MOVE_BUDGET
+    move_budget = current_app.config['BOT_MOVE_BUDGET']
+    searched = sum(1 for item in items if isinstance(item, dict) and isinstance(item.get('game'), str)
+                   and _searched_reply(games.get(item['game'])))
+    deadline = time.monotonic() + current_app.config['BOT_BATCH_BUDGET']
+
+    results, changed = [], {}
+    for item in items:
+        gid = item.get('game') if isinstance(item, dict) else None
+        game = games.get(gid) if isinstance(gid, str) else None
+        if game is None:
+            results.append({'error':'not found'})
+            continue
+        budget = None
+        if _searched_reply(game):
+            budget = min(move_budget, max(0.0, deadline - time.monotonic()) / searched)
+            searched -= 1
+        geom = game['geom']
+        pos = _parse_pos(geom, item.get('pos'))
+        error = _move_error(geom, game['cells'], game['status'], pos)
+        if error:
+            results.append({'id': game['id'], 'error': error})
+            continue
+        if game['id'] not in changed:
+            game['start'], game['moves'] = game['cells'], []
+        game['cells'], game['turn'], game['status'], moves = _take_turn(geom, game['cells'], game['turn'],
+                                                                        game['opponent'], pos, budget)
+        game['moves'] += moves
+        changed[game['id']] = game
+        results.append({'id': game['id'], 'game': _game_json(geom, game['cells'], game['turn'], game['status'])})
+
+    interval = current_app.config['GAME_SNAPSHOT_INTERVAL']
+
+    def save(games):
+        def unit(db):
+            params = [(board.to_db(game['cells']), game['turn'], game['status'], game['id'], game['version']) for game in games]
+            if db.executemany('UPDATE games SET cells=?,turn=?,status=? WHERE id=? AND version=?', params).rowcount != len(params):
+                raise _Conflict()
+            for game in games:
+                movelog.record(db, game['id'], game['geom'], game['start'], game['moves'], interval)
+        return unit
+
+    if changed:
+        units = {}
+        for game in changed.values():
+            units.setdefault(game['shard'], []).append(game)
+        try:
+            write_games({shard: save(games) for shard, games in units.items()})
+        except _Conflict:
+            return jsonify({'error':'games changed, reload and retry'}), 409
+        for gid, game in changed.items():
+            _publish(username, 'game', {'id': gid, 'game': _game_json(game['geom'], game['cells'], game['turn'], game['status'])})
+    return jsonify({'results': results})
+
 
+def _searched_reply(game):
+    # a bot game whose replies come from engine.py's timed search, not the 3x3 table
+    if game is None or game['opponent'] != 'bot':
+        return False
+    geom = game['geom']
+    return (geom.rows, geom.cols, geom.k) != (3, 3, 3)
 
-@app.route('/api/games/<gid>', methods=['GET'])
+
+class _Conflict(Exception):
+    """Raised inside a write unit to roll it back when a row changed underneath."""
+
+
+@route('/api/games/<gid>', methods=['GET'])
 def api_get_game(gid):
-    username = session.get('username')
-    db = get_db()
-    if username:
-        cur = db.execute('SELECT id,board,turn,status,opponent FROM games WHERE id=? AND username=?', (gid, username))
-        r = cur.fetchone()
-    else:
-        owner_id = session.get('actor_id')
-        cur = db.execute('SELECT id,board,turn,status,opponent FROM games WHERE id=? AND owner_id=?', (gid, owner_id))
-        r = cur.fetchone()
+    store = get_game_store()
+    live = store.snapshot(gid) if store is not None else None
+    if live is not None and _owns(live[0]):
+        game, cells, turn, status, version, pending = live
+        return _conditional(_etag('game', gid, version, pending),
+                            lambda: jsonify({'id': gid, 'game': _game_json(game.geom, cells, turn, status)}))
+    r = _own_game(get_game_db(game_shard(gid)), gid)
     if not r:
         return jsonify({'error':'not found'}), 404
-    return jsonify({'id': r['id'], 'game': {'board': _deserialize_board(r['board']), 'turn': r['turn'], 'status': r['status']}})
+    return _conditional(_etag('game', r['id'], r['version'], 0),
+                        lambda: jsonify({'id': r['id'], 'game': _game_json(_geometry(r), board.from_db(r['cells']), r['turn'], r['status'])}))
 
 
-@app.route('/api/games/<gid>', methods=['DELETE'])
+@route('/api/games/<gid>', methods=['DELETE'])
 def api_delete_game(gid):
+    store = get_game_store()
+    if store is not None:
+        store.evict([gid])
     username = session.get('username')
-    db = get_db()
     if username:
-        cur = db.execute('DELETE FROM games WHERE id=? AND username=?', (gid, username))
+        deleted = write_game(gid, lambda db: db.execute('DELETE FROM games WHERE id=? AND username=?', (gid, username)).rowcount)
     else:
         owner_id = session.get('actor_id')
-        cur = db.execute('DELETE FROM games WHERE id=? AND owner_id=?', (gid, owner_id))
-    db.commit()
-    if cur.rowcount:
+        deleted = write_game(gid, lambda db: db.execute('DELETE FROM games WHERE id=? AND owner_id=?', (gid, owner_id)).rowcount)
+    if deleted:
         return jsonify({'status':'deleted'})
     return jsonify({'error':'not found'}), 404
 
 
-@app.route('/api/games/<gid>/move', methods=['POST'])
+@route('/api/games/<gid>/move', methods=['POST'])
 def api_move(gid):
     username = session.get('username')
     if not username:
         return jsonify({'error':'login required'}), 401
     data = request.get_json() or {}
-    pos = data.get('pos')
-    try:
-        pos = int(pos)
-    except Exception:
-        return jsonify({'error':'invalid pos'}), 400
-    if pos < 0 or pos > 8:
-        return jsonify({'error':'invalid pos'}), 400
+    store = get_game_store()
+    if store is not None:
+        resp = _move_in_store(store, gid, data)
+        if resp is not None:
+            return resp
 
-    db = get_db()
-    # prefer match by username if present, otherwise try owner_id
-    if username:
-        cur = db.execute('SELECT board,turn,status,opponent,owner_id FROM games WHERE id=? AND username=?', (gid, username))
-        r = cur.fetchone()
-    else:
-        owner_id = session.get('actor_id')
-        cur = db.execute('SELECT board,turn,status,opponent,owner_id FROM games WHERE id=? AND owner_id=?', (gid, owner_id))
-        r = cur.fetchone()
+    r = _own_game(get_game_db(game_shard(gid)), gid)
     if not r:
         return jsonify({'error':'not found'}), 404
-    board = _deserialize_board(r['board'])
+    geom, cells = _geometry(r), board.from_db(r['cells'])
+    pos = _parse_pos(geom, data.get('pos'))
+    if pos is None:
+        return jsonify({'error':'invalid pos'}), 400
     if r['status'] != 'playing':
         return jsonify({'error':'game finished', 'status': r['status']}), 400
-    if board[pos]:
+    if not geom.is_free(cells, pos):
         return jsonify({'error':'cell occupied'}), 400
-
-    player = r['turn']
-    board[pos] = player
-
-    # check winner
-    def check_winner(board_state):
-        lines = [(0,1,2),(3,4,5),(6,7,8),(0,3,6),(1,4,7),(2,5,8),(0,4,8),(2,4,6)]
-        for i,j,k in lines:
-            if board_state[i] and board_state[i] == board_state[j] == board_state[k]:
-                return board_state[i]
-        if all(board_state):
-            return 'draw'
+    start = cells
+    cells, player, status, moves = _take_turn(geom, cells, r['turn'], r['opponent'], pos)
+
+    # player and bot move land in one UPDATE (plus their move-log rows); the
+    # version check turns a concurrent move on the same game into a 409
+    # instead of a lost update
+    interval = current_app.config['GAME_SNAPSHOT_INTERVAL']
+
+    def save(db):
+        if not db.execute('UPDATE games SET cells=?,turn=?,status=? WHERE id=? AND version=?',
+                          (board.to_db(cells), player, status, gid, r['version'])).rowcount:
+            return False
+        movelog.record(db, gid, geom, start, moves, interval)
+        return True
+
+    if not write_game(gid, save):
+        return jsonify({'error':'game changed, reload and retry'}), 409
+    game = _game_json(geom, cells, player, status)
+    _publish(username, 'game', {'id': gid, 'game': game})
+    return jsonify({'id': gid, 'game': game})
+
+
+def _move_in_store(store, gid, data):
+    # the same checks and turn as api_move, on the in-memory game; None when
+    # the game is not a playing one, so api_move answers from the database
+    username = session['username']
+    with store.checkout(get_game_db(game_shard(gid)), gid) as g:
+        if g is None:
+            return None
+        if g.username != username:
+            return jsonify({'error':'not found'}), 404
+        pos = _parse_pos(g.geom, data.get('pos'))
+        if pos is None:
+            return jsonify({'error':'invalid pos'}), 400
+        if g.status != 'playing':
+            return jsonify({'error':'game finished', 'status': g.status}), 400
+        if not g.geom.is_free(g.cells, pos):
+            return jsonify({'error':'cell occupied'}), 400
+        cells, player, status, moves = _take_turn(g.geom, g.cells, g.turn, g.opponent, pos)
+        if not store.apply(g, cells, player, status, moves):
+            return jsonify({'error':'game changed, reload and retry'}), 409
+    game = _game_json(g.geom, cells, player, status)
+    _publish(username, 'game', {'id': gid, 'game': game})
+    return jsonify({'id': gid, 'game': game})
+
+
+def _parse_pos(geom, pos):
+    try:
+        pos = int(pos)
+    except Exception:
         return None
+    return pos if 0 <= pos < geom.size else None
+
+
+def _move_error(geom, cells, status, pos):
+    """Return why pos cannot be played on this game, or None."""
+    if pos is None:
+        return 'invalid pos'
+    if status != 'playing':
+        return 'game finished'
+    if not geom.is_free(cells, pos):
+        return 'cell occupied'
+    return None
+
+
+def _take_turn(geom, cells, turn, opponent, pos, budget=None):
+    """Play pos for the side to move, then the bot's reply when it is the opponent.
+
+    budget caps the bot's search in seconds (default BOT_MOVE_BUDGET).
+    Returns (cells, turn, status, moves); moves are the (pos, player, by_bot)
+    entries for the move log.
+    """
+    moves = [(pos, turn, False)]
+    cells, turn, status = bot.apply_move(geom, cells, pos, turn)
+    # 3x3 answers from the precomputed table, larger boards from a timed search
+    if opponent == 'bot' and status == 'playing':
+        mv = bot.reply(geom, cells, turn, current_app.config['BOT_MOVE_BUDGET'] if budget is None else budget)
+        if mv is not None:
+            moves.append((mv, turn, True))
+            cells, turn, status = bot.apply_move(geom, cells, mv, turn)
+    return cells, turn, status, moves
 
-    winner = None
-    # simple check implemented without nested shadowing
-    lines = [(0,1,2),(3,4,5),(6,7,8),(0,3,6),(1,4,7),(2,5,8),(0,4,8),(2,4,6)]
-    for a,b,c in lines:
-        if board[a] and board[a] == board[b] == board[c]:
-            winner = board[a]
-            break
-    if winner:
-        status = f'{winner}_wins'
-    elif all(board):
-        status = 'draw'
-    else:
-        status = 'playing'
-        player = 'O' if player == 'X' else 'X'
-
-    db.execute('UPDATE games SET board=?,turn=?,status=? WHERE id=? AND username=?', (_serialize_board(board), player, status, gid, username))
-    db.commit()
-
-    # If opponent is bot and game still playing, let bot move using minimax
-    cur = db.execute('SELECT opponent,turn,status,board,owner_id FROM games WHERE id=?', (gid,))
-    row = cur.fetchone()
-    if row and row['opponent'] == 'bot' and row['status'] == 'playing':
-        bot_player = row['turn']
-        board_state = _deserialize_board(row['board'])
-
-        # minimax implementation
-        def minimax(board, player):
-            winner = check_winner(board)
-            if winner == bot_player:
-                return {'score': 1}
-            elif winner == ('draw'):
-                return {'score': 0}
-            elif winner is not None:
-                return {'score': -1}
-
-            moves = []
-            for i in range(9):
-                if board[i] == '':
-                    move = {}
-                    board[i] = player
-                    next_player = 'O' if player == 'X' else 'X'
-                    result = minimax(board, next_player)
-                    move['index'] = i
-                    move['score'] = result['score']
-                    board[i] = ''
-                    moves.append(move)
-
-            # choose best move
-            if player == bot_player:
-                best = max(moves, key=lambda m: m['score'])
-            else:
-                best = min(moves, key=lambda m: m['score'])
-            return best
-
-        # if board empty and bot starts, choose center
-        empties = [i for i,v in enumerate(board_state) if v=='']
-        if len(empties) == 9 and bot_player == 'X':
-            mv = 4
-        else:
-            res = minimax(board_state, bot_player)
-            mv = res.get('index') if res else None
 
-        if mv is not None:
-            board_state[mv] = bot_player
-            winner2 = check_winner(board_state)
-            if winner2 == 'draw':
-                status2 = 'draw'
-            elif winner2:
-                status2 = f'{winner2}_wins'
-            else:
-                status2 = 'playing'
-            next_turn = 'O' if bot_player == 'X' else 'X'
-            db.execute('UPDATE games SET board=?,turn=?,status=? WHERE id=?', (_serialize_board(board_state), next_turn, status2, gid))
-            db.commit()
-            return jsonify({'id': gid, 'game': {'board': board_state, 'turn': next_turn, 'status': status2}})
-
-    return jsonify({'id': gid, 'game': {'board': board, 'turn': player, 'status': status}})
-
-
-@app.route('/admin/clear', methods=['POST'])
-def admin_clear():
+def _owns(g):
+    # _own_game's rule for a game held in the game store
     username = session.get('username')
-    if username != 'admin':
+    return g.username == username if username else g.owner_id == session.get('actor_id')
+
+
+def _own_game(db, gid):
+    # prefer match by username if present, otherwise try owner_id
+    username = session.get('username')
+    if username:
+        return db.execute(f'SELECT {_GAME_COLUMNS} FROM games WHERE id=? AND username=?', (gid, username)).fetchone()
+    return db.execute(f'SELECT {_GAME_COLUMNS} FROM games WHERE id=? AND owner_id=?', (gid, session.get('actor_id'))).fetchone()
+
+
+def _ndjson(rows):
+    # one JSON object per line, produced as the cursor is read
+    return Response(stream_with_context(json.dumps(row, separators=(',', ':')) + '\n' for row in rows),
+                    mimetype='application/x-ndjson')
+
+
+@route('/api/games/<gid>/moves')
+def api_game_moves(gid):
+    # replay: every logged move of one game, streamed as NDJSON
+    _flush_games()
+    db = get_game_db(game_shard(gid))
+    if not _own_game(db, gid):
+        return jsonify({'error':'not found'}), 404
+    try:
+        start = int(request.args.get('from', 0))
+    except ValueError:
+        return jsonify({'error':'invalid from'}), 400
+    return _ndjson({'ply': ply, 'pos': pos, 'player': player, 'bot': by_bot}
+                   for ply, pos, player, by_bot in movelog.iter_moves(db, gid, start))
+
+
+@route('/api/games/<gid>/state')
+def api_game_state(gid):
+    # the board as it was after ?ply=N moves, rebuilt from the nearest snapshot
+    _flush_games()
+    db = get_game_db(game_shard(gid))
+    r = _own_game(db, gid)
+    if not r:
+        return jsonify({'error':'not found'}), 404
+    try:
+        ply = int(request.args['ply'])
+    except (KeyError, ValueError):
+        return jsonify({'error':'ply required'}), 400
+    geom = _geometry(r)
+    cells = movelog.state_at(db, geom, gid, ply)
+    if cells is None:
+        return jsonify({'error':'ply not in move log'}), 404
+    return jsonify({'id': gid, 'ply': ply, 'board': geom.to_list(cells)})
+
+
+@route('/admin/moves/export')
+def admin_export_moves():
+    # every logged move of every game, in (game, ply) order, streamed as NDJSON
+    if session.get('username') != 'admin':
         return jsonify({'error':'admin required'}), 403
-    db = get_db()
-    db.execute('DELETE FROM games')
-    db.execute('DELETE FROM studies')
-    db.execute('DELETE FROM study_members')
-    db.commit()
-    return jsonify({'status':'cleared'})
+    store = get_game_store()
+    if store is not None:
+        store.flush()
+    cursors = [get_game_db(shard).execute('SELECT game_id,ply,code FROM game_moves ORDER BY game_id, ply')
+               for shard in _game_shards()]
+    return _ndjson(dict(zip(('game', 'ply', 'pos', 'player', 'bot'), (game_id, ply) + movelog.decode(code)))
+                   for game_id, ply, code in heapq.merge(*(map(tuple, cur) for cur in cursors)))
+
+
+@route('/api/events')
+def api_events():
+    # Server-Sent Events: game and membership deltas for the logged-in user
+    username = session.get('username')
+    if not username:
+        return jsonify({'error':'login required'}), 401
+    sub = get_broker().subscribe([f'user:{username}'])
+    heartbeat = current_app.config['EVENTS_HEARTBEAT']
+
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                message = sub.get(timeout=heartbeat)
+                # comment lines keep proxies from closing an idle stream
+                yield message if message is not None else ': keep-alive\n\n'
+        finally:
+            sub.close()
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def _ensure_schema():
+    # the safety net for a process nobody prepared: migrate() is one PRAGMA
+    # read once the schema is current, and after that not even that
+    ready = current_app.extensions.setdefault('schema_ready', set())
+    key = _schema_key(current_app)
+    if key not in ready:
+        init_db()
+        ready.add(key)
+
+
+def _schema_key(app):
+    return app.config['DATABASE'], app.config['GAME_SHARDS']
+
+
+def create_app(config=None, preload=False):
+    """Build a Study Hub app; config overrides the defaults below.
+
+    Building it opens no database. The schema is migrated by
+    `flask --app app init-db`, by preload=True in a pre-fork master, or else
+    on each process's first request.
+    """
+    app = Flask(__name__)
+    app.config.update(
+        SECRET_KEY=os.environ.get('STUDY_HUB_SECRET_KEY', 'dev-secret-key'),
+        DATABASE=os.environ.get('STUDY_HUB_DATABASE', DATABASE),
+        DB_POOL_SIZE=8,                 # connections per process
+        DB_POOL_TIMEOUT=10.0,           # seconds to wait for a free connection
+        DB_HEALTH_CHECK_INTERVAL=30.0,  # ping connections idle longer than this
+        DB_PRAGMAS=None,                # overrides for database.DEFAULT_PRAGMAS
+        DB_GROUP_COMMIT=False,          # batch concurrent write units into one commit (database.GroupCommitter)
+        DB_GROUP_COMMIT_WINDOW=0.002,   # seconds the writer waits for more units before committing
+        DB_GROUP_COMMIT_MAX_BATCH=64,   # most units committed together
+        GAMES_PAGE_SIZE=20,             # default /api/games page size
+        GAMES_PAGE_MAX=100,             # largest ?limit a client may ask for
+        GAMES_BATCH_MAX=500,            # games or moves accepted by one batch request
+        GAME_MAX_SIDE=19,               # largest rows/cols a new game may ask for
+        BOT_MOVE_BUDGET=0.5,            # seconds the bot may search per move on non-3x3 boards
+        BOT_BATCH_BUDGET=2.0,           # seconds of bot search one /api/games/moves request may spend in total
+        GAME_SNAPSHOT_INTERVAL=16,      # plies between board snapshots in the move log
+        GAME_SHARDS=int(os.environ.get('STUDY_HUB_GAME_SHARDS', 1)),  # game database files (shards.py); 1 keeps games in DATABASE
+        GAME_STORE=False,               # keep playing games in memory, write moves behind (gamestore.py)
+        GAME_STORE_SIZE=10000,          # playing games held per process before LRU eviction
+        GAME_STORE_FLUSH_INTERVAL=0.5,  # seconds between write-behind flushes; 0 flushes only on demand
+        EVENT_BROKER_FACTORY=None,      # callable returning a broker; default events.LocalBroker
+        EVENTS_QUEUE_SIZE=100,          # buffered events per /api/events client
+        EVENTS_HEARTBEAT=15.0,          # seconds between keep-alive comments
+        DB_CONNECTION_FACTORY=None,     # sqlite3.Connection subclass for pooled connections
+        METRICS_ENABLED=os.environ.get('STUDY_HUB_METRICS') == '1',  # /metrics + SQL timing
+        PROFILE_SAMPLE_RATE=0.0,        # fraction of requests run under cProfile
+        PROFILE_SLOW_MS=500,            # keep profiles of sampled requests slower than this
+        PASSWORD_HASH_METHOD='scrypt',  # werkzeug method string, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'
+        PASSWORD_HASH_WORKERS=2,        # hashing processes; 0 hashes inline on the request thread
+        PASSWORD_HASH_MAX_PENDING=32,   # queued + running hashes before answering 503
+        PASSWORD_HASH_TIMEOUT=10.0,     # seconds to wait for a hash before answering 503
+        RESPONSE_CACHE_FACTORY=None,    # callable returning a cache; default cache.MemoryCache
+        RESPONSE_CACHE_TTL=30.0,        # seconds a cached public listing may be served; 0 disables
+        RESPONSE_CACHE_MAX_BYTES=4 * 1024 * 1024,  # cached response bodies kept per process
+    )
+    if config:
+        app.config.update(config)
+    app.before_request(_ensure_schema)
+    metrics.init_app(app)
+    for rule, options, view in _views:
+        app.add_url_rule(rule, view_func=view, **options)
+    app.teardown_appcontext(close_connection)
+    app.register_error_handler(gamestore.FlushError, _games_not_saved)
+    bulk.init_app(app, get_db, on_change=_tables_changed)
+    maintenance.init_app(app, get_db, on_change=_tables_changed)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create or migrate the database schema."""
+        init_db()
+        click.echo(f"{app.config['DATABASE']}: schema version {migrations.SCHEMA_VERSION}")
+
+    @app.cli.command('rebalance-games')
+    @click.option('--from-shards', type=int, required=True, help='the GAME_SHARDS the game files were written with')
+    @click.option('--chunk-rows', type=int, default=500)
+    def rebalance_command(from_shards, chunk_rows):
+        """Move games into the current GAME_SHARDS layout (stop the app first)."""
+        init_db()
+        old = database.shard_paths(app.config['DATABASE'], from_shards)
+        new = database.shard_paths(app.config['DATABASE'], app.config['GAME_SHARDS'])
+        progress = {'scanned': 0, 'moved': 0}
+        for progress in shards.rebalance(old, new, chunk_rows, app.config['DB_PRAGMAS']):
+            click.echo(f"{progress['scanned']} scanned, {progress['moved']} moved", err=True)
+        click.echo(f"moved {progress['moved']} of {progress['scanned']} games into {len(new)} shard(s)")
+
+    if preload:
+        prepare(app)
+    return app
+
+
+def prepare(app):
+    """Do the one-time work in a pre-fork master (e.g. gunicorn --preload
+    'app:create_app(preload=True)') so forked workers inherit it.
+
+    Migrates the schema, compiles every template and closes the connections
+    used for that. gc.freeze() then moves everything built so far (templates,
+    the solved bot table, route maps) out of the collector's reach, so the
+    workers' garbage collections do not touch those pages and copy-on-write
+    keeps them shared.
+    """
+    with app.app_context():
+        init_db()
+    app.extensions.setdefault('schema_ready', set()).add(_schema_key(app))
+    database.close_pool(app)
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    gc.collect()
+    gc.freeze()
+    return app
+
+
+app = create_app()
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    prepare(app).run(debug=True)
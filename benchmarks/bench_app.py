@@ -0,0 +1,396 @@
+"""
+bench_app.py - load test for the hot Study Hub endpoints
+
+Seeds a throwaway database (never study_hub.db), then drives the app with
+concurrent workers, each logged in as its own user, across the hot endpoints:
+study search (with and without a query), dashboard, owned studies, the games
+list and bot moves. Reports throughput and p50/p99 latency per endpoint.
+
+    python benchmarks/bench_app.py --scale small --workers 8 --seconds 10
+    python benchmarks/bench_app.py --scale full --output after.json --compare before.json
+
+Results are written as JSON (commit, scale and environment included) so runs
+from two commits can be compared with --compare. Use --server to go through a
+real local WSGI server over HTTP instead of the Flask test client, and
+--no-cache to measure search/latest without the response cache,
+--group-commit to batch concurrent writes, and --game-store to play moves on
+in-memory games written behind. With STUDY_HUB_GAME_SHARDS=N the seeded games
+go to the shard file each one belongs to (shards.py).
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+SCALES = {
+    # users, studies, memberships, games
+    'tiny': (200, 2000, 10000, 1000),
+    'small': (2000, 20000, 100000, 10000),
+    'medium': (20000, 200000, 1000000, 100000),
+    'full': (100000, 1000000, 5000000, 500000),
+}
+
+WORDS = ('algebra', 'biology', 'calculus', 'chemistry', 'design', 'economics', 'french',
+         'geometry', 'history', 'java', 'kanji', 'latin', 'music', 'physics', 'python',
+         'statistics', 'spanish', 'writing', 'anatomy', 'robotics')
+
+PASSWORD = 'bench'
+CHUNK = 50000
+
+
+def seed(path, users, studies, memberships, games, rng, game_paths=None):
+    """Bulk-load rows straight into SQLite; the app's migrations create the schema first.
+
+    game_paths are the game shard files (database.shard_paths); each game goes
+    to the one shards.shard_for picks, as the app would have written it.
+    """
+    import shards
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=OFF')
+    # one cheap hash shared by every user keeps seeding and logins fast
+    pw = generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000')
+    names = [f'user{i}' for i in range(users)]
+
+    def batches(rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= CHUNK:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    for batch in batches((n, pw) for n in names):
+        db.executemany('INSERT INTO users(username,password) VALUES(?,?)', batch)
+    study_ids = []
+
+    def study_rows():
+        for i in range(studies):
+            sid = str(uuid.UUID(int=rng.getrandbits(128)))
+            study_ids.append(sid)
+            topic = ' '.join(rng.sample(WORDS, 2))
+            ts = f'2024-{1 + i % 12:02d}-{1 + i % 28:02d} {i % 24:02d}:{i % 60:02d}:{(i // 60) % 60:02d}'
+            yield (sid, rng.choice(names), topic.title(), f'Weekly {topic} group #{i}', '', int(rng.random() < 0.6), ts)
+
+    for batch in batches(study_rows()):
+        db.executemany('INSERT INTO studies(id,username,name,description,schedule,public,created_at) VALUES(?,?,?,?,?,?,?)', batch)
+
+    def member_rows():
+        for _ in range(memberships):
+            yield (rng.choice(study_ids), rng.choice(names), 'pending' if rng.random() < 0.1 else 'approved')
+
+    for batch in batches(member_rows()):
+        db.executemany('INSERT OR IGNORE INTO study_members(study_id,username,status) VALUES(?,?,?)', batch)
+
+    def game_rows():
+        for i in range(games):
+            owner = rng.choice(names)
+            yield (str(uuid.UUID(int=rng.getrandbits(128))), owner, owner, 0, 'X',
+                   rng.choice(('playing', 'X_wins', 'O_wins', 'draw')), 'bot',
+                   f'2024-{1 + i % 12:02d}-{1 + i % 28:02d} 12:00:{i % 60:02d}')
+
+    game_dbs = [db] if not game_paths or game_paths == [path] else [sqlite3.connect(p) for p in game_paths]
+    for batch in batches(game_rows()):
+        by_shard = {}
+        for row in batch:
+            by_shard.setdefault(shards.shard_for(row[0], len(game_dbs)), []).append(row)
+        for shard, rows in by_shard.items():
+            game_dbs[shard].executemany('INSERT INTO games(id,username,owner_id,cells,turn,status,opponent,created_at) '
+                                        'VALUES(?,?,?,?,?,?,?,?)', rows)
+    for conn in [db] + [c for c in game_dbs if c is not db]:
+        conn.commit()
+        conn.execute('ANALYZE')
+        conn.close()
+    return names
+
+
+class TestClientDriver:
+    """One Flask test client (own cookie jar) per worker."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, json_body=None):
+        rv = self.client.open(path, method=method, data=data, json=json_body)
+        return rv.status_code, rv.get_json(silent=True)
+
+
+class HttpDriver:
+    """Same interface over real HTTP against a local WSGI server."""
+
+    def __init__(self, base):
+        self.base = base
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, data=None, json_body=None):
+        body, headers = None, {}
+        if json_body is not None:
+            body, headers = json.dumps(json_body).encode(), {'Content-Type': 'application/json'}
+        elif data is not None:
+            body = urllib.parse.urlencode(data).encode()
+        req = urllib.request.Request(self.base + path, data=body, method=method, headers=headers)
+        try:
+            with self.opener.open(req) as resp:
+                raw = resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            raw, status = e.read(), e.code
+        try:
+            return status, json.loads(raw)
+        except ValueError:
+            return status, None
+
+
+class Worker:
+    def __init__(self, driver, username, rng):
+        self.driver = driver
+        self.rng = rng
+        self.game = None
+        status, _ = driver.request('POST', '/login', data={'username': username, 'password': PASSWORD})
+        if status >= 400:
+            raise RuntimeError(f'login failed for {username}: {status}')
+
+    def search(self):
+        q = self.rng.choice(WORDS)[:self.rng.randint(3, 6)]
+        return self.driver.request('GET', f'/api/studies/search?q={q}')[0]
+
+    def latest(self):
+        return self.driver.request('GET', '/api/studies/search')[0]
+
+    def dashboard(self):
+        return self.driver.request('GET', '/dashboard')[0]
+
+    def owned_studies(self):
+        return self.driver.request('GET', '/api/owned_studies')[0]
+
+    def games(self):
+        return self.driver.request('GET', '/api/games')[0]
+
+    def move(self):
+        if self.game is None:
+            status, j = self.driver.request('POST', '/api/games', json_body={'opponent': 'bot'})
+            if status != 200:
+                return status
+            self.game = (j['id'], j['game']['board'])
+        gid, cells = self.game
+        free = [i for i, v in enumerate(cells) if not v]
+        status, j = self.driver.request('POST', f'/api/games/{gid}/move', json_body={'pos': self.rng.choice(free)})
+        if status != 200 or j['game']['status'] != 'playing':
+            self.game = None
+        else:
+            self.game = (gid, j['game']['board'])
+        return status
+
+
+ENDPOINTS = ('search', 'latest', 'dashboard', 'owned_studies', 'games', 'move')
+
+
+def run(workers, seconds, mix, seed_value):
+    deadline = time.perf_counter() + seconds
+    samples = {name: [] for name in mix}
+    errors = {name: 0 for name in mix}
+    lock = threading.Lock()
+
+    def loop(index, worker):
+        rng = random.Random(seed_value + index)
+        local = {name: [] for name in mix}
+        local_errors = {name: 0 for name in mix}
+        while time.perf_counter() < deadline:
+            name = rng.choice(mix)
+            start = time.perf_counter()
+            status = getattr(worker, name)()
+            local[name].append(time.perf_counter() - start)
+            if status >= 400:
+                local_errors[name] += 1
+        with lock:
+            for name in mix:
+                samples[name].extend(local[name])
+                errors[name] += local_errors[name]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+        list(pool.map(lambda iw: loop(*iw), enumerate(workers)))
+    elapsed = time.perf_counter() - started
+    return samples, errors, elapsed
+
+
+def percentile(sorted_samples, p):
+    if not sorted_samples:
+        return None
+    k = min(len(sorted_samples) - 1, int(round(p / 100.0 * (len(sorted_samples) - 1))))
+    return sorted_samples[k]
+
+
+def report(samples, errors, elapsed):
+    results = {}
+    for name, values in samples.items():
+        values.sort()
+        results[name] = {
+            'requests': len(values),
+            'errors': errors[name],
+            'rps': round(len(values) / elapsed, 1),
+            'p50_ms': round(percentile(values, 50) * 1000, 3) if values else None,
+            'p99_ms': round(percentile(values, 99) * 1000, 3) if values else None,
+        }
+    total = sum(len(v) for v in samples.values())
+    results['_total'] = {'requests': total, 'errors': sum(errors.values()), 'rps': round(total / elapsed, 1)}
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results, previous=None):
+    print(f'{"endpoint":<14} {"requests":>9} {"errors":>7} {"rps":>9} {"p50 ms":>9} {"p99 ms":>9}')
+    for name, r in results.items():
+        if name == '_total':
+            continue
+        line = f'{name:<14} {r["requests"]:>9} {r["errors"]:>7} {r["rps"]:>9} {r["p50_ms"] or 0:>9} {r["p99_ms"] or 0:>9}'
+        old = (previous or {}).get(name)
+        if old and old.get('p50_ms') and r['p50_ms']:
+            line += f'   p50 {100.0 * (r["p50_ms"] - old["p50_ms"]) / old["p50_ms"]:+.1f}%'
+            line += f'  rps {100.0 * (r["rps"] - old["rps"]) / old["rps"]:+.1f}%' if old.get('rps') else ''
+        print(line)
+    t = results['_total']
+    print(f'{"total":<14} {t["requests"]:>9} {t["errors"]:>7} {t["rps"]:>9}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='tiny')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='comma-separated subset of ' + ','.join(ENDPOINTS))
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--db', help='database file to create (default: a temp file)')
+    parser.add_argument('--server', action='store_true', help='go through a threaded local WSGI server')
+    parser.add_argument('--output', help='write JSON results here')
+    parser.add_argument('--compare', help='JSON results of an earlier run to diff against')
+    parser.add_argument('--no-cache', action='store_true', help='disable the response cache (RESPONSE_CACHE_TTL=0)')
+    parser.add_argument('--group-commit', action='store_true', help='batch concurrent writes (DB_GROUP_COMMIT=True)')
+    parser.add_argument('--game-store', action='store_true', help='write-behind store of playing games (GAME_STORE=True)')
+    args = parser.parse_args(argv)
+
+    mix = tuple(e for e in args.endpoints.split(',') if e)
+    unknown = set(mix) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f'unknown endpoints: {", ".join(sorted(unknown))}')
+
+    tmpdir = None
+    path = args.db
+    if path is None:
+        tmpdir = tempfile.TemporaryDirectory(prefix='studyhub-bench-')
+        path = os.path.join(tmpdir.name, 'bench.db')
+
+    from app import app, init_db
+    import database
+    import gamestore
+    database.close_pool(app)
+    app.extensions.pop('cache', None)
+    app.config.update(DATABASE=path, DB_POOL_SIZE=max(args.workers, 8))
+    if args.no_cache:
+        app.config['RESPONSE_CACHE_TTL'] = 0
+    app.config['DB_GROUP_COMMIT'] = args.group_commit
+    app.config['GAME_STORE'] = args.game_store
+    with app.app_context():
+        init_db()
+    database.close_pool(app)
+
+    rng = random.Random(args.seed)
+    users, studies, memberships, games = SCALES[args.scale]
+    t0 = time.perf_counter()
+    names = seed(path, users, studies, memberships, games, rng,
+                 database.shard_paths(path, app.config['GAME_SHARDS']))
+    seed_seconds = time.perf_counter() - t0
+    print(f'seeded {args.scale}: {users} users, {studies} studies, {memberships} memberships, '
+          f'{games} games in {seed_seconds:.1f}s')
+
+    server = None
+    if args.server:
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{server.server_port}'
+        make_driver = lambda: HttpDriver(base)  # noqa: E731
+    else:
+        make_driver = lambda: TestClientDriver(app)  # noqa: E731
+
+    try:
+        worker_rng = random.Random(args.seed)
+        workers = [Worker(make_driver(), name, random.Random(args.seed + i))
+                   for i, name in enumerate(worker_rng.sample(names, args.workers))]
+        samples, errors, elapsed = run(workers, args.seconds, mix, args.seed)
+    finally:
+        if server is not None:
+            server.shutdown()
+        gamestore.close_store(app)
+        database.close_pool(app)
+        app.extensions.pop('cache', None)
+
+    results = report(samples, errors, elapsed)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+    print_table(results, previous)
+
+    if args.output:
+        doc = {
+            'meta': {
+                'commit': git_commit(),
+                'scale': args.scale,
+                'rows': {'users': users, 'studies': studies, 'memberships': memberships, 'games': games},
+                'workers': args.workers,
+                'seconds': args.seconds,
+                'driver': 'http' if args.server else 'test_client',
+                'response_cache': not args.no_cache,
+                'group_commit': args.group_commit,
+                'game_store': args.game_store,
+                'game_shards': app.config['GAME_SHARDS'],
+                'seed': args.seed,
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'platform': platform.platform(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            },
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(doc, f, indent=2, sort_keys=True)
+        print(f'wrote {args.output}')
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+bench_bot.py - per-move latency of the tic-tac-toe bot, before and after
+
+"before" is the exhaustive minimax that used to run inside api_move on every
+bot reply; "after" is the table lookup in bot.py. Both are timed on every
+reachable position where the bot (O) is to move, grouped by stones on board.
+
+Larger boards have no table; for those the search in engine.py is timed from a
+few opening positions, reporting the depth it completed within --budget.
+
+    python benchmarks/bench_bot.py [--repeat N] [--budget SECONDS]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+t0 = time.perf_counter()
+import board  # noqa: E402
+import bot  # noqa: E402  (import time is the table build)
+BUILD_SECONDS = time.perf_counter() - t0
+import engine  # noqa: E402
+
+MNK_BOARDS = ((4, 4, 4), (7, 7, 4), (15, 15, 5))
+
+
+def legacy_minimax(board, bot_player):
+    """The search api_move ran before bot.py existed, kept verbatim for comparison."""
+    def check_winner(board_state):
+        lines = [(0,1,2),(3,4,5),(6,7,8),(0,3,6),(1,4,7),(2,5,8),(0,4,8),(2,4,6)]
+        for i,j,k in lines:
+            if board_state[i] and board_state[i] == board_state[j] == board_state[k]:
+                return board_state[i]
+        if all(board_state):
+            return 'draw'
+        return None
+
+    def minimax(board, player):
+        winner = check_winner(board)
+        if winner == bot_player:
+            return {'score': 1}
+        elif winner == ('draw'):
+            return {'score': 0}
+        elif winner is not None:
+            return {'score': -1}
+
+        moves = []
+        for i in range(9):
+            if board[i] == '':
+                move = {}
+                board[i] = player
+                next_player = 'O' if player == 'X' else 'X'
+                result = minimax(board, next_player)
+                move['index'] = i
+                move['score'] = result['score']
+                board[i] = ''
+                moves.append(move)
+
+        if player == bot_player:
+            best = max(moves, key=lambda m: m['score'])
+        else:
+            best = min(moves, key=lambda m: m['score'])
+        return best
+
+    empties = [i for i,v in enumerate(board) if v=='']
+    if len(empties) == 9 and bot_player == 'X':
+        return 4
+    return minimax(board, bot_player).get('index')
+
+
+def bot_positions():
+    """Every distinct non-terminal board reachable with X first and O to move, as lists."""
+    seen = set()
+    out = []
+
+    def walk(grid, player):
+        key = tuple(grid)
+        if key in seen or board.winner(board.from_list(grid)) is not None:
+            return
+        seen.add(key)
+        if player == 'O':
+            out.append(list(grid))
+        for i in range(9):
+            if not grid[i]:
+                grid[i] = player
+                walk(grid, bot.other(player))
+                grid[i] = ''
+
+    walk([''] * 9, 'X')
+    return out
+
+
+def time_moves(fn, positions, repeat):
+    samples = []
+    for position in positions:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn(position, 'O')
+        samples.append((time.perf_counter() - start) / repeat)
+    return samples
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    n = len(samples)
+    return {
+        'mean_us': sum(samples) / n * 1e6,
+        'p50_us': samples[n // 2] * 1e6,
+        'max_us': samples[-1] * 1e6,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help='timed calls per position')
+    parser.add_argument('--budget', type=float, default=0.5, help='search seconds per move on m,n,k boards')
+    args = parser.parse_args(argv)
+
+    positions = bot_positions()
+    by_stones = {}
+    for grid in positions:
+        by_stones.setdefault(9 - grid.count(''), []).append(grid)
+
+    print(f'table build: {BUILD_SECONDS * 1000:.1f} ms, {bot.POSITIONS} canonical positions')
+    print(f'{"stones":>6} {"boards":>6} {"minimax mean":>14} {"minimax max":>13} {"table mean":>12} {"table max":>11}')
+    for stones in sorted(by_stones):
+        group = by_stones[stones]
+        before = summarize(time_moves(legacy_minimax, group, args.repeat))
+        # the legacy search took list boards; the table takes packed ints (board.py)
+        after = summarize(time_moves(bot.best_move, [board.from_list(g) for g in group], args.repeat))
+        print(f'{stones:>6} {len(group):>6} {before["mean_us"]:>12.1f}us {before["max_us"]:>11.1f}us '
+              f'{after["mean_us"]:>10.2f}us {after["max_us"]:>9.2f}us')
+
+    print()
+    print(f'{"board":>10} {"stones":>6} {"depth":>5} {"nodes":>8} {"ms":>8}')
+    for rows, cols, k in MNK_BOARDS:
+        geom = board.geometry(rows, cols, k)
+        center = (rows // 2) * cols + cols // 2
+        cells = geom.play(0, center, 'X')
+        player = 'O'
+        for _ in range(4):  # a few plies of self-play from the center opening
+            search = engine.Search(geom, args.budget)
+            start = time.perf_counter()
+            mv = search.best_move(cells, player)
+            ms = (time.perf_counter() - start) * 1000
+            stones = geom.occupied(cells).bit_count()
+            print(f'{f"{rows}x{cols}k{k}":>10} {stones:>6} {search.depth:>5} {search.nodes:>8} {ms:>8.1f}')
+            if mv is None:
+                break
+            cells = geom.play(cells, mv, player)
+            player = bot.other(player)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+selfplay.py - bot self-play and evaluation across all cores
+
+Plays many games without the web app: bot against bot, bot against a random
+player, or both, using the same move rules (bot.apply_move) and bot replies
+(bot.reply) as POST /api/games/<id>/move. Games are split into chunks that a
+process pool plays in parallel; aggregate win/draw/loss counts and bot move
+timings are printed as chunks finish, and the totals at the end.
+
+    python benchmarks/selfplay.py --games 1000000 --seed 7
+    python benchmarks/selfplay.py --board 7x7k4 --games 2000 --depth 3 --output after.json --compare before.json
+
+Game i is played from its own random.Random seeded with (seed, i), so the
+games do not depend on --workers or --chunk. Every game's moves feed an
+order-independent digest: two runs with the same seed and the same bot play
+identical games exactly when their digests match, which makes a speed-only
+bot change checkable. On 3x3 the bot is a lookup and fully reproducible;
+larger boards are searched, and only a fixed --depth (which lifts the time
+budget) makes that search independent of machine speed.
+
+The first --opening plies of every bot-bot game are random for both sides,
+so it does not replay one game over and over. The run exits with
+status 1 when a bot made an illegal move or, on 3x3, lost a game.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import board  # noqa: E402
+import bot  # noqa: E402
+
+MATCHUPS = ('bot-bot', 'bot-random', 'random-bot')
+OUTCOMES = ('win', 'draw', 'loss', 'illegal')
+# bot move time buckets, microseconds; the last bucket is everything slower
+MOVE_BUCKETS_US = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000,
+                   20000, 50000, 100000, 200000, 500000, 1000000)
+
+
+def parse_board(text):
+    """'7x7k4' -> (7, 7, 4); 'RxC' means k = min(R, C)."""
+    size, _, k = text.lower().partition('k')
+    rows, cols = (int(n) for n in size.split('x'))
+    return rows, cols, int(k) if k else min(rows, cols)
+
+
+def _empty_stats():
+    return {'games': 0, 'plies': 0, **{o: 0 for o in OUTCOMES},
+            'moves': 0, 'move_seconds': 0.0, 'move_max_us': 0.0,
+            'move_buckets': [0] * (len(MOVE_BUCKETS_US) + 1)}
+
+
+def _observe(stats, seconds):
+    us = seconds * 1e6
+    i = 0
+    while i < len(MOVE_BUCKETS_US) and us > MOVE_BUCKETS_US[i]:
+        i += 1
+    stats['move_buckets'][i] += 1
+    stats['moves'] += 1
+    stats['move_seconds'] += seconds
+    stats['move_max_us'] = max(stats['move_max_us'], us)
+
+
+def play_game(geom, matchup, rng, opening=0, budget=0.5, depth=None, stats=None):
+    """Play one game; return (outcome for the bot side, status, moves).
+
+    The bot side is X unless X is the random player; in bot-bot the outcome
+    is X's. A bot move that is missing or illegal ends the game as 'illegal'.
+    """
+    kinds = dict(zip('XO', matchup.split('-')))
+    side = 'X' if kinds['X'] == 'bot' else 'O'
+    opening = opening if matchup == 'bot-bot' else 0
+    cells, turn, status, moves = 0, 'X', 'playing', []
+    while status == 'playing':
+        if kinds[turn] == 'random' or len(moves) < opening:
+            pos = rng.choice([i for i in range(geom.size) if geom.is_free(cells, i)])
+        else:
+            start = time.perf_counter()
+            pos = bot.reply(geom, cells, turn, budget, depth)
+            if stats is not None:
+                _observe(stats, time.perf_counter() - start)
+            if pos is None or not geom.is_free(cells, pos):
+                return 'illegal', f'{turn}_illegal', moves
+        moves.append(pos)
+        cells, turn, status = bot.apply_move(geom, cells, pos, turn)
+    if status == 'draw':
+        return 'draw', status, moves
+    return ('win' if status == f'{side}_wins' else 'loss'), status, moves
+
+
+def play_chunk(dims, matchups, seed, start, stop, opening, budget, depth):
+    """Play games start..stop-1 (run in a pool worker); return per-matchup stats and a digest."""
+    geom = board.geometry(*dims)
+    results = {m: _empty_stats() for m in matchups}
+    digest = 0
+    for i in range(start, stop):
+        matchup = matchups[i % len(matchups)]
+        stats = results[matchup]
+        outcome, status, moves = play_game(geom, matchup, random.Random(f'{seed}:{i}'),
+                                           opening, budget, depth, stats)
+        stats['games'] += 1
+        stats['plies'] += len(moves)
+        stats[outcome] += 1
+        record = f'{i}:{matchup}:{status}:{",".join(map(str, moves))}'.encode()
+        digest ^= int.from_bytes(hashlib.blake2b(record, digest_size=8).digest(), 'big')
+    return results, digest
+
+
+def merge(total, part):
+    for matchup, stats in part.items():
+        into = total.setdefault(matchup, _empty_stats())
+        for key, value in stats.items():
+            if key == 'move_buckets':
+                into[key] = [a + b for a, b in zip(into[key], value)]
+            elif key == 'move_max_us':
+                into[key] = max(into[key], value)
+            else:
+                into[key] += value
+
+
+def percentile_us(buckets, q):
+    """Upper bound of the bucket holding the q-th percentile move (None past the last bound)."""
+    count = sum(buckets)
+    if not count:
+        return None
+    rank = q / 100.0 * count
+    seen = 0
+    for bound, n in zip(MOVE_BUCKETS_US + (None,), buckets):
+        seen += n
+        if seen >= rank:
+            return bound
+    return None
+
+
+def summarize(results):
+    out = {}
+    for matchup, s in results.items():
+        games = s['games'] or 1
+        out[matchup] = {
+            'games': s['games'],
+            **{o: s[o] for o in OUTCOMES},
+            'win_rate': round(s['win'] / games, 4),
+            'draw_rate': round(s['draw'] / games, 4),
+            'loss_rate': round(s['loss'] / games, 4),
+            'plies_per_game': round(s['plies'] / games, 2),
+            'bot_moves': s['moves'],
+            'move_mean_us': round(s['move_seconds'] / s['moves'] * 1e6, 2) if s['moves'] else None,
+            'move_p50_us': percentile_us(s['move_buckets'], 50),
+            'move_p99_us': percentile_us(s['move_buckets'], 99),
+            'move_max_us': round(s['move_max_us'], 1),
+        }
+    return out
+
+
+def print_table(summary, previous=None):
+    print(f'{"matchup":<11} {"games":>9} {"win":>7} {"draw":>7} {"loss":>7} {"illegal":>7} '
+          f'{"mean us":>9} {"p50 us":>8} {"p99 us":>8} {"max us":>9}')
+    for matchup, r in summary.items():
+        line = (f'{matchup:<11} {r["games"]:>9} {r["win_rate"]:>7.4f} {r["draw_rate"]:>7.4f} {r["loss_rate"]:>7.4f} '
+                f'{r["illegal"]:>7} {r["move_mean_us"] or 0:>9} {r["move_p50_us"] or "-":>8} '
+                f'{r["move_p99_us"] or "-":>8} {r["move_max_us"]:>9}')
+        old = (previous or {}).get(matchup)
+        if old and old.get('move_mean_us') and r['move_mean_us']:
+            line += f'   mean {100.0 * (r["move_mean_us"] - old["move_mean_us"]) / old["move_mean_us"]:+.1f}%'
+        print(line)
+
+
+def progress_line(done, games, results, elapsed):
+    parts = [f'{done}/{games} games', f'{done / elapsed:.0f}/s' if elapsed else '']
+    for matchup, s in results.items():
+        n = s['games'] or 1
+        line = f'{matchup} W{s["win"] / n:.3f} D{s["draw"] / n:.3f} L{s["loss"] / n:.3f}'
+        if s['illegal']:
+            line += f' illegal {s["illegal"]}'
+        if s['moves']:
+            line += f' move {s["move_seconds"] / s["moves"] * 1e6:.1f}us max {s["move_max_us"]:.0f}us'
+        parts.append(line)
+    return '  '.join(p for p in parts if p)
+
+
+def run(dims, matchups, games, seed, workers, chunk, opening, budget, depth, report_every=1.0, out=print):
+    """Play all games; return (per-matchup stats, digest hex, elapsed seconds)."""
+    spans = [(start, min(start + chunk, games)) for start in range(0, games, chunk)]
+    args = (dims, matchups, seed)
+    results, digest = {}, 0
+    t0 = last = time.perf_counter()
+    done = 0
+
+    def collect(part, span):
+        nonlocal digest, done, last
+        merge(results, part[0])
+        digest ^= part[1]
+        done += span[1] - span[0]
+        now = time.perf_counter()
+        if now - last >= report_every or done == games:
+            last = now
+            out(progress_line(done, games, results, now - t0))
+
+    if not workers:
+        for span in spans:
+            collect(play_chunk(*args, *span, opening, budget, depth), span)
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = {pool.submit(play_chunk, *args, *span, opening, budget, depth): span for span in spans}
+            for future in as_completed(futures):
+                collect(future.result(), futures[future])
+    return results, f'{digest:016x}', time.perf_counter() - t0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--board', default='3x3k3', help='ROWSxCOLSkK, e.g. 7x7k4')
+    parser.add_argument('--matchups', default=','.join(MATCHUPS), help='comma-separated subset of ' + ','.join(MATCHUPS))
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='processes; 0 plays inline')
+    parser.add_argument('--chunk', type=int, default=2000, help='games per pool task')
+    parser.add_argument('--opening', type=int, default=2, help='random plies at the start of every bot-bot game')
+    parser.add_argument('--budget', type=float, default=0.05, help='search seconds per bot move on m,n,k boards')
+    parser.add_argument('--depth', type=int, help='fixed search depth on m,n,k boards (no time budget)')
+    parser.add_argument('--report-every', type=float, default=1.0, help='seconds between progress lines')
+    parser.add_argument('--output', help='write JSON results here')
+    parser.add_argument('--compare', help='JSON results of an earlier run to diff against')
+    args = parser.parse_args(argv)
+
+    matchups = tuple(m for m in args.matchups.split(',') if m)
+    unknown = set(matchups) - set(MATCHUPS)
+    if unknown:
+        parser.error(f'unknown matchups: {", ".join(sorted(unknown))}')
+    try:
+        dims = parse_board(args.board)
+    except ValueError:
+        parser.error(f'bad --board {args.board!r}, expected e.g. 3x3k3')
+    classic = dims == (3, 3, 3)
+    budget = None if args.depth else args.budget
+
+    print(f'{args.games} games on {"x".join(map(str, dims[:2]))}k{dims[2]}, {", ".join(matchups)}, '
+          f'seed {args.seed}, {args.workers or "no"} worker processes')
+    results, digest, elapsed = run(dims, matchups, args.games, args.seed, args.workers, max(1, args.chunk),
+                                   args.opening, budget, args.depth, args.report_every)
+    summary = summarize({m: results[m] for m in matchups if m in results})
+    previous = previous_digest = None
+    if args.compare:
+        with open(args.compare) as f:
+            doc = json.load(f)
+        previous, previous_digest = doc['results'], doc['meta'].get('digest')
+    print_table(summary, previous)
+    print(f'digest {digest}' + (f' ({"same games" if previous_digest == digest else "games differ"} '
+                                f'from {args.compare})' if previous_digest else '')
+          + f', {args.games / elapsed:.0f} games/s')
+
+    if args.output:
+        doc = {
+            'meta': {
+                'board': list(dims),
+                'matchups': list(matchups),
+                'games': args.games,
+                'seed': args.seed,
+                'opening': args.opening,
+                'budget': budget,
+                'depth': args.depth,
+                'reproducible': classic or bool(args.depth),
+                'digest': digest,
+                'workers': args.workers,
+                'seconds': round(elapsed, 3),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            },
+            'results': summary,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(doc, f, indent=2, sort_keys=True)
+        print(f'wrote {args.output}')
+
+    bad = sum(r['illegal'] for r in summary.values()) + (sum(r['loss'] for m, r in summary.items()
+                                                              if m != 'bot-bot') if classic else 0)
+    return 1 if bad else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
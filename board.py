@@ -0,0 +1,179 @@
+"""
+board.py - compact board representation
+
+A board is a single int: bits 0-8 are the cells held by X and bits 9-17 the
+cells held by O (cell i is row i // 3, column i % 3). That is what the games
+table stores in its `cells` column, and win/draw detection and move validation
+are a couple of bit operations on it.
+
+The JSON API keeps its original shape: to_list() turns a board back into the
+9-element list of 'X', 'O' and '' the frontend expects.
+
+Geometry generalizes this to m,n,k games (rows x cols, k in a row wins) with
+the same packing: X in bits 0..size-1, O in the next size bits, so a 3x3x3
+Geometry reads and writes exactly the boards above. Wins are detected
+incrementally from the lines through the last move. Boards wider than 63 bits
+do not fit an SQLite INTEGER and are stored as blobs (to_db / from_db).
+"""
+
+from functools import lru_cache
+
+SIZE = 9
+FULL = (1 << SIZE) - 1
+EMPTY = 0
+
+LINES = ((0, 1, 2), (3, 4, 5), (6, 7, 8),
+         (0, 3, 6), (1, 4, 7), (2, 5, 8),
+         (0, 4, 8), (2, 4, 6))
+
+WIN_MASKS = tuple(sum(1 << i for i in line) for line in LINES)
+
+# WINS[mask] is True when the 9-bit mask contains a full line
+WINS = tuple(any(mask & w == w for w in WIN_MASKS) for mask in range(1 << SIZE))
+
+
+def x_mask(cells):
+    return cells & FULL
+
+
+def o_mask(cells):
+    return cells >> SIZE
+
+
+def occupied(cells):
+    return (cells | cells >> SIZE) & FULL
+
+
+def is_free(cells, pos):
+    return not (occupied(cells) >> pos) & 1
+
+
+def play(cells, pos, player):
+    return cells | (1 << (pos if player == 'X' else pos + SIZE))
+
+
+def winner(cells):
+    """Return 'X' or 'O' for a completed line, 'draw' for a full board, else None."""
+    if WINS[cells & FULL]:
+        return 'X'
+    if WINS[cells >> SIZE]:
+        return 'O'
+    if occupied(cells) == FULL:
+        return 'draw'
+    return None
+
+
+def to_list(cells):
+    x, o = cells & FULL, cells >> SIZE
+    return ['X' if x >> i & 1 else 'O' if o >> i & 1 else '' for i in range(SIZE)]
+
+
+def from_list(board):
+    cells = 0
+    for i, v in enumerate(board):
+        if v == 'X':
+            cells |= 1 << i
+        elif v == 'O':
+            cells |= 1 << (i + SIZE)
+    return cells
+
+
+def from_text(s):
+    """Parse the legacy comma-joined board column ('X,,O,...')."""
+    if not s:
+        return EMPTY
+    return from_list(s.split(','))
+
+
+class Geometry:
+    """An m,n,k board: rows x cols cells, k in a row (any direction) wins."""
+
+    def __init__(self, rows=3, cols=3, k=3):
+        self.rows, self.cols, self.k = rows, cols, k
+        self.size = rows * cols
+        self.full = (1 << self.size) - 1
+        lines = []
+        for r in range(rows):
+            for c in range(cols):
+                for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    end_r, end_c = r + dr * (k - 1), c + dc * (k - 1)
+                    if 0 <= end_r < rows and 0 <= end_c < cols:
+                        lines.append(sum(1 << ((r + dr * i) * cols + c + dc * i) for i in range(k)))
+        self.lines = tuple(lines)
+        # lines_through[pos]: the winning lines a stone on pos takes part in
+        self.lines_through = tuple(tuple(w for w in lines if w >> pos & 1) for pos in range(self.size))
+
+    def __repr__(self):
+        return f'Geometry({self.rows}, {self.cols}, {self.k})'
+
+    def x_mask(self, cells):
+        return cells & self.full
+
+    def o_mask(self, cells):
+        return cells >> self.size
+
+    def occupied(self, cells):
+        return (cells | cells >> self.size) & self.full
+
+    def is_free(self, cells, pos):
+        return 0 <= pos < self.size and not (self.occupied(cells) >> pos) & 1
+
+    def play(self, cells, pos, player):
+        return cells | (1 << (pos if player == 'X' else pos + self.size))
+
+    def wins_at(self, mask, pos):
+        """True when mask (one player's stones) has a full line through pos."""
+        return any(mask & w == w for w in self.lines_through[pos])
+
+    def result_after(self, cells, pos, player):
+        """winner() for a board whose last move was player on pos: only lines through pos are checked."""
+        mask = self.x_mask(cells) if player == 'X' else self.o_mask(cells)
+        if self.wins_at(mask, pos):
+            return player
+        if self.occupied(cells) == self.full:
+            return 'draw'
+        return None
+
+    def winner(self, cells):
+        x, o = self.x_mask(cells), self.o_mask(cells)
+        for w in self.lines:
+            if x & w == w:
+                return 'X'
+            if o & w == w:
+                return 'O'
+        if (x | o) == self.full:
+            return 'draw'
+        return None
+
+    def to_list(self, cells):
+        x, o = self.x_mask(cells), self.o_mask(cells)
+        return ['X' if x >> i & 1 else 'O' if o >> i & 1 else '' for i in range(self.size)]
+
+    def from_list(self, board):
+        cells = 0
+        for i, v in enumerate(board):
+            if v == 'X':
+                cells |= 1 << i
+            elif v == 'O':
+                cells |= 1 << (i + self.size)
+        return cells
+
+
+@lru_cache(maxsize=64)
+def geometry(rows=3, cols=3, k=3):
+    return Geometry(rows, cols, k)
+
+
+CLASSIC = geometry(3, 3, 3)
+
+
+def to_db(cells):
+    if cells < 1 << 63:
+        return cells
+    return cells.to_bytes((cells.bit_length() + 7) // 8, 'big')
+
+
+def from_db(value):
+    if isinstance(value, bytes):
+        return int.from_bytes(value, 'big')
+    return value
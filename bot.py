@@ -0,0 +1,145 @@
+"""
+bot.py - Tic-tac-toe bot engine
+
+The bot plays from a perfect-play table that is solved once, when the module is
+imported. Positions are folded by the 8 symmetries of the board, so the solver
+only visits one position per equivalence class, and a bot reply is a constant
+time lookup instead of a fresh minimax search on the request thread.
+
+Boards are the packed ints from board.py. Other board sizes have no table;
+reply() hands them to the search in engine.py.
+"""
+
+import board
+import engine
+
+# Tie-break between equally good moves: center, then corners, then edges.
+# Each class maps onto itself under every symmetry, so the choice made in the
+# canonical frame is still the preferred one after mapping it back.
+PREFERENCE = (4, 0, 2, 6, 8, 1, 3, 5, 7)
+
+_PLAYERS = ('X', 'O')
+
+
+def _symmetries():
+    transforms = (
+        lambda r, c: (r, c),
+        lambda r, c: (c, 2 - r),
+        lambda r, c: (2 - r, 2 - c),
+        lambda r, c: (2 - c, r),
+        lambda r, c: (r, 2 - c),
+        lambda r, c: (2 - r, c),
+        lambda r, c: (c, r),
+        lambda r, c: (2 - c, 2 - r),
+    )
+    perms = []
+    for t in transforms:
+        # perm[i] is the source cell that lands on cell i after the transform
+        perm = [0] * 9
+        for i in range(9):
+            r, c = t(*divmod(i, 3))
+            perm[r * 3 + c] = i
+        perms.append(tuple(perm))
+    return tuple(perms)
+
+
+SYMMETRIES = _symmetries()
+
+# _PERMUTED[s][mask] is the 9-bit mask moved through symmetry s
+_PERMUTED = tuple(
+    tuple(sum(1 << i for i in range(9) if mask >> perm[i] & 1) for mask in range(1 << 9))
+    for perm in SYMMETRIES
+)
+_SYM = tuple(zip(_PERMUTED, SYMMETRIES))
+
+
+def other(player):
+    return 'O' if player == 'X' else 'X'
+
+
+def _canonical(cells):
+    """Return (cells, perm) for the smallest packed board among the 8 symmetric ones."""
+    x, o = board.x_mask(cells), board.o_mask(cells)
+    best = None
+    for table, perm in _SYM:
+        code = table[x] | table[o] << board.SIZE
+        if best is None or code < best[0]:
+            best = (code, perm)
+    return best
+
+
+def _slot(cells, player):
+    return cells * 2 + (player == 'O')
+
+
+# (canonical board, side to move) -> best move index in the canonical frame
+_TABLE = {}
+
+
+def _solve(cells, player, scores):
+    """Negamax over canonical positions; fills _TABLE and returns the score for player.
+
+    Wins score higher the sooner they happen, so the bot finishes games instead
+    of wandering and delays a forced loss as long as possible.
+    """
+    canon, _ = _canonical(cells)
+    key = _slot(canon, player)
+    if key in scores:
+        return scores[key]
+    taken = board.occupied(canon)
+    best_score, best_move = None, None
+    for mv in PREFERENCE:
+        if taken >> mv & 1:
+            continue
+        child = board.play(canon, mv, player)
+        result = board.winner(child)
+        if result == player:
+            score = board.SIZE - board.occupied(child).bit_count() + 1
+        elif result == 'draw':
+            score = 0
+        else:
+            score = -_solve(child, other(player), scores)
+        if best_score is None or score > best_score:
+            best_score, best_move = score, mv
+    _TABLE[key] = best_move
+    scores[key] = best_score
+    return best_score
+
+
+def _build():
+    scores = {}
+    for player in _PLAYERS:
+        _solve(board.EMPTY, player, scores)
+    return len(scores)
+
+
+POSITIONS = _build()
+
+
+def best_move(cells, player):
+    """Return the perfect-play cell index for player, or None if the game is over."""
+    if board.winner(cells) is not None:
+        return None
+    canon, perm = _canonical(cells)
+    mv = _TABLE.get(_slot(canon, player))
+    if mv is None:
+        return None
+    return perm[mv]
+
+
+def reply(geom, cells, player, budget=0.5, max_depth=None):
+    """Bot move for any board geometry: table lookup on 3x3, timed search otherwise."""
+    if (geom.rows, geom.cols, geom.k) == (3, 3, 3):
+        return best_move(cells, player)
+    return engine.best_move(geom, cells, player, budget, max_depth)
+
+
+def apply_move(geom, cells, pos, player):
+    """Return (cells, next turn, status) after player takes pos."""
+    cells = geom.play(cells, pos, player)
+    winner = geom.result_after(cells, pos, player)
+    if winner == 'draw':
+        return cells, player, 'draw'
+    if winner:
+        return cells, player, f'{winner}_wins'
+    return cells, other(player), 'playing'
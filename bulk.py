@@ -0,0 +1,293 @@
+"""
+bulk.py - streaming bulk import/export of studies and memberships
+
+Rows are read from NDJSON (one object per line) or CSV (header row) a line at
+a time, validated, and written with executemany in chunks of BULK_CHUNK_SIZE
+rows, one transaction per chunk. Exports walk a cursor and yield one line per
+row. Nothing holds more than one chunk, so memory stays flat whatever the file
+size.
+
+Admin endpoints:
+    POST /admin/import/<kind>?format=ndjson|csv   body: the file
+    GET  /admin/export/<kind>?format=ndjson|csv
+where kind is 'studies' or 'members'. Imports answer with NDJSON progress
+lines, one per committed chunk, then a final summary with per-row errors.
+
+The same code is exposed as Flask CLI commands:
+    flask --app app import-data studies schools.csv
+    flask --app app export-data members --format ndjson -o members.ndjson
+"""
+
+import csv
+import io
+import itertools
+import json
+import sys
+import uuid
+
+import click
+from flask import Response, jsonify, request, session, stream_with_context
+
+import database
+
+MAX_REPORTED_ERRORS = 100   # per-row errors listed in a summary; the rest are only counted
+
+FIELDS = {
+    'studies': ('id', 'username', 'name', 'description', 'schedule', 'public', 'created_at'),
+    'members': ('study_id', 'username', 'status', 'joined_at'),
+}
+
+_INSERT = {
+    'studies': 'INSERT OR IGNORE INTO studies(id,username,name,description,schedule,public,created_at) '
+               'VALUES(?,?,?,?,?,?,COALESCE(?,CURRENT_TIMESTAMP))',
+    'members': 'INSERT OR IGNORE INTO study_members(study_id,username,status,joined_at) '
+               'VALUES(?,?,?,COALESCE(?,CURRENT_TIMESTAMP))',
+}
+
+_EXPORT = {
+    'studies': 'SELECT id,username,name,description,schedule,public,created_at FROM studies ORDER BY rowid',
+    'members': 'SELECT study_id,username,status,joined_at FROM study_members ORDER BY study_id, username',
+}
+
+
+def _text(value):
+    return None if value is None else str(value).strip()
+
+
+def _flag(value):
+    if isinstance(value, bool):
+        return int(value)
+    return 1 if _text(value).lower() in ('1', 'true', 'yes', 'on') else 0
+
+
+def _study_row(row):
+    name = _text(row.get('name'))
+    username = _text(row.get('username'))
+    if not name:
+        raise ValueError('name is required')
+    if not username:
+        raise ValueError('username is required')
+    return (_text(row.get('id')) or str(uuid.uuid4()), username, name,
+            _text(row.get('description')) or '', _text(row.get('schedule')) or '',
+            _flag(row.get('public') or 0), _text(row.get('created_at')) or None)
+
+
+def _member_row(row):
+    study_id, username = _text(row.get('study_id')), _text(row.get('username'))
+    if not study_id or not username:
+        raise ValueError('study_id and username are required')
+    status = _text(row.get('status')) or 'approved'
+    if status not in ('approved', 'pending'):
+        raise ValueError(f'invalid status {status!r}')
+    return (study_id, username, status, _text(row.get('joined_at')) or None)
+
+
+_VALIDATE = {'studies': _study_row, 'members': _member_row}
+_REPLACED = '\ufffd'   # what errors='replace' decodes invalid UTF-8 to
+
+
+def _undecodable(row):
+    if any(_REPLACED in v for v in itertools.chain(row, row.values()) if isinstance(v, str)):
+        return ValueError('invalid UTF-8')
+    return None
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, dict) from a text stream of NDJSON or CSV.
+
+    A line that cannot be parsed is yielded as (line, ValueError). Streams are
+    decoded with errors='replace', so bytes that were not UTF-8 show up as
+    U+FFFD and their row is reported instead of imported.
+    """
+    if fmt == 'csv':
+        consumed = 0
+
+        def lines():
+            nonlocal consumed
+            for line in stream:
+                consumed += 1
+                yield line
+
+        reader = csv.DictReader(lines())
+        while True:
+            before = consumed
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield consumed, ValueError(f'invalid CSV: {e}')
+                if consumed == before:
+                    return   # nothing more was read; the reader cannot get past it
+                continue
+            yield consumed, _undecodable(row) or row
+        return
+    for n, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        if _REPLACED in line:
+            yield n, ValueError('invalid UTF-8')
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield n, ValueError(f'invalid JSON: {e}')
+            continue
+        yield n, row if isinstance(row, dict) else ValueError('expected a JSON object')
+
+
+def _known_studies(db, ids):
+    known = set()
+    ids = list(ids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        marks = ','.join('?' * len(chunk))
+        known.update(r[0] for r in db.execute(f'SELECT id FROM studies WHERE id IN ({marks})', chunk))
+    return known
+
+
+def import_rows(db, kind, rows, chunk_size=5000):
+    """Import (line, dict) rows; yield a progress report after every committed chunk.
+
+    The last report yielded is the final one. Rows that already exist (same
+    key) are skipped, invalid rows are reported and never abort the import.
+    """
+    validate = _VALIDATE[kind]
+    report = {'kind': kind, 'read': 0, 'inserted': 0, 'skipped': 0, 'error_count': 0, 'errors': [], 'chunks': 0}
+
+    def error(line, message):
+        report['error_count'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line, 'error': message})
+
+    def flush(batch):
+        if kind == 'members':
+            known = _known_studies(db, {r[0] for _, r in batch})
+            for line, r in batch:
+                if r[0] not in known:
+                    error(line, f'unknown study {r[0]}')
+            batch = [(line, r) for line, r in batch if r[0] in known]
+        params = [r for _, r in batch]
+        inserted = database.run_in_transaction(db, lambda conn: conn.executemany(_INSERT[kind], params).rowcount)
+        report['inserted'] += inserted
+        report['skipped'] += len(params) - inserted
+        report['chunks'] += 1
+
+    batch = []
+    for line, row in rows:
+        report['read'] += 1
+        if isinstance(row, Exception):
+            error(line, str(row))
+            continue
+        try:
+            batch.append((line, validate(row)))
+        except ValueError as e:
+            error(line, str(e))
+            continue
+        if len(batch) >= chunk_size:
+            flush(batch)
+            batch = []
+            yield report
+    if batch:
+        flush(batch)
+    yield report
+
+
+def export_lines(db, kind, fmt):
+    """Yield the table as NDJSON or CSV text, a row at a time."""
+    fields = FIELDS[kind]
+    cur = db.execute(_EXPORT[kind])
+    if fmt == 'csv':
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(fields)
+        for row in cur:
+            writer.writerow(row)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        yield buf.getvalue()
+        return
+    for row in cur:
+        yield json.dumps(dict(zip(fields, row)), separators=(',', ':')) + '\n'
+
+
+_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def _check_request(kind):
+    """Error response for a bad admin bulk request, or None."""
+    if session.get('username') != 'admin':
+        return jsonify({'error':'admin required'}), 403
+    if kind not in FIELDS:
+        return jsonify({'error':'kind must be studies or members'}), 404
+    if request.args.get('format', 'ndjson') not in _MIMETYPES:
+        return jsonify({'error':'format must be ndjson or csv'}), 400
+    return None
+
+
+def init_app(app, get_db, on_change=None):
+    """Register the admin endpoints and CLI commands.
+
+    on_change(kind) runs after an import committed rows (e.g. to invalidate
+    cached listings).
+    """
+    app.config.setdefault('BULK_CHUNK_SIZE', 5000)
+
+    @app.route('/admin/import/<kind>', methods=['POST'])
+    def admin_import(kind):
+        error = _check_request(kind)
+        if error:
+            return error
+        fmt = request.args.get('format', 'ndjson')
+        db = get_db()
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8', errors='replace', newline='')
+        chunk_size = app.config['BULK_CHUNK_SIZE']
+
+        def progress():
+            report = None
+            for report in import_rows(db, kind, read_rows(stream, fmt), chunk_size):
+                yield json.dumps({'progress': {k: v for k, v in report.items() if k != 'errors'}}) + '\n'
+            if report['inserted'] and on_change is not None:
+                on_change(kind)
+            yield json.dumps({'done': report}) + '\n'
+
+        return Response(stream_with_context(progress()), mimetype='application/x-ndjson')
+
+    @app.route('/admin/export/<kind>')
+    def admin_export(kind):
+        error = _check_request(kind)
+        if error:
+            return error
+        fmt = request.args.get('format', 'ndjson')
+        return Response(stream_with_context(export_lines(get_db(), kind, fmt)), mimetype=_MIMETYPES[fmt],
+                        headers={'Content-Disposition': f'attachment; filename={kind}.{fmt}'})
+
+    @app.cli.command('import-data')
+    @click.argument('kind', type=click.Choice(sorted(FIELDS)))
+    @click.argument('source', type=click.File('r', encoding='utf-8', errors='replace'))
+    @click.option('--format', 'fmt', type=click.Choice(sorted(_MIMETYPES)), help='default: from the file extension')
+    @click.option('--chunk-size', type=int, default=None)
+    def import_command(kind, source, fmt, chunk_size):
+        """Import studies or members from an NDJSON or CSV file ('-' for stdin)."""
+        fmt = fmt or ('csv' if source.name.endswith('.csv') else 'ndjson')
+        db = get_db()
+        report = None
+        for report in import_rows(db, kind, read_rows(source, fmt), chunk_size or app.config['BULK_CHUNK_SIZE']):
+            click.echo(f"{report['read']} read, {report['inserted']} inserted, {report['skipped']} skipped, "
+                       f"{report['error_count']} errors", err=True)
+        for e in report['errors']:
+            click.echo(f"line {e['line']}: {e['error']}", err=True)
+        if report['inserted'] and on_change is not None:
+            on_change(kind)
+        if report['error_count']:
+            sys.exit(1)
+
+    @app.cli.command('export-data')
+    @click.argument('kind', type=click.Choice(sorted(FIELDS)))
+    @click.option('--format', 'fmt', type=click.Choice(sorted(_MIMETYPES)), default='ndjson')
+    @click.option('-o', '--output', type=click.File('w', encoding='utf-8'), default='-')
+    def export_command(kind, fmt, output):
+        """Export studies or members as NDJSON or CSV (stdout by default)."""
+        for chunk in export_lines(get_db(), kind, fmt):
+            output.write(chunk)
@@ -0,0 +1,84 @@
+"""
+cache.py - read-through response cache for public, user-independent reads
+
+The public study search and "latest public studies" listing return the same
+JSON to every visitor, so app.py keeps rendered response bodies here keyed by
+the normalized request. Entries expire after a TTL and the least recently used
+ones are evicted once the cache holds more than max_bytes of bodies.
+
+Invalidation is by generation: each namespace ('studies') has a counter that
+writers bump after commit, and the counter is part of every key. Readers take
+the generation before querying, so a result computed from rows that changed
+mid-request is stored under the old generation and never served. Old entries
+are not deleted, they just stop being reachable and age out.
+
+MemoryCache is per process. Anything with the same get/set/generation/bump/
+stats methods can replace it (see RESPONSE_CACHE_FACTORY in app.py), e.g. a
+Redis or memcached client shared by several workers.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryCache:
+    def __init__(self, max_bytes=4 * 1024 * 1024, ttl=30.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expires, size, value), oldest use first
+        self._generations = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, size, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        return True
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key)[1]
+
+    def generation(self, namespace):
+        with self._lock:
+            return self._generations.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self._lock:
+            gen = self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            return gen
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
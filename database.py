@@ -0,0 +1,342 @@
+"""
+database.py - pooled SQLite connections for Study Hub
+
+Connections are opened once, tuned with per-connection PRAGMAs (WAL journal,
+synchronous=NORMAL, mmap, page cache, busy timeout) and then handed out to
+requests from a bounded pool instead of being reopened for every request.
+
+Writes go through run_in_transaction(): the request's statements run as one
+BEGIN IMMEDIATE ... COMMIT unit. With group commit enabled (DB_GROUP_COMMIT)
+they are handed to GroupCommitter instead, whose single writer thread runs
+every unit that arrives within DB_GROUP_COMMIT_WINDOW in one transaction (one
+savepoint each) and commits them together: one WAL sync for the whole batch.
+That pays off with synchronous=FULL or when many writers queue on the lock.
+
+With GAME_SHARDS > 1 the game tables live in that many extra files next to
+the main one (shard_paths), each with a pool of its own (get_shard_pools); see
+shards.py for the routing.
+
+Note: each pooled connection to ':memory:' would be a separate database, so the
+pool is meant for file-backed databases (use a temp file in tests).
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+DEFAULT_PRAGMAS = {
+    # must come before journal_mode: it only takes effect on a database that
+    # has no tables yet (older files need one VACUUM, see maintenance.py)
+    'auto_vacuum': 'INCREMENTAL',
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,            # ms to wait on a locked database before failing
+    'cache_size': -16000,            # negative = KiB, so ~16 MB of page cache
+    'mmap_size': 128 * 1024 * 1024,
+}
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the pool timeout."""
+
+
+class ConnectionPool:
+    def __init__(self, database, size=8, timeout=10.0, pragmas=None,
+                 health_check_interval=30.0, factory=sqlite3.Connection):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self.pragmas.update(pragmas or {})
+        self.health_check_interval = health_check_interval
+        self.factory = factory
+        # LIFO keeps the most recently used (warm) connections in circulation
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        self._last_used = {}
+        self.pid = os.getpid()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False, factory=self.factory)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name}={value}')
+        return conn
+
+    def _healthy(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        if self._closed:
+            raise PoolTimeout('pool is closed')
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    conn = False
+            if conn is False:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            try:
+                conn = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise PoolTimeout(f'no database connection free after {self.timeout}s')
+        idle_for = time.monotonic() - self._last_used.pop(id(conn), 0)
+        if idle_for > self.health_check_interval and not self._healthy(conn):
+            self._discard(conn)
+            return self.acquire()
+        return conn
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        if self._closed:
+            self._discard(conn)
+            return
+        self._last_used[id(conn)] = time.monotonic()
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._last_used.pop(id(conn), None)
+            self._discard(conn)
+
+    def stats(self):
+        return {'size': self.size, 'open': self._created, 'idle': self._idle.qsize()}
+
+
+def run_in_transaction(conn, fn):
+    """Run fn(conn) as one transaction and return its result.
+
+    IMMEDIATE takes the write lock up front, so reads inside fn cannot be
+    invalidated by another writer before fn's own writes land. fn must not
+    commit; it may raise to roll everything back.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        result = fn(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return result
+
+
+class _Job:
+    __slots__ = ('fn', 'done', 'result', 'error')
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GroupCommitter:
+    """Runs write units from many threads on one connection, committing together.
+
+    Each unit gets its own savepoint: one that raises is rolled back alone and
+    its exception re-raised in the submitting thread; the others still commit.
+    submit() returns once the batch holding the unit is durable.
+    """
+
+    def __init__(self, connect, window=0.002, max_batch=64):
+        self._connect = connect
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.units = 0
+        self.pid = os.getpid()
+
+    def submit(self, fn):
+        job = _Job(fn)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='group-commit', daemon=True)
+                self._thread.start()
+            self._queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                self._queue.put(None)  # finish this batch, then stop
+                break
+            batch.append(job)
+        return batch
+
+    def _loop(self):
+        conn = self._connect()
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    break
+                batch = self._collect(job)
+                self._run_batch(conn, batch)
+                for job in batch:
+                    job.done.set()
+        finally:
+            conn.close()
+
+    def _run_batch(self, conn, batch):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for job in batch:
+                conn.execute('SAVEPOINT unit')
+                try:
+                    job.result = job.fn(conn)
+                    conn.execute('RELEASE unit')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO unit')
+                    conn.execute('RELEASE unit')
+                    job.error = e
+            conn.commit()
+            self.batches += 1
+            self.units += len(batch)
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for job in batch:
+                job.error = job.error or e
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+    def stats(self):
+        return {'batches': self.batches, 'units': self.units}
+
+
+_pool_lock = threading.Lock()
+
+
+def _new_pool(cfg, path):
+    return ConnectionPool(
+        path,
+        size=cfg.get('DB_POOL_SIZE', 8),
+        timeout=cfg.get('DB_POOL_TIMEOUT', 10.0),
+        pragmas=cfg.get('DB_PRAGMAS'),
+        health_check_interval=cfg.get('DB_HEALTH_CHECK_INTERVAL', 30.0),
+        factory=cfg.get('DB_CONNECTION_FACTORY') or sqlite3.Connection,
+    )
+
+
+def get_pool(app):
+    """Return the app's pool, creating it on first use and again after a fork,
+    so connections inherited from a parent process are never reused."""
+    pool = app.extensions.get('db_pool')
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        pool = app.extensions.get('db_pool')
+        if pool is None or pool.pid != os.getpid():
+            pool = app.extensions['db_pool'] = _new_pool(app.config, app.config['DATABASE'])
+    return pool
+
+
+def shard_paths(path, count):
+    """The game shard files for database path; one shard is the main file itself."""
+    if count <= 1:
+        return [path]
+    base, ext = os.path.splitext(path)
+    return [f'{base}_games{i}{ext or ".db"}' for i in range(count)]
+
+
+def get_shard_pools(app):
+    """One pool per GAME_SHARDS file, in shard order (just the main pool when unsharded)."""
+    count = app.config.get('GAME_SHARDS', 1)
+    if count <= 1:
+        return [get_pool(app)]
+    pools = app.extensions.get('db_shard_pools')
+    if pools is not None and len(pools) == count and pools[0].pid == os.getpid():
+        return pools
+    with _pool_lock:
+        pools = app.extensions.get('db_shard_pools')
+        if pools is None or len(pools) != count or pools[0].pid != os.getpid():
+            pools = app.extensions['db_shard_pools'] = [
+                _new_pool(app.config, path) for path in shard_paths(app.config['DATABASE'], count)]
+    return pools
+
+
+def get_group_committer(app):
+    """Return the app's group committer (one writer thread per process)."""
+    committer = app.extensions.get('db_group_commit')
+    if committer is not None and committer.pid == os.getpid():
+        return committer
+    pool = get_pool(app)
+    with _pool_lock:
+        committer = app.extensions.get('db_group_commit')
+        if committer is None or committer.pid != os.getpid():
+            cfg = app.config
+            committer = GroupCommitter(
+                pool._connect,
+                window=cfg.get('DB_GROUP_COMMIT_WINDOW', 0.002),
+                max_batch=cfg.get('DB_GROUP_COMMIT_MAX_BATCH', 64),
+            )
+            app.extensions['db_group_commit'] = committer
+    return committer
+
+
+def close_pool(app):
+    committer = app.extensions.pop('db_group_commit', None)
+    if committer is not None and committer.pid == os.getpid():
+        committer.close()
+    pool = app.extensions.pop('db_pool', None)
+    if pool is not None:
+        pool.close()
+    for pool in app.extensions.pop('db_shard_pools', None) or ():
+        pool.close()
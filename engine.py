@@ -0,0 +1,236 @@
+"""
+engine.py - game-tree search for m,n,k boards
+
+bot.py answers classic 3x3 games from its solved table; every other board
+(board.Geometry) is searched here with iterative-deepening negamax and
+alpha-beta pruning. Positions are cached in a transposition table keyed by
+Zobrist hashes, so transpositions and the previous iteration's best moves are
+reused, and the search stops when its per-move time budget runs out, playing
+the best move of the deepest iteration that finished.
+
+Only empty cells next to a stone are candidates (every empty cell on boards of
+up to 16 cells), tried transposition-table move first and then by how much
+each one extends or blocks open lines.
+"""
+
+import random
+import time
+
+WIN = 1 << 40            # scores beyond WIN // 2 are forced wins (minus plies)
+EXACT, LOWER, UPPER = 0, 1, 2
+TT_MAX = 1 << 20         # entries kept before the table is cleared
+
+_zobrist = {}
+_near = {}
+
+
+class _Timeout(Exception):
+    pass
+
+
+def zobrist_keys(geom):
+    """Two tables of random 64-bit keys, one per player, indexed by cell."""
+    key = (geom.rows, geom.cols)
+    keys = _zobrist.get(key)
+    if keys is None:
+        rng = random.Random(f'zobrist-{geom.rows}x{geom.cols}')
+        keys = _zobrist[key] = tuple(tuple(rng.getrandbits(64) for _ in range(geom.size)) for _ in range(2))
+    return keys
+
+
+def near_masks(geom):
+    """near[pos]: cells within one step of pos (all cells on small boards)."""
+    key = (geom.rows, geom.cols)
+    masks = _near.get(key)
+    if masks is None:
+        if geom.size <= 16:
+            masks = (geom.full,) * geom.size
+        else:
+            masks = []
+            for pos in range(geom.size):
+                r, c = divmod(pos, geom.cols)
+                masks.append(sum(1 << (rr * geom.cols + cc)
+                                 for rr in range(max(0, r - 1), min(geom.rows, r + 2))
+                                 for cc in range(max(0, c - 1), min(geom.cols, c + 2))))
+            masks = tuple(masks)
+        _near[key] = masks
+    return masks
+
+
+class Search:
+    def __init__(self, geom, budget=0.5, max_depth=None):
+        self.geom = geom
+        self.budget = budget
+        self.max_depth = max_depth
+        self.keys = zobrist_keys(geom)
+        self.near = near_masks(geom)
+        # an open line holding n of one side's stones is worth weights[n]
+        self.weights = tuple(0 if n == 0 else 4 ** n for n in range(geom.k + 1))
+        self.tt = {}
+        self.nodes = 0
+        self.depth = 0
+        self.deadline = None
+
+    def best_move(self, cells, player):
+        """Return the chosen cell index for player, or None when the game is over."""
+        geom = self.geom
+        if geom.winner(cells) is not None:
+            return None
+        x, o = geom.x_mask(cells), geom.o_mask(cells)
+        me, opp = (x, o) if player == 'X' else (o, x)
+        turn = 0 if player == 'X' else 1
+        occupied = me | opp
+        if not occupied:
+            return (geom.rows // 2) * geom.cols + geom.cols // 2
+        h = 0
+        for t, mask in ((0, x), (1, o)):
+            while mask:
+                low = mask & -mask
+                h ^= self.keys[t][low.bit_length() - 1]
+                mask ^= low
+        cand = 0
+        mask = occupied
+        while mask:
+            low = mask & -mask
+            cand |= self.near[low.bit_length() - 1]
+            mask ^= low
+        cand &= ~occupied & geom.full
+
+        empties = geom.size - occupied.bit_count()
+        limit = empties if self.max_depth is None else min(self.max_depth, empties)
+        start = time.perf_counter()
+        best = None
+        for depth in range(1, limit + 1):
+            # depth 1 always finishes, so there is a move even on a tiny budget
+            self.deadline = None if depth == 1 or self.budget is None else start + self.budget
+            try:
+                score, move = self._root(me, opp, cand, h, turn, depth)
+            except _Timeout:
+                break
+            best, self.depth = move, depth
+            if abs(score) > WIN // 2:
+                break  # forced result; deeper search cannot change it
+        return best
+
+    def _root(self, me, opp, cand, h, turn, depth):
+        alpha, beta = -WIN * 2, WIN * 2
+        best_score, best_move = None, None
+        entry = self.tt.get(h)
+        for mv in self._order(me, opp, cand, entry[3] if entry else None):
+            score = self._child(me, opp, cand, h, turn, mv, depth, alpha, beta, 0)
+            if best_score is None or score > best_score:
+                best_score, best_move = score, mv
+            alpha = max(alpha, score)
+        self._store(h, depth, best_score, EXACT, best_move, 0)
+        return best_score, best_move
+
+    def _child(self, me, opp, cand, h, turn, mv, depth, alpha, beta, ply):
+        bit = 1 << mv
+        mine = me | bit
+        if self.geom.wins_at(mine, mv):
+            return WIN - ply - 1
+        occupied = mine | opp
+        if occupied == self.geom.full:
+            return 0
+        child_cand = (cand | self.near[mv]) & ~occupied & self.geom.full
+        return -self._negamax(opp, mine, child_cand, h ^ self.keys[turn][mv], 1 - turn, depth - 1, -beta, -alpha, ply + 1)
+
+    def _negamax(self, me, opp, cand, h, turn, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.deadline is not None and not self.nodes & 255 and time.perf_counter() > self.deadline:
+            raise _Timeout()
+        entry = self.tt.get(h)
+        tt_move = None
+        if entry is not None:
+            e_depth, e_score, e_flag, tt_move = entry
+            if e_depth >= depth:
+                score = _from_tt(e_score, ply)
+                if e_flag == EXACT:
+                    return score
+                if e_flag == LOWER:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+        if depth == 0:
+            return self._evaluate(me, opp)
+        if not cand:
+            # only far-away cells are left; fall back to every empty cell
+            cand = ~(me | opp) & self.geom.full
+        alpha0 = alpha
+        best_score, best_move = -WIN * 2, None
+        for mv in self._order(me, opp, cand, tt_move):
+            score = self._child(me, opp, cand, h, turn, mv, depth, alpha, beta, ply)
+            if score > best_score:
+                best_score, best_move = score, mv
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        flag = UPPER if best_score <= alpha0 else LOWER if best_score >= beta else EXACT
+        self._store(h, depth, best_score, flag, best_move, ply)
+        return best_score
+
+    def _store(self, h, depth, score, flag, move, ply):
+        if len(self.tt) >= TT_MAX:
+            self.tt.clear()
+        self.tt[h] = (depth, _to_tt(score, ply), flag, move)
+
+    def _order(self, me, opp, cand, tt_move):
+        weights = self.weights
+        scored = []
+        mask = cand
+        while mask:
+            low = mask & -mask
+            mv = low.bit_length() - 1
+            mask ^= low
+            if mv == tt_move:
+                continue
+            value = 0
+            for w in self.geom.lines_through[mv]:
+                if not w & opp:
+                    value += weights[(w & me).bit_count() + 1]       # extends my line
+                elif not w & me:
+                    value += weights[(w & opp).bit_count()]          # blocks theirs
+            scored.append((-value, mv))
+        scored.sort()
+        moves = [mv for _, mv in scored]
+        if tt_move is not None and cand >> tt_move & 1:
+            moves.insert(0, tt_move)
+        return moves
+
+    def _evaluate(self, me, opp):
+        """Static score for the side to move: open lines weighted by stones in them."""
+        weights = self.weights
+        score = 0
+        for w in self.geom.lines:
+            a, b = w & me, w & opp
+            if a:
+                if not b:
+                    score += weights[a.bit_count()]
+            elif b:
+                score -= weights[b.bit_count()]
+        return score
+
+
+def _to_tt(score, ply):
+    # mate scores are stored relative to the node, not the root
+    if score > WIN // 2:
+        return score + ply
+    if score < -WIN // 2:
+        return score - ply
+    return score
+
+
+def _from_tt(score, ply):
+    if score > WIN // 2:
+        return score - ply
+    if score < -WIN // 2:
+        return score + ply
+    return score
+
+
+def best_move(geom, cells, player, budget=0.5, max_depth=None):
+    """Search cells for player within budget seconds; None when the game is over."""
+    return Search(geom, budget, max_depth).best_move(cells, player)
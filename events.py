@@ -0,0 +1,90 @@
+"""
+events.py - publish/subscribe for live updates (Server-Sent Events)
+
+Routes publish small JSON deltas to named channels ('user:<username>') after a
+change is committed; /api/events streams a user's channel to the browser as
+Server-Sent Events so pages can patch themselves instead of re-fetching lists.
+
+LocalBroker fans out inside one process. Anything with the same publish() /
+subscribe() methods can replace it (see EVENT_BROKER_FACTORY in app.py), e.g. a
+Redis or other shared-broker client when running several workers.
+"""
+
+import json
+import queue
+import threading
+
+
+def format_sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+# Sent instead of the events a slow client missed: it should re-fetch once.
+RESYNC = format_sse('resync', {})
+
+
+class Subscription:
+    def __init__(self, broker, channels, maxsize):
+        self.broker = broker
+        self.channels = tuple(channels)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._overflowed = False
+
+    def put(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            # never block the publisher on a slow reader
+            self._overflowed = True
+
+    def get(self, timeout=None):
+        """Return the next formatted message, or None when timeout passes first."""
+        if self._overflowed:
+            self._overflowed = False
+            with self._queue.mutex:
+                self._queue.queue.clear()
+            return RESYNC
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, channels):
+        sub = Subscription(self, channels, self.queue_size)
+        with self._lock:
+            for channel in sub.channels:
+                self._subscribers.setdefault(channel, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            for channel in sub.channels:
+                subs = self._subscribers.get(channel)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subscribers[channel]
+
+    def publish(self, channel, event, data):
+        with self._lock:
+            subs = list(self._subscribers.get(channel, ()))
+        if not subs:
+            return 0
+        message = format_sse(event, data)
+        for sub in subs:
+            sub.put(message)
+        return len(subs)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
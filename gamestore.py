@@ -0,0 +1,317 @@
+"""
+gamestore.py - in-process store of games being played, with write-behind
+
+A game in progress is touched by one owner in quick succession, yet every move
+used to read the row, decode the board, update it and append to the move log.
+With GAME_STORE enabled, playing games are kept here instead: the first move
+loads the row, later moves are applied in memory under a per-game lock, and
+the accumulated moves are written back in batches:
+
+    - every GAME_STORE_FLUSH_INTERVAL seconds, by a background thread,
+      all dirty games in one transaction;
+    - at once when a game ends (the finished game then leaves the store);
+    - when a game is evicted, least recently used first, once more than
+      GAME_STORE_SIZE games are held;
+    - before SQL readers of the games table (listings, replays) run, for
+      the requesting user's games, and when the process exits.
+
+Flushes are crash-safe in the sense that matters for SQLite: a game's UPDATE
+and its move-log rows (movelog.record) commit together, guarded by the row
+version, so the database always holds a consistent prefix of every game. What
+a crash can lose is the moves of unfinished games acknowledged since the last
+flush, at most GAME_STORE_FLUSH_INTERVAL seconds' worth; finished games are
+durable before their result is returned.
+
+A flush that fails (a busy or broken database) is logged and its games stay
+dirty for the next one. Where a caller waits on the write (a game ending, an
+eviction, evict() before a direct change to the rows) the failure is raised
+as FlushError instead, and the app answers 503 rather than acknowledge a
+move that is not durable; the move that ended the game is undone.
+
+The store is per process. If the row changed underneath (another process
+moved, an admin clear deleted it), the flush skips that game and drops it
+from the store. So enable it with one worker process, or with sticky routing
+of each user to a process.
+"""
+
+import atexit
+import itertools
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import board
+import database
+import movelog
+import shards
+
+class FlushError(Exception):
+    """Raised when games that had to be written before returning could not be."""
+
+
+_COLUMNS = 'id,username,owner_id,cells,turn,status,opponent,version,board_rows,board_cols,win_length'
+
+
+class ActiveGame:
+    __slots__ = ('id', 'username', 'owner_id', 'opponent', 'geom', 'cells', 'turn', 'status',
+                 'version', 'base', 'pending', 'lock', 'live', 'shard')
+
+    def __init__(self, row, shard=0):
+        (self.id, self.username, self.owner_id, cells, self.turn, self.status,
+         self.opponent, self.version, rows, cols, k) = row
+        self.geom = board.geometry(rows, cols, k)
+        self.cells = self.base = board.from_db(cells)
+        self.pending = []            # (pos, player, by_bot) played since base was written
+        self.lock = threading.RLock()
+        self.live = True
+        self.shard = shard
+
+
+class GameStore:
+    def __init__(self, connect, capacity=10000, flush_interval=0.5, snapshot_interval=movelog.SNAPSHOT_INTERVAL,
+                 shard_of=None, logger=None):
+        self._connect = connect               # connect(shard) -> a connection to that game shard
+        self.logger = logger or logging.getLogger(__name__)
+        self._shard_of = shard_of or (lambda gid: 0)
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.snapshot_interval = snapshot_interval
+        self._games = OrderedDict()       # id -> ActiveGame, least recently used first
+        self._lock = threading.Lock()         # the dict and every game's state fields
+        self._load_lock = threading.Lock()    # misses and evictions, so a load never reads a row mid-eviction
+        self._flush_lock = threading.Lock()   # one flush at a time on the store's connection
+        self._conns = {}                      # shard -> the store's own connection
+        self._thread = None
+        self._stop = threading.Event()
+        self.hits = self.misses = self.evictions = 0
+        self.flushes = self.flushed_games = self.conflicts = 0
+        self.pid = os.getpid()
+
+    @contextmanager
+    def checkout(self, db, gid):
+        """Hold gid's lock and yield its ActiveGame, or None when it is not a playing game."""
+        while True:
+            game = self._lookup(db, gid)
+            if game is None:
+                yield None
+                return
+            with game.lock:
+                if game.live:
+                    yield game
+                    return
+            # evicted or finished while we waited; the row is current again
+
+    def _lookup(self, db, gid):
+        with self._lock:
+            game = self._games.get(gid)
+            if game is not None:
+                self._games.move_to_end(gid)
+                self.hits += 1
+                return game
+        with self._load_lock:
+            with self._lock:
+                game = self._games.get(gid)
+            if game is not None:
+                return game
+            row = db.execute(f'SELECT {_COLUMNS} FROM games WHERE id=?', (gid,)).fetchone()
+            if row is None or row[5] != 'playing':
+                return None
+            game = ActiveGame(tuple(row), self._shard_of(gid))
+            with self._lock:
+                self.misses += 1
+                self._games[gid] = game
+                victims = list(itertools.islice(self._games.values(), max(0, len(self._games) - self.capacity)))
+            for victim in victims:
+                # a game someone is moving in right now is not the one to evict
+                if victim.lock.acquire(blocking=False):
+                    try:
+                        self._drop([victim])
+                    finally:
+                        victim.lock.release()
+                    self.evictions += 1
+        self._start()
+        return game
+
+    def apply(self, game, cells, turn, status, moves):
+        """Record moves made on a checked-out game; False if it left the store meanwhile.
+
+        A move that ends the game is written before this returns; if that
+        fails the move is undone and FlushError raised.
+        """
+        with self._lock:
+            if not game.live:
+                return False
+            before = game.cells, game.turn, game.status, len(game.pending)
+            game.cells, game.turn, game.status = cells, turn, status
+            game.pending.extend(moves)
+        if status != 'playing':
+            try:
+                self._drop([game])
+            except FlushError:
+                with self._lock:
+                    game.cells, game.turn, game.status, count = before
+                    del game.pending[count:]
+                raise
+        return True
+
+    def snapshot(self, gid):
+        """(ActiveGame, cells, turn, status, version, pending count) for gid, or None; no load."""
+        with self._lock:
+            game = self._games.get(gid)
+            if game is None:
+                return None
+            return game, game.cells, game.turn, game.status, game.version, len(game.pending)
+
+    def flush(self, username=None):
+        """Write every dirty game (only username's if given); return how many were written.
+
+        Raises FlushError when a shard's write failed; its games stay dirty.
+        """
+        with self._lock:
+            games = [g for g in self._games.values() if g.pending and (username is None or g.username == username)]
+        written = self._flush(games) if games else 0
+        with self._lock:
+            done = [g for g in games if g.live and not g.pending and g.status != 'playing']
+        for game in done:
+            self._drop([game])
+        return written
+
+    def evict(self, gids):
+        """Write and forget these games, e.g. before changing their rows directly."""
+        with self._load_lock:
+            with self._lock:
+                games = [self._games[gid] for gid in gids if gid in self._games]
+            for game in games:
+                with game.lock:
+                    self._drop([game])
+
+    def _drop(self, games):
+        # write, then forget; a game whose write failed stays and FlushError is raised
+        self._flush([g for g in games if g.pending])
+        with self._lock:
+            for game in games:
+                if game.live and not game.pending:
+                    game.live = False
+                    self._games.pop(game.id, None)
+
+    def _flush(self, games):
+        with self._flush_lock:
+            with self._lock:
+                batch = [(g, g.version, g.base, g.cells, g.turn, g.status, list(g.pending))
+                         for g in games if g.live and g.pending]
+            by_shard = {}
+            for item in batch:
+                by_shard.setdefault(item[0].shard, []).append(item)
+            written, failed = 0, []
+            for shard, items in sorted(by_shard.items()):
+                try:
+                    written += self._flush_shard(shard, items)
+                except Exception as exc:
+                    self.logger.exception('game store: flushing %d game(s) to shard %d failed', len(items), shard)
+                    failed.append(exc)
+                    conn = self._conns.pop(shard, None)   # reconnect next time
+                    if conn is not None:
+                        conn.close()
+            if failed:
+                raise FlushError(f'{len(failed)} of {len(by_shard)} game shard(s) could not be written') from failed[0]
+            return written
+
+    def _flush_shard(self, shard, batch):
+        # one transaction per shard; a failed one leaves its games pending and raises
+        conn = self._conns.get(shard)
+        if conn is None:
+            conn = self._conns[shard] = self._connect(shard)
+
+        def write(conn):
+            conflicts = []
+            for game, version, base, cells, turn, status, moves in batch:
+                if not conn.execute('UPDATE games SET cells=?,turn=?,status=? WHERE id=? AND version=?',
+                                    (board.to_db(cells), turn, status, game.id, version)).rowcount:
+                    conflicts.append(game)
+                    continue
+                movelog.record(conn, game.id, game.geom, base, moves, self.snapshot_interval)
+            return conflicts
+
+        conflicts = database.run_in_transaction(conn, write)
+        with self._lock:
+            for game, version, base, cells, turn, status, moves in batch:
+                if game in conflicts:
+                    game.live = False
+                    game.pending = []
+                    self._games.pop(game.id, None)
+                    continue
+                # the version trigger bumps the row once per UPDATE
+                game.version = version + 1
+                game.base = cells
+                del game.pending[:len(moves)]
+            self.flushes += 1
+            self.flushed_games += len(batch) - len(conflicts)
+            self.conflicts += len(conflicts)
+        return len(batch) - len(conflicts)
+
+    def _start(self):
+        if self._thread is not None or not self.flush_interval:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='game-store-flush', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except FlushError:
+                pass   # logged; the games stay dirty for the next round
+
+    def close(self):
+        """Stop the flusher and write whatever is still pending."""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        try:
+            self.flush()
+        except FlushError:
+            pass   # logged; nothing more can be done on the way out
+        with self._flush_lock:
+            for conn in self._conns.values():
+                conn.close()
+            self._conns.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'games': len(self._games), 'dirty': sum(1 for g in self._games.values() if g.pending),
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'flushes': self.flushes, 'flushed_games': self.flushed_games, 'conflicts': self.conflicts}
+
+
+_store_lock = threading.Lock()
+
+
+def get_store(app):
+    """Return the app's game store (one per process, recreated after a fork)."""
+    store = app.extensions.get('game_store')
+    if store is not None and store.pid == os.getpid():
+        return store
+    pools = database.get_shard_pools(app)
+    with _store_lock:
+        store = app.extensions.get('game_store')
+        if store is None or store.pid != os.getpid():
+            cfg = app.config
+            store = GameStore(lambda shard: pools[shard]._connect(), capacity=cfg['GAME_STORE_SIZE'],
+                              flush_interval=cfg['GAME_STORE_FLUSH_INTERVAL'],
+                              snapshot_interval=cfg['GAME_SNAPSHOT_INTERVAL'],
+                              shard_of=lambda gid: shards.shard_for(gid, len(pools)), logger=app.logger)
+            app.extensions['game_store'] = store
+            atexit.register(store.close)
+    return store
+
+
+def close_store(app):
+    store = app.extensions.pop('game_store', None)
+    if store is not None and store.pid == os.getpid():
+        atexit.unregister(store.close)
+        store.close()
@@ -0,0 +1,336 @@
+"""
+maintenance.py - background archival, chunked purges and incremental VACUUM
+
+Big deletes do not belong in a request: one DELETE over a whole table holds
+the write lock for as long as the table is large, and every other writer
+waits behind it (or times out). Instead they run as jobs on one background
+thread per process:
+
+    clear    delete every game, study and membership
+    archive  move finished games older than ARCHIVE_AFTER_DAYS, with their
+             move log, into the ARCHIVE_DATABASE file
+
+Rows go MAINTENANCE_CHUNK_ROWS at a time, one short transaction per chunk,
+with MAINTENANCE_PAUSE seconds between chunks so request writes interleave
+with the job instead of queueing behind it. The freed pages are then returned
+to the filesystem with PRAGMA incremental_vacuum, MAINTENANCE_VACUUM_PAGES at a
+time. New databases are created with auto_vacuum=INCREMENTAL (see
+database.DEFAULT_PRAGMAS); an older file needs one full rebuild first:
+
+    flask --app app vacuum
+
+An archive chunk is committed to the archive file before it is deleted from
+the main database, and the copy is INSERT OR REPLACE, so a crash in between
+only means the next pass copies those games again. Archived games no longer
+appear in /api/games.
+
+Job state and progress are rows in maintenance_jobs, so any worker process
+can answer a poll. Every MAINTENANCE_INTERVAL seconds the worker also runs an
+archive pass on its own; passes in several processes may overlap, which is
+harmless for the reason above.
+
+Admin endpoints:
+    POST /admin/clear            start a clear job    -> 202 {"job": {...}}
+    POST /admin/maintenance      start an archive job -> 202 {"job": {...}}
+    GET  /admin/jobs/<id>        the job's state and progress
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+import click
+from flask import jsonify, session, url_for
+
+import database
+
+_JOB_COLUMNS = 'id,kind,state,progress,error,created_at,started_at,finished_at'
+
+
+def clear_chunks(conn, progress, chunk_rows=500, tables=('study_members', 'studies', 'games')):
+    """Delete every row of tables, in order; yield the table after each committed chunk."""
+    for table in tables:
+        progress.setdefault(table, 0)
+        while True:
+            deleted = database.run_in_transaction(conn, lambda c: c.execute(
+                f'DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} LIMIT ?)', (chunk_rows,)).rowcount)
+            if not deleted:
+                break
+            progress[table] += deleted
+            yield table
+
+
+def _archive_schema(conn):
+    """Create or widen the archive tables to match main; return the games columns."""
+    info = conn.execute('PRAGMA main.table_info(games)').fetchall()
+    have = {r[1] for r in conn.execute('PRAGMA archive.table_info(games)')}
+    if not have:
+        defs = ', '.join(f'{r[1]} {r[2]}' + (' PRIMARY KEY' if r[5] else '') for r in info)
+        conn.execute(f'CREATE TABLE archive.games ({defs}, archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+    for r in info:
+        if have and r[1] not in have:
+            conn.execute(f'ALTER TABLE archive.games ADD COLUMN {r[1]} {r[2]}')
+    for table, value in (('game_moves', 'code'), ('game_snapshots', 'cells')):
+        conn.execute(f'CREATE TABLE IF NOT EXISTS archive.{table} (game_id TEXT NOT NULL, ply INTEGER NOT NULL, '
+                     f'{value} INTEGER NOT NULL, PRIMARY KEY (game_id, ply)) WITHOUT ROWID')
+    return [r[1] for r in info]
+
+
+def archive_chunks(conn, progress, chunk_rows=500, older_than_days=30):
+    """Move finished games created more than older_than_days ago into the
+    attached 'archive' database; yield 'games' after each chunk."""
+    cols = ','.join(_archive_schema(conn))
+    progress.setdefault('archived', 0)
+    while True:
+        ids = [r[0] for r in conn.execute(
+            "SELECT id FROM games WHERE status != 'playing' AND created_at < datetime('now', ?) "
+            'ORDER BY created_at LIMIT ?', (f'-{older_than_days} days', chunk_rows))]
+        if not ids:
+            return
+        marks = ','.join('?' * len(ids))
+
+        def copy(c):
+            c.execute(f'INSERT OR REPLACE INTO archive.games({cols}) SELECT {cols} FROM main.games WHERE id IN ({marks})', ids)
+            for table in ('game_moves', 'game_snapshots'):
+                c.execute(f'INSERT OR REPLACE INTO archive.{table} SELECT * FROM main.{table} WHERE game_id IN ({marks})', ids)
+
+        database.run_in_transaction(conn, copy)
+        # only what the archive holds; the games_log_ad trigger drops the move log
+        deleted = database.run_in_transaction(conn, lambda c: c.execute(
+            f'DELETE FROM main.games WHERE id IN (SELECT id FROM archive.games WHERE id IN ({marks}))', ids).rowcount)
+        progress['archived'] += deleted
+        yield 'games'
+
+
+def vacuum_steps(conn, progress, pages=256):
+    """Release free pages a few at a time; a no-op unless auto_vacuum is INCREMENTAL."""
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        return
+    progress.setdefault('vacuumed_pages', 0)
+    while True:
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if not free:
+            return
+        conn.execute(f'PRAGMA incremental_vacuum({pages})').fetchall()
+        released = free - conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if released <= 0:
+            return
+        progress['vacuumed_pages'] += released
+        yield None
+
+
+def archive_path(app):
+    """ARCHIVE_DATABASE, or <database>_archive.db next to the main file."""
+    return app.config['ARCHIVE_DATABASE'] or os.path.splitext(app.config['DATABASE'])[0] + '_archive.db'
+
+
+def _job_json(row):
+    job = dict(zip(_JOB_COLUMNS.split(','), row))
+    job['progress'] = json.loads(job['progress'])
+    return job
+
+
+def get_job(db, job_id):
+    row = db.execute(f'SELECT {_JOB_COLUMNS} FROM maintenance_jobs WHERE id=?', (job_id,)).fetchone()
+    return None if row is None else _job_json(row)
+
+
+class Worker:
+    """Runs maintenance jobs one at a time on a background thread."""
+
+    def __init__(self, app, on_change=None):
+        self.app = app
+        self.on_change = on_change
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.pid = os.getpid()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='maintenance', daemon=True)
+                self._thread.start()
+
+    def submit(self, db, kind):
+        """Record a queued job and hand it to the worker; return its id."""
+        job_id = uuid.uuid4().hex
+        database.run_in_transaction(db, lambda c: c.execute(
+            'INSERT INTO maintenance_jobs(id,kind) VALUES(?,?)', (job_id, kind)))
+        self.start()
+        self._queue.put(job_id)
+        return job_id
+
+    def _loop(self):
+        interval = self.app.config['MAINTENANCE_INTERVAL']
+        while True:
+            try:
+                job_id = self._queue.get(timeout=interval or None)
+            except queue.Empty:
+                job_id = 'archive'   # periodic pass
+            if job_id is None:
+                break
+            try:
+                self.run(job_id)
+            except Exception:
+                self.app.logger.exception('maintenance job %s could not run', job_id)
+
+    def _connect(self):
+        return database.get_pool(self.app)._connect()
+
+    def _connect_games(self, conn):
+        # one connection per game shard; unsharded, games are in conn's file
+        if self.app.config.get('GAME_SHARDS', 1) <= 1:
+            return [conn]
+        return [pool._connect() for pool in database.get_shard_pools(self.app)]
+
+    def run(self, job_id):
+        """Run a queued job, or a fresh one when job_id is a job kind."""
+        cfg = self.app.config
+        conn = self._connect()
+        game_conns = self._connect_games(conn)
+        try:
+            if job_id in ('archive', 'clear'):
+                kind, job_id = job_id, uuid.uuid4().hex
+                database.run_in_transaction(conn, lambda c: c.execute(
+                    'INSERT INTO maintenance_jobs(id,kind) VALUES(?,?)', (job_id, kind)))
+            else:
+                kind = conn.execute('SELECT kind FROM maintenance_jobs WHERE id=?', (job_id,)).fetchone()[0]
+            progress = {}
+
+            def update(state, error=None):
+                done = state in ('done', 'failed')
+                database.run_in_transaction(conn, lambda c: c.execute(
+                    'UPDATE maintenance_jobs SET state=?, progress=?, error=?, '
+                    'started_at=COALESCE(started_at, CURRENT_TIMESTAMP), '
+                    'finished_at=CASE WHEN ? THEN CURRENT_TIMESTAMP END WHERE id=?',
+                    (state, json.dumps(progress), error, done, job_id)))
+
+            update('running')
+            try:
+                rows = cfg['MAINTENANCE_CHUNK_ROWS']
+                if kind == 'archive':
+                    steps = []
+                    for game_conn in game_conns:
+                        game_conn.execute('ATTACH DATABASE ? AS archive', (archive_path(self.app),))
+                        game_conn.execute('PRAGMA archive.journal_mode=WAL')
+                        steps.append(archive_chunks(game_conn, progress, rows, cfg['ARCHIVE_AFTER_DAYS']))
+                else:
+                    steps = [clear_chunks(conn, progress, rows, ('study_members', 'studies'))]
+                    steps += [clear_chunks(game_conn, progress, rows, ('games',)) for game_conn in game_conns]
+                files = [conn] + [c for c in game_conns if c is not conn]
+                steps += [vacuum_steps(c, progress, cfg['MAINTENANCE_VACUUM_PAGES']) for c in files]
+                for step in steps:
+                    for table in step:
+                        if table is not None and self.on_change is not None:
+                            with self.app.app_context():
+                                self.on_change(table)
+                        update('running')
+                        time.sleep(cfg['MAINTENANCE_PAUSE'])
+            except Exception as e:
+                self.app.logger.exception('maintenance job %s (%s) failed', job_id, kind)
+                update('failed', str(e))
+            else:
+                update('done')
+        finally:
+            for c in game_conns:
+                if c is not conn:
+                    c.close()
+            conn.close()
+        return job_id
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+
+_lock = threading.Lock()
+
+
+def get_worker(app):
+    """Return the app's maintenance worker (one per process, recreated after a fork)."""
+    worker = app.extensions.get('maintenance')
+    if worker is not None and worker.pid == os.getpid():
+        return worker
+    with _lock:
+        worker = app.extensions.get('maintenance')
+        if worker is None or worker.pid != os.getpid():
+            worker = app.extensions['maintenance'] = Worker(app, app.extensions.get('maintenance_on_change'))
+    return worker
+
+
+def close_worker(app):
+    worker = app.extensions.pop('maintenance', None)
+    if worker is not None and worker.pid == os.getpid():
+        worker.close()
+
+
+def init_app(app, get_db, on_change=None):
+    """Register the admin endpoints and CLI commands.
+
+    on_change(table) runs after a chunk changed games or studies (e.g. to
+    invalidate cached listings).
+    """
+    app.config.setdefault('ARCHIVE_DATABASE', None)
+    app.config.setdefault('ARCHIVE_AFTER_DAYS', 30)
+    app.config.setdefault('MAINTENANCE_INTERVAL', 3600.0)
+    app.config.setdefault('MAINTENANCE_CHUNK_ROWS', 500)
+    app.config.setdefault('MAINTENANCE_PAUSE', 0.05)
+    app.config.setdefault('MAINTENANCE_VACUUM_PAGES', 256)
+    app.extensions['maintenance_on_change'] = on_change
+
+    @app.before_request
+    def start_worker():
+        if app.config['MAINTENANCE_INTERVAL']:
+            get_worker(app).start()
+
+    def submit(kind):
+        if session.get('username') != 'admin':
+            return jsonify({'error':'admin required'}), 403
+        db = get_db()
+        job_id = get_worker(app).submit(db, kind)
+        location = url_for('admin_job', job_id=job_id)
+        return jsonify({'job': get_job(db, job_id), 'status_url': location}), 202, {'Location': location}
+
+    @app.route('/admin/clear', methods=['POST'])
+    def admin_clear():
+        return submit('clear')
+
+    @app.route('/admin/maintenance', methods=['POST'])
+    def admin_maintenance():
+        return submit('archive')
+
+    @app.route('/admin/jobs/<job_id>')
+    def admin_job(job_id):
+        if session.get('username') != 'admin':
+            return jsonify({'error':'admin required'}), 403
+        job = get_job(get_db(), job_id)
+        if job is None:
+            return jsonify({'error':'not found'}), 404
+        return jsonify(job)
+
+    @app.cli.command('maintenance')
+    @click.argument('kind', type=click.Choice(['archive', 'clear']))
+    def maintenance_command(kind):
+        """Run an archive or clear job now, in the foreground."""
+        job = get_job(get_db(), get_worker(app).run(kind))
+        click.echo(json.dumps(job))
+        if job['state'] != 'done':
+            raise SystemExit(1)
+
+    @app.cli.command('vacuum')
+    def vacuum_command():
+        """Rebuild the database with auto_vacuum=INCREMENTAL (locks it while running)."""
+        db = get_db()
+        if db.in_transaction:
+            db.commit()
+        db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        db.execute('VACUUM')
+        click.echo(f"auto_vacuum={db.execute('PRAGMA auto_vacuum').fetchone()[0]}")
@@ -0,0 +1,248 @@
+"""
+metrics.py - opt-in request profiling and hot-path instrumentation
+
+When METRICS_ENABLED is set the app records, per endpoint:
+  - request latency histograms,
+  - SQL statement counts and timings (pooled connections are created as
+    InstrumentedConnection, which times execute/executemany/executescript),
+  - optional cProfile captures of slow requests (PROFILE_SAMPLE_RATE of
+    requests are profiled; captures slower than PROFILE_SLOW_MS are kept).
+
+Everything is exposed in Prometheus text format at /metrics. With metrics off
+the hooks return immediately and connections are plain sqlite3 connections.
+"""
+
+import cProfile
+import io
+import pstats
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from flask import Response, g, jsonify, request, session
+
+# seconds; roughly log-spaced from "index lookup" to "something is wrong"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50)
+
+_local = threading.local()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for le, n in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += n
+            yield f'{name}_bucket{_labels(labels, le=le)} {cumulative}'
+        yield f'{name}_sum{_labels(labels)} {self.sum}'
+        yield f'{name}_count{_labels(labels)} {self.count}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+class Registry:
+    def __init__(self, profile_keep=20):
+        self._lock = threading.Lock()
+        self.requests = {}      # (endpoint, method) -> Histogram
+        self.responses = {}     # (endpoint, status) -> count
+        self.sql = {}           # (endpoint, verb) -> Histogram
+        self.sql_per_request = {}  # endpoint -> Histogram of statement counts
+        self.profiles = deque(maxlen=profile_keep)
+        self.slow_profiles = 0
+
+    def observe_request(self, endpoint, method, status, seconds, statements):
+        with self._lock:
+            key = (endpoint, method)
+            if key not in self.requests:
+                self.requests[key] = Histogram(LATENCY_BUCKETS)
+            if endpoint not in self.sql_per_request:
+                self.sql_per_request[endpoint] = Histogram(STATEMENT_BUCKETS)
+            self.requests[key].observe(seconds)
+            self.sql_per_request[endpoint].observe(statements)
+            self.responses[(endpoint, status)] = self.responses.get((endpoint, status), 0) + 1
+
+    def observe_sql(self, endpoint, verb, seconds):
+        with self._lock:
+            hist = self.sql.get((endpoint, verb))
+            if hist is None:
+                hist = self.sql[(endpoint, verb)] = Histogram(SQL_BUCKETS)
+            hist.observe(seconds)
+
+    def add_profile(self, endpoint, seconds, text):
+        with self._lock:
+            self.slow_profiles += 1
+            self.profiles.append({'endpoint': endpoint, 'seconds': round(seconds, 6),
+                                  'at': time.time(), 'stats': text})
+
+    def exposition(self, pool_stats=None, cache_stats=None):
+        out = []
+        with self._lock:
+            out.append('# HELP studyhub_request_duration_seconds Request latency by endpoint.')
+            out.append('# TYPE studyhub_request_duration_seconds histogram')
+            for (endpoint, method), hist in sorted(self.requests.items()):
+                out.extend(hist.lines('studyhub_request_duration_seconds', [('endpoint', endpoint), ('method', method)]))
+            out.append('# HELP studyhub_responses_total Responses by endpoint and status code.')
+            out.append('# TYPE studyhub_responses_total counter')
+            for (endpoint, status), n in sorted(self.responses.items()):
+                out.append(f'studyhub_responses_total{_labels([("endpoint", endpoint), ("status", status)])} {n}')
+            out.append('# HELP studyhub_sql_statements_per_request SQL statements executed per request.')
+            out.append('# TYPE studyhub_sql_statements_per_request histogram')
+            for endpoint, hist in sorted(self.sql_per_request.items()):
+                out.extend(hist.lines('studyhub_sql_statements_per_request', [('endpoint', endpoint)]))
+            out.append('# HELP studyhub_sql_duration_seconds SQL statement time by endpoint and verb.')
+            out.append('# TYPE studyhub_sql_duration_seconds histogram')
+            for (endpoint, verb), hist in sorted(self.sql.items()):
+                out.extend(hist.lines('studyhub_sql_duration_seconds', [('endpoint', endpoint), ('verb', verb)]))
+            out.append('# HELP studyhub_slow_profiles_total Profiled requests slower than PROFILE_SLOW_MS.')
+            out.append('# TYPE studyhub_slow_profiles_total counter')
+            out.append(f'studyhub_slow_profiles_total {self.slow_profiles}')
+        if pool_stats:
+            out.append('# HELP studyhub_db_pool_connections Pooled SQLite connections.')
+            out.append('# TYPE studyhub_db_pool_connections gauge')
+            for state in ('open', 'idle'):
+                out.append(f'studyhub_db_pool_connections{_labels([("state", state)])} {pool_stats[state]}')
+        if cache_stats:
+            out.append('# HELP studyhub_response_cache_lookups_total Response cache lookups by result.')
+            out.append('# TYPE studyhub_response_cache_lookups_total counter')
+            for result, key in (('hit', 'hits'), ('miss', 'misses')):
+                out.append(f'studyhub_response_cache_lookups_total{_labels([("result", result)])} {cache_stats[key]}')
+            out.append('# HELP studyhub_response_cache_evictions_total Entries evicted to stay under the byte bound.')
+            out.append('# TYPE studyhub_response_cache_evictions_total counter')
+            out.append(f'studyhub_response_cache_evictions_total {cache_stats["evictions"]}')
+            out.append('# HELP studyhub_response_cache_bytes Cached response bytes.')
+            out.append('# TYPE studyhub_response_cache_bytes gauge')
+            out.append(f'studyhub_response_cache_bytes {cache_stats["bytes"]}')
+        return '\n'.join(out) + '\n'
+
+
+def _record_sql(sql, seconds):
+    active = getattr(_local, 'active', None)
+    if active is None:
+        return  # outside a request (e.g. migrations at startup)
+    registry, endpoint = active
+    _local.statements += 1
+    verb = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else '?'
+    registry.observe_sql(endpoint, verb, seconds)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection that reports each statement's time to the current request."""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_sql(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_sql(sql, time.perf_counter() - start)
+
+    def executescript(self, sql_script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            _record_sql(sql_script, time.perf_counter() - start)
+
+
+def get_registry(app):
+    return app.extensions['metrics']
+
+
+def init_app(app):
+    app.config.setdefault('METRICS_ENABLED', False)
+    app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+    app.config.setdefault('PROFILE_SLOW_MS', 500)
+    app.extensions['metrics'] = Registry()
+    # the connection wrapper is chosen when the pool is built, so SQL timings
+    # need METRICS_ENABLED set before the first request
+    if app.config['METRICS_ENABLED'] and not app.config.get('DB_CONNECTION_FACTORY'):
+        app.config['DB_CONNECTION_FACTORY'] = InstrumentedConnection
+
+    @app.before_request
+    def _metrics_start():
+        if not app.config['METRICS_ENABLED']:
+            return
+        g._metrics_start = time.perf_counter()
+        _local.active = (app.extensions['metrics'], request.endpoint or 'unknown')
+        _local.statements = 0
+        rate = app.config['PROFILE_SAMPLE_RATE']
+        if rate and random.random() < rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                return  # another profiler is already running (one at a time on 3.12+)
+            g._profiler = profiler
+
+    @app.after_request
+    def _metrics_stop(response):
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        registry, endpoint = _local.active
+        registry.observe_request(endpoint, request.method, response.status_code, elapsed, _local.statements)
+        profiler = g.pop('_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if elapsed * 1000 >= app.config['PROFILE_SLOW_MS']:
+                buf = io.StringIO()
+                pstats.Stats(profiler, stream=buf).sort_stats('cumulative').print_stats(25)
+                registry.add_profile(endpoint, elapsed, buf.getvalue())
+        return response
+
+    @app.teardown_request
+    def _metrics_clear(exc):
+        _local.active = None
+        profiler = g.pop('_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        if not app.config['METRICS_ENABLED']:
+            return jsonify({'error':'metrics disabled'}), 404
+        pool = app.extensions.get('db_pool')
+        rcache = app.extensions.get('cache')
+        text = get_registry(app).exposition(pool.stats() if pool else None,
+                                            rcache.stats() if rcache else None)
+        return Response(text, mimetype='text/plain; version=0.0.4')
+
+    @app.route('/metrics/profiles')
+    def metrics_profiles():
+        # cProfile dumps name internal code paths, so admin only
+        if not app.config['METRICS_ENABLED']:
+            return jsonify({'error':'metrics disabled'}), 404
+        if session.get('username') != 'admin':
+            return jsonify({'error':'admin required'}), 403
+        return jsonify(list(get_registry(app).profiles))
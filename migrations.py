@@ -0,0 +1,300 @@
+"""
+migrations.py - versioned schema migrations for Study Hub
+
+Each entry in MIGRATIONS upgrades the schema by one version; its position in
+the list is the version it produces. PRAGMA user_version records the last one
+applied, so on a current database migrate() costs a single PRAGMA read.
+
+Add new migrations at the end and never edit one that has shipped.
+"""
+
+import sqlite3
+
+import board
+
+
+def _run(db, script):
+    # Like executescript(), but without its implicit COMMIT so a migration
+    # stays inside the caller's transaction.
+    stmt = ''
+    for line in script.splitlines(keepends=True):
+        stmt += line
+        if sqlite3.complete_statement(stmt):
+            db.execute(stmt)
+            stmt = ''
+    if stmt.strip():
+        db.execute(stmt)
+
+
+def _columns(db, table):
+    return [r[1] for r in db.execute(f'PRAGMA table_info({table})').fetchall()]
+
+
+def _has_table(db, name):
+    return db.execute('SELECT 1 FROM sqlite_master WHERE name=?', (name,)).fetchone() is not None
+
+
+def _base_schema(db):
+    _run(db, '''
+    CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        password TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS studies (
+        id TEXT PRIMARY KEY,
+        username TEXT,
+        name TEXT,
+        description TEXT,
+        schedule TEXT,
+        public INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS games (
+        id TEXT PRIMARY KEY,
+        username TEXT,
+        owner_id TEXT,
+        board TEXT,
+        turn TEXT,
+        status TEXT,
+        opponent TEXT DEFAULT 'human',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS study_members (
+        study_id TEXT,
+        username TEXT,
+        status TEXT DEFAULT 'approved',
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (study_id, username)
+    );
+    ''')
+    # databases created before these columns existed
+    cols = _columns(db, 'studies')
+    if 'description' not in cols:
+        db.execute('ALTER TABLE studies ADD COLUMN description TEXT')
+    if 'schedule' not in cols:
+        db.execute('ALTER TABLE studies ADD COLUMN schedule TEXT')
+    if 'public' not in cols:
+        db.execute('ALTER TABLE studies ADD COLUMN public INTEGER DEFAULT 0')
+    game_cols = _columns(db, 'games')
+    if 'opponent' not in game_cols:
+        db.execute("ALTER TABLE games ADD COLUMN opponent TEXT DEFAULT 'human'")
+    if 'owner_id' not in game_cols:
+        db.execute('ALTER TABLE games ADD COLUMN owner_id TEXT')
+    if 'status' not in _columns(db, 'study_members'):
+        db.execute("ALTER TABLE study_members ADD COLUMN status TEXT DEFAULT 'approved'")
+
+
+def _search_index(db):
+    # Full-text index over public study names/descriptions. External content:
+    # the text lives in studies, the index is keyed by its rowid and kept in
+    # sync by triggers. A full VACUUM may renumber implicit rowids; rebuild the
+    # index (DELETE FROM studies_fts, then the backfill below) after one.
+    if _has_table(db, 'studies_fts'):
+        return  # created by init_db before migrations were versioned
+    _run(db, '''
+    CREATE VIRTUAL TABLE studies_fts USING fts5(
+        name, description, content='studies', content_rowid='rowid'
+    );
+    CREATE TRIGGER studies_fts_ai AFTER INSERT ON studies WHEN new.public BEGIN
+        INSERT INTO studies_fts(rowid, name, description) VALUES (new.rowid, new.name, new.description);
+    END;
+    CREATE TRIGGER studies_fts_ad AFTER DELETE ON studies WHEN old.public BEGIN
+        INSERT INTO studies_fts(studies_fts, rowid, name, description) VALUES ('delete', old.rowid, old.name, old.description);
+    END;
+    CREATE TRIGGER studies_fts_au AFTER UPDATE OF name, description, public ON studies BEGIN
+        INSERT INTO studies_fts(studies_fts, rowid, name, description)
+            SELECT 'delete', old.rowid, old.name, old.description WHERE old.public;
+        INSERT INTO studies_fts(rowid, name, description)
+            SELECT new.rowid, new.name, new.description WHERE new.public;
+    END;
+    INSERT INTO studies_fts(rowid, name, description)
+        SELECT rowid, name, description FROM studies WHERE public=1;
+    ''')
+
+
+def _listing_indexes(db):
+    # one index per dashboard / listing predicate + sort order
+    _run(db, '''
+    CREATE INDEX IF NOT EXISTS idx_studies_username_created ON studies(username, created_at);
+    CREATE INDEX IF NOT EXISTS idx_studies_public_created ON studies(public, created_at);
+    CREATE INDEX IF NOT EXISTS idx_games_username_created ON games(username, created_at);
+    CREATE INDEX IF NOT EXISTS idx_games_owner ON games(owner_id);
+    CREATE INDEX IF NOT EXISTS idx_members_username_joined ON study_members(username, joined_at, study_id);
+    ''')
+
+
+def _games_keyset_indexes(db):
+    # /api/games pages on (created_at, id) with an optional status filter; with
+    # id in the index the keyset range and sort are both served by the index
+    _run(db, '''
+    DROP INDEX IF EXISTS idx_games_username_created;
+    CREATE INDEX IF NOT EXISTS idx_games_username_created_id ON games(username, created_at, id);
+    CREATE INDEX IF NOT EXISTS idx_games_username_status_created ON games(username, status, created_at, id);
+    ''')
+
+
+def _packed_boards(db):
+    # games.board (comma-joined text) -> games.cells (packed int, see board.py).
+    # The text column is cleared rather than dropped so older SQLite builds
+    # without DROP COLUMN can run this too.
+    if 'cells' not in _columns(db, 'games'):
+        db.execute('ALTER TABLE games ADD COLUMN cells INTEGER NOT NULL DEFAULT 0')
+    db.create_function('pack_board', 1, board.from_text, deterministic=True)
+    db.execute('UPDATE games SET cells=pack_board(board), board=NULL WHERE board IS NOT NULL')
+
+
+def _member_counters(db):
+    # Per-study approved/pending member counts, maintained by triggers on
+    # study_members so every path that changes a membership (join, leave,
+    # approve, deny, study delete, bulk loads) updates them in the same
+    # transaction as the membership row itself.
+    cols = _columns(db, 'studies')
+    if 'member_count' not in cols:
+        db.execute('ALTER TABLE studies ADD COLUMN member_count INTEGER NOT NULL DEFAULT 0')
+    if 'pending_count' not in cols:
+        db.execute('ALTER TABLE studies ADD COLUMN pending_count INTEGER NOT NULL DEFAULT 0')
+    _run(db, '''
+    UPDATE studies SET
+        member_count = (SELECT COUNT(*) FROM study_members m WHERE m.study_id=studies.id AND m.status='approved'),
+        pending_count = (SELECT COUNT(*) FROM study_members m WHERE m.study_id=studies.id AND m.status='pending');
+    CREATE TRIGGER IF NOT EXISTS study_members_count_ai AFTER INSERT ON study_members BEGIN
+        UPDATE studies SET member_count = member_count + (new.status='approved'),
+                           pending_count = pending_count + (new.status='pending')
+        WHERE id = new.study_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS study_members_count_ad AFTER DELETE ON study_members BEGIN
+        UPDATE studies SET member_count = member_count - (old.status='approved'),
+                           pending_count = pending_count - (old.status='pending')
+        WHERE id = old.study_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS study_members_count_au AFTER UPDATE OF status, study_id ON study_members BEGIN
+        UPDATE studies SET member_count = member_count - (old.status='approved'),
+                           pending_count = pending_count - (old.status='pending')
+        WHERE id = old.study_id;
+        UPDATE studies SET member_count = member_count + (new.status='approved'),
+                           pending_count = pending_count + (new.status='pending')
+        WHERE id = new.study_id;
+    END;
+    ''')
+
+
+def _row_versions(db):
+    # version goes up on every UPDATE of a row, so (id, version) identifies what
+    # a client last saw (ETags, app.py); membership changes also touch the
+    # study row through the counter triggers above
+    for table in ('games', 'studies', 'study_members'):
+        if 'version' not in _columns(db, table):
+            db.execute(f'ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+    _run(db, '''
+    CREATE TRIGGER IF NOT EXISTS games_version_au AFTER UPDATE ON games WHEN new.version = old.version BEGIN
+        UPDATE games SET version = old.version + 1 WHERE rowid = new.rowid;
+    END;
+    CREATE TRIGGER IF NOT EXISTS studies_version_au AFTER UPDATE ON studies WHEN new.version = old.version BEGIN
+        UPDATE studies SET version = old.version + 1 WHERE rowid = new.rowid;
+    END;
+    CREATE TRIGGER IF NOT EXISTS study_members_version_au AFTER UPDATE ON study_members WHEN new.version = old.version BEGIN
+        UPDATE study_members SET version = old.version + 1 WHERE rowid = new.rowid;
+    END;
+    ''')
+
+
+def _board_dimensions(db):
+    # m,n,k games (board.Geometry); existing rows are classic 3x3, three in a row
+    cols = _columns(db, 'games')
+    for name in ('board_rows', 'board_cols', 'win_length'):
+        if name not in cols:
+            db.execute(f'ALTER TABLE games ADD COLUMN {name} INTEGER NOT NULL DEFAULT 3')
+
+
+def _stones(cells, size):
+    cells = board.from_db(cells)
+    return ((cells | cells >> size) & ((1 << size) - 1)).bit_count()
+
+
+def _move_log(db):
+    # append-only history (movelog.py). Games already in progress get a
+    # snapshot of their current board so replays have a starting point.
+    _run(db, '''
+    CREATE TABLE IF NOT EXISTS game_moves (
+        game_id TEXT NOT NULL,
+        ply INTEGER NOT NULL,
+        code INTEGER NOT NULL,
+        PRIMARY KEY (game_id, ply)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS game_snapshots (
+        game_id TEXT NOT NULL,
+        ply INTEGER NOT NULL,
+        cells INTEGER NOT NULL,
+        PRIMARY KEY (game_id, ply)
+    ) WITHOUT ROWID;
+    CREATE TRIGGER IF NOT EXISTS games_log_ad AFTER DELETE ON games BEGIN
+        DELETE FROM game_moves WHERE game_id = old.id;
+        DELETE FROM game_snapshots WHERE game_id = old.id;
+    END;
+    ''')
+    db.create_function('stones', 2, _stones, deterministic=True)
+    db.execute('''INSERT OR IGNORE INTO game_snapshots(game_id,ply,cells)
+                  SELECT id, stones(cells, board_rows * board_cols), cells FROM games WHERE cells != 0''')
+
+
+def _maintenance_jobs(db):
+    # background jobs (maintenance.py) are polled from any worker process, so
+    # their state lives here; the partial index finds finished games to archive
+    _run(db, '''
+    CREATE TABLE IF NOT EXISTS maintenance_jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'queued',
+        progress TEXT NOT NULL DEFAULT '{}',
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_games_finished_created ON games(created_at) WHERE status != 'playing';
+    ''')
+
+
+MIGRATIONS = [
+    _base_schema,
+    _search_index,
+    _listing_indexes,
+    _games_keyset_indexes,
+    _packed_boards,
+    _member_counters,
+    _row_versions,
+    _board_dimensions,
+    _move_log,
+    _maintenance_jobs,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(db):
+    """Apply pending migrations, one transaction each; return the resulting version."""
+    current = schema_version(db)
+    if current >= SCHEMA_VERSION:
+        return current
+    if db.in_transaction:
+        db.commit()
+    for version in range(current + 1, SCHEMA_VERSION + 1):
+        # IMMEDIATE takes the write lock before re-reading user_version, so two
+        # workers starting together cannot both apply the same step
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if schema_version(db) >= version:
+                db.rollback()
+                continue
+            MIGRATIONS[version - 1](db)
+            db.execute(f'PRAGMA user_version={version}')
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    db.execute('PRAGMA optimize')
+    return SCHEMA_VERSION
@@ -0,0 +1,68 @@
+"""
+movelog.py - append-only move history for games
+
+games.cells only holds the current board. Every move (human or bot) is also
+appended to game_moves as one small integer, keyed by (game_id, ply) where ply
+is the number of stones on the board before the move:
+
+    code = pos << 2 | (player == 'O') << 1 | by_bot
+
+Every SNAPSHOT_INTERVAL plies the board is also copied to game_snapshots, so
+the state after any ply is rebuilt from the nearest snapshot plus fewer than
+SNAPSHOT_INTERVAL moves, however long the game is. Moves are read back with
+plain cursor iteration, so replays and exports stream instead of loading a
+whole game (or the whole table) into memory.
+"""
+
+import board
+
+SNAPSHOT_INTERVAL = 16
+
+
+def encode(pos, player, by_bot=False):
+    return pos << 2 | (player == 'O') << 1 | bool(by_bot)
+
+
+def decode(code):
+    """Return (pos, player, by_bot)."""
+    return code >> 2, 'O' if code & 2 else 'X', bool(code & 1)
+
+
+def record(db, game_id, geom, cells, moves, interval=SNAPSHOT_INTERVAL):
+    """Append moves [(pos, player, by_bot), ...] played in order from cells.
+
+    Call inside the write unit that updates games.cells, so the log and the
+    board can never disagree.
+    """
+    ply = geom.occupied(cells).bit_count()
+    rows, snapshots = [], []
+    for pos, player, by_bot in moves:
+        if ply % interval == 0:
+            snapshots.append((game_id, ply, board.to_db(cells)))
+        rows.append((game_id, ply, encode(pos, player, by_bot)))
+        cells = geom.play(cells, pos, player)
+        ply += 1
+    if snapshots:
+        db.executemany('INSERT OR REPLACE INTO game_snapshots(game_id,ply,cells) VALUES(?,?,?)', snapshots)
+    db.executemany('INSERT INTO game_moves(game_id,ply,code) VALUES(?,?,?)', rows)
+
+
+def iter_moves(db, game_id, start=0, stop=None):
+    """Yield (ply, pos, player, by_bot) for plies start <= ply < stop."""
+    cur = db.execute('SELECT ply,code FROM game_moves WHERE game_id=? AND ply>=? AND ply<? ORDER BY ply',
+                     (game_id, start, (1 << 62) if stop is None else stop))
+    for ply, code in cur:
+        yield (ply,) + decode(code)
+
+
+def state_at(db, geom, game_id, ply):
+    """Board after ply stones were placed, from the nearest snapshot; None if unknown."""
+    snap = db.execute('SELECT ply,cells FROM game_snapshots WHERE game_id=? AND ply<=? ORDER BY ply DESC LIMIT 1',
+                      (game_id, ply)).fetchone()
+    start, cells = (snap[0], board.from_db(snap[1])) if snap else (0, board.EMPTY)
+    for n, pos, player, _ in iter_moves(db, game_id, start, ply):
+        if n != start:
+            return None  # gap in the log
+        cells = geom.play(cells, pos, player)
+        start += 1
+    return cells if start == ply else None
@@ -0,0 +1,137 @@
+"""
+passwords.py - password hashing off the request thread
+
+Hashing and checking passwords is deliberately CPU-expensive, so register and
+login hand it to a small process pool (separate processes, so the work is not
+serialized behind the GIL with every other request in the worker).
+
+The pool is bounded: once PASSWORD_HASH_MAX_PENDING hashes are queued or
+running, new ones fail fast with HasherBusy and the route answers 503 instead
+of letting every request's latency grow. PASSWORD_HASH_METHOD picks the
+werkzeug hash parameters; stored hashes made with other parameters are
+upgraded the next time their owner logs in.
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue is full or a hash did not finish in time."""
+
+
+def canonical_method(method):
+    # werkzeug writes the fully spelled-out parameters into the stored hash
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        return 'scrypt:32768:8:1'
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    return method
+
+
+def needs_rehash(pwhash, method):
+    return pwhash.split('$', 1)[0] != canonical_method(method)
+
+
+# These run inside the worker processes.
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(pwhash, password, method):
+    if not check_password_hash(pwhash, password):
+        return False, None
+    if needs_rehash(pwhash, method):
+        return True, generate_password_hash(password, method=method)
+    return True, None
+
+
+class Hasher:
+    def __init__(self, method='scrypt', workers=2, max_pending=32, timeout=10.0):
+        self.method = canonical_method(method)
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: never fork a multi-threaded server process
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy('password hashing queue is full')
+        if not self.workers:
+            try:
+                return fn(*args)  # inline, e.g. tests or single-threaded tools
+            finally:
+                self._slots.release()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # the slot is held until the task is done, not until we stop waiting:
+        # a timed-out hash keeps its worker busy and still counts as pending
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HasherBusy('password hashing timed out')
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """Return (ok, new_hash); new_hash is set when the stored hash should be replaced."""
+        return self._run(_verify, pwhash, password, self.method)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+_hasher_lock = threading.Lock()
+
+
+def get_hasher(app):
+    """Return the app's hasher, building it on first use and again after a fork."""
+    hasher = app.extensions.get('hasher')
+    if hasher is not None and hasher.pid == os.getpid():
+        return hasher
+    with _hasher_lock:
+        hasher = app.extensions.get('hasher')
+        if hasher is None or hasher.pid != os.getpid():
+            cfg = app.config
+            hasher = Hasher(
+                cfg.get('PASSWORD_HASH_METHOD', 'scrypt'),
+                workers=cfg.get('PASSWORD_HASH_WORKERS', 2),
+                max_pending=cfg.get('PASSWORD_HASH_MAX_PENDING', 32),
+                timeout=cfg.get('PASSWORD_HASH_TIMEOUT', 10.0),
+            )
+            atexit.register(hasher.shutdown)
+            app.extensions['hasher'] = hasher
+    return hasher
+
+
+def reset_hasher(app):
+    hasher = app.extensions.pop('hasher', None)
+    if hasher is not None:
+        hasher.shutdown()
@@ -0,0 +1,135 @@
+"""
+shards.py - game storage spread over several SQLite files
+
+games is the busiest table: every move is an UPDATE plus move-log rows, and
+in one file they all queue on the same write lock as users, studies and
+memberships. With GAME_SHARDS = N > 1, games, game_moves and game_snapshots
+live in N files next to the main database (database.shard_paths), and a game
+belongs to shard crc32(id) % N. Each file has its own WAL and write lock, so
+moves on different shards commit in parallel and never wait for study writes.
+Every shard carries the full schema (migrations run on each); only its game
+tables are used.
+
+Reads of one game go to its shard. Listings ask every shard for a page in
+the same (created_at, id) order and merge them (merge_desc). A write that
+spans shards (the batch endpoints) opens one transaction per shard and only
+commits once every shard's part succeeded (run_together). That is atomic
+against conflicts and errors, though not against a crash between two
+commits. Group commit (DB_GROUP_COMMIT) applies to the main file only.
+
+Changing GAME_SHARDS moves rows with the rebalance tool, with the app stopped:
+
+    STUDY_HUB_GAME_SHARDS=4 flask --app app rebalance-games --from-shards 1
+
+Each chunk is copied (INSERT OR REPLACE) and committed on its new shard before
+it is deleted from the old one, so an interrupted run can simply be repeated.
+"""
+
+import heapq
+import os
+import sqlite3
+import zlib
+
+import database
+
+def shard_for(game_id, count):
+    """The shard index of a game id; stable across processes and restarts."""
+    if count <= 1:
+        return 0
+    return zlib.crc32(game_id.encode('utf-8')) % count
+
+
+def run_together(units):
+    """Run [(conn, fn), ...] as one transaction per connection; return the results.
+
+    All transactions are opened (in the given order, so two callers cannot
+    deadlock) and every fn has run before the first commit; if any fn raises,
+    every transaction is rolled back.
+    """
+    began = []
+    try:
+        for conn, fn in units:
+            if conn.in_transaction:
+                conn.commit()
+            conn.execute('BEGIN IMMEDIATE')
+            began.append(conn)
+        results = [fn(conn) for conn, fn in units]
+    except BaseException:
+        for conn in began:
+            conn.rollback()
+        raise
+    for conn in began:
+        conn.commit()
+    return results
+
+
+def merge_desc(pages, key, limit):
+    """Merge per-shard result lists, each already sorted descending by key."""
+    return list(heapq.merge(*pages, key=key, reverse=True))[:limit]
+
+
+def _connect(path, pragmas):
+    conn = sqlite3.connect(path)
+    for name, value in pragmas.items():
+        conn.execute(f'PRAGMA {name}={value}')
+    return conn
+
+
+def rebalance(old_paths, new_paths, chunk_rows=500, pragmas=None):
+    """Move every game (with its move log) from the old shard layout to the new one.
+
+    Both layouts must already have the current schema. Yields a progress dict
+    after each chunk.
+    """
+    pragmas = dict(database.DEFAULT_PRAGMAS, **(pragmas or {}))
+    targets = [_connect(path, pragmas) for path in new_paths]
+    real = [os.path.realpath(path) for path in new_paths]
+    progress = {'scanned': 0, 'moved': 0}
+    try:
+        for path in old_paths:
+            if not os.path.exists(path):
+                continue
+            source = _connect(path, pragmas)
+            try:
+                here = os.path.realpath(path)
+                cols = ','.join(r[1] for r in source.execute('PRAGMA table_info(games)'))
+                last = 0
+                while True:
+                    rows = source.execute('SELECT rowid, id FROM games WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                                          (last, chunk_rows)).fetchall()
+                    if not rows:
+                        break
+                    last = rows[-1][0]
+                    progress['scanned'] += len(rows)
+                    moving = {}
+                    for _, gid in rows:
+                        shard = shard_for(gid, len(new_paths))
+                        if real[shard] != here:
+                            moving.setdefault(shard, []).append(gid)
+                    for shard, ids in sorted(moving.items()):
+                        _move(source, targets[shard], cols, ids)
+                        progress['moved'] += len(ids)
+                    yield progress
+            finally:
+                source.close()
+    finally:
+        for conn in targets:
+            conn.close()
+
+
+def _move(source, target, cols, ids):
+    marks = ','.join('?' * len(ids))
+    games = source.execute(f'SELECT {cols} FROM games WHERE id IN ({marks})', ids).fetchall()
+    if not games:
+        return
+    logs = {table: source.execute(f'SELECT game_id,ply,{value} FROM {table} WHERE game_id IN ({marks})', ids).fetchall()
+            for table, value in (('game_moves', 'code'), ('game_snapshots', 'cells'))}
+
+    def copy(conn):
+        conn.executemany(f'INSERT OR REPLACE INTO games({cols}) VALUES({",".join("?" * len(games[0]))})', games)
+        conn.executemany('INSERT OR REPLACE INTO game_moves(game_id,ply,code) VALUES(?,?,?)', logs['game_moves'])
+        conn.executemany('INSERT OR REPLACE INTO game_snapshots(game_id,ply,cells) VALUES(?,?,?)', logs['game_snapshots'])
+
+    database.run_in_transaction(target, copy)
+    # the games_log_ad trigger removes the old copy's move log
+    database.run_in_transaction(source, lambda conn: conn.execute(f'DELETE FROM games WHERE id IN ({marks})', ids))
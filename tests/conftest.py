@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+# ensure project root (parent folder) is on sys.path so tests can import app.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import app, init_db
+import database
+import gamestore
+import maintenance
+
+
+@pytest.fixture
+def db_client(tmp_path):
+    # same app, pointed at a throwaway database file
+    old = app.config['DATABASE']
+    maintenance.close_worker(app)
+    gamestore.close_store(app)
+    database.close_pool(app)
+    app.extensions.pop('cache', None)
+    app.config.update(TESTING=True, DATABASE=str(tmp_path / 'test.db'))
+    with app.app_context():
+        init_db()
+    with app.test_client() as c:
+        yield c
+    maintenance.close_worker(app)
+    gamestore.close_store(app)
+    database.close_pool(app)
+    app.extensions.pop('cache', None)
+    app.config['DATABASE'] = old
+
+def login(c, uname='alice'):
+    c.post('/register', data={'username': uname, 'password': 'pw'})
+    c.post('/login', data={'username': uname, 'password': 'pw'})
+
+def add_study(c, name, description='', public=True):
+    data = {'study_name': name, 'description': description}
+    if public:
+        data['public'] = 'on'
+    return c.post('/add', data=data, headers={'X-Requested-With': 'XMLHttpRequest'}).get_json()['id']
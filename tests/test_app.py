@@ -1,11 +1,15 @@
+import base64
+import json
 import os
 import sys
+import time
 import pytest
 
 # ensure project root (parent folder) is on sys.path so tests can import app.py
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app import app
+from conftest import login as _login, add_study as _add_study
 import uuid
 
 @pytest.fixture
@@ -31,4 +35,207 @@ def test_register_login_add_list(client):
 
     # dashboard shows study
     rv = client.get('/dashboard')
-    assert b'Math 101' in rv.data
\ No newline at end of file
+    assert b'Math 101' in rv.data
+
+def test_search_ranks_prefix_matches_and_pages(db_client):
+    _login(db_client)
+    _add_study(db_client, 'Calculus I', 'limits and derivatives')
+    _add_study(db_client, 'Physics', 'uses calculus heavily')
+    _add_study(db_client, 'Private calculus', public=False)
+    _add_study(db_client, 'History', 'wars')
+
+    rv = db_client.get('/api/studies/search?q=calc')
+    assert [s['name'] for s in rv.get_json()] == ['Calculus I', 'Physics']
+    assert 'X-Next-Cursor' not in rv.headers
+
+    rv = db_client.get('/api/studies/search?q=calc&limit=1')
+    assert [s['name'] for s in rv.get_json()] == ['Calculus I']
+    rv = db_client.get('/api/studies/search?q=calc&limit=1&cursor=' + rv.headers['X-Next-Cursor'])
+    assert [s['name'] for s in rv.get_json()] == ['Physics']
+    assert 'X-Next-Cursor' not in rv.headers
+
+    assert db_client.get('/api/studies/search?q=calc&cursor=nope').status_code == 400
+
+
+def test_search_latest_pages_and_forgets_deleted_studies(db_client):
+    _login(db_client)
+    ids = [_add_study(db_client, f'Study {i}') for i in range(3)]
+    seen = []
+    url = '/api/studies/search?limit=2'
+    while url:
+        rv = db_client.get(url)
+        seen += [s['id'] for s in rv.get_json()]
+        cursor = rv.headers.get('X-Next-Cursor')
+        url = cursor and '/api/studies/search?limit=2&cursor=' + cursor
+    assert seen == ids[::-1]
+
+    db_client.post(f'/study/{ids[0]}/delete')
+    found = [s['id'] for s in db_client.get('/api/studies/search?q=study').get_json()]
+    assert sorted(found) == sorted(ids[1:])
+
+
+def test_games_list_pages_by_cursor_and_filters_status(db_client):
+    _login(db_client)
+    gids = [db_client.post('/api/games', json={'opponent': 'human'}).get_json()['id'] for _ in range(5)]
+    # finish one game: X takes the top row
+    for pos in (0, 3, 1, 4, 2):
+        db_client.post(f'/api/games/{gids[0]}/move', json={'pos': pos})
+
+    seen, url = [], '/api/games?limit=2'
+    while url:
+        rv = db_client.get(url)
+        page = rv.get_json()
+        assert len(page) <= 2
+        seen += [g['id'] for g in page]
+        cursor = rv.headers.get('X-Next-Cursor')
+        url = cursor and '/api/games?limit=2&cursor=' + cursor
+    assert sorted(seen) == sorted(gids) and len(seen) == 5
+
+    playing = db_client.get('/api/games?status=playing').get_json()
+    assert sorted(g['id'] for g in playing) == sorted(gids[1:])
+    assert db_client.get('/api/games?cursor=%%%').status_code == 400
+    for forged in ([{'a': 1}, [2]], [True, 'x'], [None, 'x']):
+        cursor = base64.urlsafe_b64encode(json.dumps(forged).encode()).decode()
+        for url in ('/api/games?cursor=', '/api/studies/search?q=calc&cursor='):
+            rv = db_client.get(url + cursor)
+            assert rv.status_code == 400 and rv.get_json() == {'error': 'invalid cursor'}
+
+
+def test_member_counters_follow_membership_changes(db_client):
+    _login(db_client, 'owner')
+    sid = _add_study(db_client, 'Private club', public=False)
+
+    def counts():
+        s = next(s for s in db_client.get('/api/owned_studies').get_json() if s['id'] == sid)
+        return s['member_count'], s['pending_count']
+
+    assert counts() == (1, 0)  # creator is auto-joined
+    for name in ('ann', 'ben'):
+        _login(db_client, name)
+        db_client.post(f'/study/{sid}/join')
+    _login(db_client, 'owner')
+    assert counts() == (1, 2)
+    db_client.post(f'/study/{sid}/approve', data={'username': 'ann'})
+    assert counts() == (2, 1)
+    db_client.post(f'/study/{sid}/deny', data={'username': 'ben'})
+    assert counts() == (2, 0)
+    _login(db_client, 'ann')
+    db_client.post(f'/study/{sid}/leave')
+    _login(db_client, 'owner')
+    assert counts() == (1, 0)
+    assert b'Private club' in db_client.get('/dashboard').data
+
+
+def test_conditional_get_answers_304_until_the_rows_change(db_client):
+    _login(db_client, 'owner')
+    sid = _add_study(db_client, 'Private club', public=False)
+    gid = db_client.post('/api/games', json={'opponent': 'human'}).get_json()['id']
+    urls = ['/api/games', f'/api/games/{gid}', '/api/owned_studies', f'/study/{sid}/members']
+    etags = {}
+    for url in urls:
+        rv = db_client.get(url)
+        assert rv.status_code == 200 and rv.headers['ETag']
+        etags[url] = rv.headers['ETag']
+        rv = db_client.get(url, headers={'If-None-Match': etags[url]})
+        assert rv.status_code == 304 and rv.data == b''
+
+    db_client.post(f'/api/games/{gid}/move', json={'pos': 4})
+    _login(db_client, 'bob')
+    db_client.post(f'/study/{sid}/join')
+    _login(db_client, 'owner')
+    for url in urls:
+        rv = db_client.get(url, headers={'If-None-Match': etags[url]})
+        assert rv.status_code == 200 and rv.headers['ETag'] != etags[url]
+
+
+def test_bot_game_with_group_commit(db_client):
+    app.config['DB_GROUP_COMMIT'] = True
+    try:
+        _login(db_client, 'alice')
+        gid = db_client.post('/api/games', json={'opponent': 'bot'}).get_json()['id']
+        game = db_client.post(f'/api/games/{gid}/move', json={'pos': 0}).get_json()['game']
+        # player and bot reply were written together
+        assert game['board'].count('X') == 1 and game['board'].count('O') == 1
+        assert db_client.get(f'/api/games/{gid}').get_json()['game'] == game
+    finally:
+        app.config['DB_GROUP_COMMIT'] = False
+
+
+def test_batch_create_and_moves_report_per_item_results(db_client):
+    _login(db_client, 'alice')
+    rv = db_client.post('/api/games/batch', json={'games': [{'opponent': 'bot'}, {'opponent': 'human'}, {'opponent': 'cat'}]})
+    results = rv.get_json()['results']
+    assert results[2] == {'error': 'invalid opponent'}
+    bot_gid, human_gid = results[0]['id'], results[1]['id']
+
+    rv = db_client.post('/api/games/moves', json={'moves': [
+        {'game': human_gid, 'pos': 0},
+        {'game': human_gid, 'pos': 0},     # now occupied
+        {'game': human_gid, 'pos': 4},
+        {'game': bot_gid, 'pos': 9},
+        {'game': bot_gid, 'pos': 4},
+        {'game': 'nope', 'pos': 1},
+        {'game': ['x'], 'pos': 1},         # not an id at all
+    ]})
+    results = rv.get_json()['results']
+    assert [r.get('error') for r in results] == [None, 'cell occupied', None, 'invalid pos', None, 'not found', 'not found']
+    assert results[2]['game']['board'][:5] == ['X', '', '', '', 'O']
+    assert results[4]['game']['board'].count('O') == 1  # bot replied in the same batch
+    assert db_client.get(f'/api/games/{human_gid}').get_json()['game'] == results[2]['game']
+    assert db_client.get(f'/api/games/{bot_gid}').get_json()['game'] == results[4]['game']
+
+
+def test_batch_moves_share_one_bot_search_budget(db_client, monkeypatch):
+    import bot
+    monkeypatch.setitem(app.config, 'BOT_BATCH_BUDGET', 0.2)
+    monkeypatch.setitem(app.config, 'BOT_MOVE_BUDGET', 0.5)
+    budgets = []
+
+    def reply(geom, cells, player, budget=0.5, max_depth=None):
+        budgets.append(budget)
+        time.sleep(budget)      # a search that uses all the time it is given
+        return next(i for i in range(geom.size) if geom.is_free(cells, i))
+
+    monkeypatch.setattr(bot, 'reply', reply)
+    _login(db_client, 'alice')
+    games = [{'opponent': 'bot', 'rows': 5, 'cols': 5, 'win_length': 4}] * 4
+    gids = [r['id'] for r in db_client.post('/api/games/batch', json={'games': games}).get_json()['results']]
+    results = db_client.post('/api/games/moves', json={'moves': [{'game': gid, 'pos': 12} for gid in gids]}).get_json()['results']
+    assert all(r['game']['board'].count('O') == 1 for r in results)
+    assert len(budgets) == 4 and sum(budgets) <= 0.25        # not 4 * BOT_MOVE_BUDGET
+
+
+def test_games_carry_board_dimensions(db_client):
+    _login(db_client, 'alice')
+    assert db_client.post('/api/games', json={'rows': 2, 'cols': 3}).status_code == 400
+    assert db_client.post('/api/games', json={'rows': 4, 'cols': 4, 'win_length': 5}).status_code == 400
+    rv = db_client.post('/api/games', json={'opponent': 'bot', 'rows': 9, 'cols': 9, 'win_length': 5})
+    game = rv.get_json()['game']
+    assert (game['rows'], game['cols'], game['win_length'], len(game['board'])) == (9, 9, 5, 81)
+    gid = rv.get_json()['id']
+    assert db_client.post(f'/api/games/{gid}/move', json={'pos': 81}).status_code == 400
+    game = db_client.post(f'/api/games/{gid}/move', json={'pos': 40}).get_json()['game']
+    assert game['board'][40] == 'X' and game['board'].count('O') == 1 and game['turn'] == 'X'
+    assert db_client.get(f'/api/games/{gid}').get_json()['game'] == game
+    assert db_client.get('/api/games').get_json()[0]['cols'] == 9
+
+
+def test_moves_are_logged_and_replayable(db_client):
+    app.config['GAME_SNAPSHOT_INTERVAL'] = 2
+    try:
+        _login(db_client, 'alice')
+        gid = db_client.post('/api/games', json={'opponent': 'bot'}).get_json()['id']
+        boards = [db_client.post(f'/api/games/{gid}/move', json={'pos': pos}).get_json()['game']['board']
+                  for pos in (0, 8)]
+    finally:
+        app.config['GAME_SNAPSHOT_INTERVAL'] = 16
+    moves = [json.loads(line) for line in db_client.get(f'/api/games/{gid}/moves').data.splitlines()]
+    assert [(m['ply'], m['player'], m['bot']) for m in moves] == [(0, 'X', False), (1, 'O', True), (2, 'X', False), (3, 'O', True)]
+    assert moves[0]['pos'] == 0 and moves[2]['pos'] == 8
+    for ply, expected in ((2, boards[0]), (4, boards[1])):
+        assert db_client.get(f'/api/games/{gid}/state?ply={ply}').get_json()['board'] == expected
+    assert db_client.get(f'/api/games/{gid}/state?ply=9').status_code == 404
+    assert db_client.get('/admin/moves/export').status_code == 403
+    _login(db_client, 'admin')
+    exported = [json.loads(line) for line in db_client.get('/admin/moves/export').data.splitlines()]
+    assert [m['game'] for m in exported] == [gid] * 4
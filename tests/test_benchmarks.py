@@ -0,0 +1,72 @@
+import json
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+
+from app import app
+import database
+
+
+def test_load_test_smoke(tmp_path):
+    import bench_app
+    old = dict(app.config)
+    out = tmp_path / 'bench.json'
+    try:
+        bench_app.main(['--scale', 'tiny', '--workers', '2', '--seconds', '0.3',
+                        '--db', str(tmp_path / 'bench.db'), '--output', str(out)])
+    finally:
+        database.close_pool(app)
+        app.config.update(old)
+    doc = json.loads(out.read_text())
+    assert doc['meta']['scale'] == 'tiny'
+    assert set(doc['results']) == set(bench_app.ENDPOINTS) | {'_total'}
+    assert doc['results']['_total']['requests'] > 0
+    assert doc['results']['_total']['errors'] == 0
+
+
+def test_load_test_seeds_games_into_their_shards(tmp_path):
+    import bench_app
+    import shards
+    old = dict(app.config)
+    out = tmp_path / 'bench.json'
+    try:
+        app.config['GAME_SHARDS'] = 3
+        bench_app.main(['--scale', 'tiny', '--workers', '2', '--seconds', '0.3', '--endpoints', 'games,move',
+                        '--db', str(tmp_path / 'bench.db'), '--output', str(out)])
+    finally:
+        database.close_pool(app)
+        app.config.update(old)
+    doc = json.loads(out.read_text())
+    assert doc['meta']['game_shards'] == 3
+    assert doc['results']['_total']['requests'] > 0 and doc['results']['_total']['errors'] == 0
+    main = str(tmp_path / 'bench.db')
+    counts = [sqlite3.connect(p).execute('SELECT id FROM games').fetchall() for p in database.shard_paths(main, 3)]
+    assert sqlite3.connect(main).execute('SELECT count(*) FROM games').fetchone()[0] == 0
+    assert all(counts) and all(shards.shard_for(gid, 3) == i for i, rows in enumerate(counts) for (gid,) in rows)
+
+
+def test_selfplay_is_reproducible_across_workers(tmp_path):
+    import selfplay
+    docs = []
+    for workers, chunk in ((0, 1000), (2, 37)):
+        out = tmp_path / f'selfplay{workers}.json'
+        assert selfplay.main(['--games', '300', '--seed', '5', '--workers', str(workers), '--chunk', str(chunk),
+                              '--output', str(out)]) == 0
+        docs.append(json.loads(out.read_text()))
+    first, second = docs
+    assert first['meta']['digest'] == second['meta']['digest'] and first['meta']['reproducible']
+    for matchup in ('bot-bot', 'bot-random', 'random-bot'):
+        a, b = first['results'][matchup], second['results'][matchup]
+        assert (a['win'], a['draw'], a['loss']) == (b['win'], b['draw'], b['loss'])
+        assert a['games'] == 100 and a['illegal'] == 0 and a['bot_moves'] > 0
+    assert first['results']['bot-random']['loss'] == first['results']['random-bot']['loss'] == 0
+
+
+def test_selfplay_progress_streams_results_and_move_timings():
+    import selfplay
+    lines = []
+    selfplay.run((3, 3, 3), ('bot-random',), 40, 1, 0, 10, 2, 0.5, None, report_every=0, out=lines.append)
+    assert len(lines) == 4 and lines[-1].startswith('40/40 games')
+    assert 'bot-random W' in lines[-1] and ' move ' in lines[-1] and 'us max ' in lines[-1]
@@ -0,0 +1,80 @@
+import os
+import sys
+from functools import lru_cache
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import board
+import bot
+
+
+def _cells(grid):
+    return board.from_list(grid)
+
+
+@lru_cache(maxsize=None)
+def _cached_value(grid, player):
+    return _value(list(grid), player)
+
+
+def _value(grid, player):
+    # plain minimax value for player to move: 1 win, 0 draw, -1 loss
+    result = board.winner(_cells(grid))
+    if result == 'draw':
+        return 0
+    if result is not None:
+        return 1 if result == player else -1
+    best = -2
+    for i in range(9):
+        if not grid[i]:
+            grid[i] = player
+            best = max(best, -_cached_value(tuple(grid), bot.other(player)))
+            grid[i] = ''
+    return best
+
+
+def _positions(grid, player, out):
+    if board.winner(_cells(grid)) is not None:
+        return
+    out.append((list(grid), player))
+    for i in range(9):
+        if not grid[i]:
+            grid[i] = player
+            _positions(grid, bot.other(player), out)
+            grid[i] = ''
+
+
+def test_table_moves_are_optimal_everywhere():
+    positions = []
+    _positions([''] * 9, 'X', positions)
+    seen = set()
+    for grid, player in positions:
+        key = (tuple(grid), player)
+        if key in seen:
+            continue
+        seen.add(key)
+        mv = bot.best_move(_cells(grid), player)
+        assert mv is not None and grid[mv] == ''
+        expected = _value(list(grid), player)
+        grid[mv] = player
+        assert -_value(grid, bot.other(player)) == expected
+
+
+def test_empty_board_opens_center_and_finished_games_have_no_move():
+    assert bot.best_move(board.EMPTY, 'X') == 4
+    assert bot.best_move(_cells(['X', 'X', 'X', 'O', 'O', '', '', '', '']), 'O') is None
+
+
+def test_bot_takes_immediate_win():
+    assert bot.best_move(_cells(['O', 'O', '', 'X', 'X', '', 'X', '', '']), 'O') == 2
+
+
+def test_board_round_trips_and_detects_results():
+    cells = _cells(['X', 'O', '', '', 'X', '', 'O', '', 'X'])
+    assert board.to_list(cells) == ['X', 'O', '', '', 'X', '', 'O', '', 'X']
+    assert board.from_text('X,O,,,X,,O,,X') == cells
+    assert board.winner(cells) == 'X'
+    assert not board.is_free(cells, 1) and board.is_free(cells, 2)
+    full = _cells(['X', 'O', 'X', 'X', 'O', 'O', 'O', 'X', 'X'])
+    assert board.winner(full) == 'draw'
+    assert board.winner(board.play(board.EMPTY, 4, 'O')) is None
@@ -0,0 +1,81 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import app
+from conftest import login as _login
+
+
+def _lines(rv):
+    return [json.loads(line) for line in rv.data.splitlines()]
+
+
+def test_admin_import_reports_progress_and_row_errors_then_exports(db_client):
+    app.config['BULK_CHUNK_SIZE'] = 2
+    try:
+        _login(db_client, 'admin')
+        body = ('id,username,name,description,public\n'
+                's1,ann,Algebra,Linear,1\n'
+                's2,ben,Biology,,0\n'
+                's3,,Nameless owner,,1\n'
+                's1,ann,Duplicate,,1\n'
+                's4,cat,Chemistry,Labs,yes\n')
+        out = _lines(db_client.post('/admin/import/studies?format=csv', data=body, content_type='text/csv'))
+        done = out[-1]['done']
+        assert [o['progress']['chunks'] for o in out[:-1]] == [1, 2, 2]
+        assert (done['read'], done['inserted'], done['skipped'], done['error_count']) == (5, 3, 1, 1)
+        assert done['errors'] == [{'line': 4, 'error': 'username is required'}]
+
+        members = '\n'.join(json.dumps(m) for m in (
+            {'study_id': 's2', 'username': 'ann', 'status': 'pending'},
+            {'study_id': 'nope', 'username': 'ann'},
+            {'study_id': 's2', 'username': 'cat', 'status': 'boss'},
+        )) + '\nnot json\n'
+        done = _lines(db_client.post('/admin/import/members', data=members))[-1]['done']
+        assert (done['inserted'], done['error_count']) == (1, 3)
+        assert [e['line'] for e in done['errors']] == [2, 3, 4]
+    finally:
+        app.config['BULK_CHUNK_SIZE'] = 5000
+
+    # imported public studies show up in search right away (cache invalidated)
+    assert [s['name'] for s in db_client.get('/api/studies/search?q=chem').get_json()] == ['Chemistry']
+    studies = _lines(db_client.get('/admin/export/studies'))
+    assert [s['id'] for s in studies] == ['s1', 's2', 's4']
+    assert studies[2]['public'] == 1
+    csv_text = db_client.get('/admin/export/members?format=csv').data.decode()
+    assert csv_text.splitlines()[0] == 'study_id,username,status,joined_at'
+    assert 's2,ann,pending,' in csv_text
+    _login(db_client, 'ann')
+    assert db_client.get('/admin/export/studies').status_code == 403
+
+
+def test_broken_csv_records_and_bad_bytes_are_reported_not_fatal(db_client):
+    _login(db_client, 'admin')
+    body = (b'id,username,name,description,public\n'
+            b's1,ann,Algebra,,1\n'
+            b's2,ann,' + b'x' * 200000 + b',,1\n'        # beyond the csv field size limit
+            b's3,ben,Bi\xffology,,1\n'                   # not UTF-8
+            b's4,cat,Chemistry,,1\n')
+    out = _lines(db_client.post('/admin/import/studies?format=csv', data=body, content_type='text/csv'))
+    done = out[-1]['done']
+    assert (done['read'], done['inserted'], done['error_count']) == (4, 2, 2)
+    assert [e['line'] for e in done['errors']] == [3, 4]
+    assert done['errors'][0]['error'].startswith('invalid CSV: field larger than field limit')
+    assert done['errors'][1]['error'] == 'invalid UTF-8'
+
+    done = _lines(db_client.post('/admin/import/members', data=b'{"study_id": "s1", "username": "\xff"}\n'))[-1]['done']
+    assert done['errors'] == [{'line': 1, 'error': 'invalid UTF-8'}]
+
+
+def test_cli_round_trip(db_client, tmp_path):
+    src = tmp_path / 'studies.ndjson'
+    src.write_text('{"id": "x1", "username": "ann", "name": "Latin", "public": true}\n')
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['import-data', 'studies', str(src)])
+    assert result.exit_code == 0, result.output
+    out = tmp_path / 'out.csv'
+    result = runner.invoke(args=['export-data', 'studies', '--format', 'csv', '-o', str(out)])
+    assert result.exit_code == 0
+    assert out.read_text().splitlines()[1].startswith('x1,ann,Latin,,,1,')
@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cache
+from app import app, get_cache
+from conftest import login as _login, add_study as _add_study
+
+
+def test_memory_cache_evicts_lru_by_bytes_and_expires():
+    c = cache.MemoryCache(max_bytes=10, ttl=60)
+    c.set('a', 'A', 4)
+    c.set('b', 'B', 4)
+    assert c.get('a') == 'A'       # 'b' is now least recently used
+    c.set('c', 'C', 4)
+    assert c.get('b') is None
+    assert c.get('a') == 'A' and c.get('c') == 'C'
+    assert not c.set('huge', 'X', 11)
+    c.set('short', 'S', 1, ttl=0.01)
+    time.sleep(0.02)
+    assert c.get('short') is None
+    stats = c.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['bytes']) == (3, 2, 1, 8)
+    assert c.generation('studies') == 0 and c.bump('studies') == 1
+
+
+def test_public_search_is_cached_until_a_write_bumps_the_generation(db_client):
+    _login(db_client, 'alice')
+    _add_study(db_client, 'Calculus circle')
+    rv = db_client.get('/api/studies/search?q=calc')
+    assert rv.headers['X-Cache'] == 'MISS'
+    # normalized: case and punctuation do not make a new entry
+    rv = db_client.get('/api/studies/search?q=CALC!')
+    assert rv.headers['X-Cache'] == 'HIT'
+    assert [s['name'] for s in rv.get_json()] == ['Calculus circle']
+    assert db_client.get('/api/studies/search').headers['X-Cache'] == 'MISS'
+    assert db_client.get('/api/studies/search').headers['X-Cache'] == 'HIT'
+
+    _add_study(db_client, 'Private calculus', public=False)  # invisible, keeps the cache
+    assert db_client.get('/api/studies/search?q=calc').headers['X-Cache'] == 'HIT'
+    _add_study(db_client, 'Calculus II')
+    rv = db_client.get('/api/studies/search?q=calc')
+    assert rv.headers['X-Cache'] == 'MISS'
+    assert len(rv.get_json()) == 2
+    with app.app_context():
+        assert get_cache().stats()['hits'] == 3
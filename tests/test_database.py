@@ -0,0 +1,105 @@
+import os
+import sys
+import sqlite3
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+
+
+@pytest.fixture
+def pool(tmp_path):
+    p = database.ConnectionPool(str(tmp_path / 'pool.db'), size=2, timeout=0.1, health_check_interval=0)
+    yield p
+    p.close()
+
+
+def test_connections_are_reused_and_tuned(pool):
+    conn = pool.acquire()
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+    assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert pool.stats()['open'] == 1
+
+
+def test_release_rolls_back_open_transaction(pool):
+    conn = pool.acquire()
+    conn.execute('CREATE TABLE t (x)')
+    conn.execute('INSERT INTO t VALUES (1)')
+    assert conn.in_transaction
+    pool.release(conn)
+    conn = pool.acquire()
+    assert not conn.in_transaction
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+
+
+def test_exhausted_pool_times_out(pool):
+    a, b = pool.acquire(), pool.acquire()
+    with pytest.raises(database.PoolTimeout):
+        pool.acquire()
+    pool.release(a)
+    assert pool.acquire() is a
+    pool.release(b)
+
+
+def test_dead_connection_is_replaced_on_checkout(pool):
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.close()
+    fresh = pool.acquire()
+    assert fresh is not conn
+    assert fresh.execute('SELECT 1').fetchone()[0] == 1
+    assert pool.stats()['open'] == 1
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute('SELECT 1')
+
+
+def test_group_committer_batches_units_and_isolates_failures(pool):
+    conn = pool.acquire()
+    conn.execute('CREATE TABLE t (x UNIQUE)')
+    conn.commit()
+    committer = database.GroupCommitter(pool._connect, window=0.05)
+
+    def insert(x):
+        return lambda db: db.execute('INSERT INTO t VALUES (?)', (x,)).rowcount
+
+    errors = []
+
+    def submit(x):
+        try:
+            committer.submit(insert(x))
+        except sqlite3.IntegrityError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=submit, args=(x,)) for x in (1, 2, 3, 3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    committer.close()
+    assert len(errors) == 1  # the duplicate 3 rolled back alone
+    assert [r[0] for r in conn.execute('SELECT x FROM t ORDER BY x')] == [1, 2, 3]
+    assert committer.stats()['units'] == 4
+    assert committer.stats()['batches'] < 4
+    pool.release(conn)
+
+
+def test_run_in_transaction_rolls_back_on_error(pool):
+    conn = pool.acquire()
+    conn.execute('CREATE TABLE t (x)')
+    conn.commit()
+
+    def fails(db):
+        db.execute('INSERT INTO t VALUES (1)')
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        database.run_in_transaction(conn, fails)
+    assert database.run_in_transaction(conn, lambda db: db.execute('INSERT INTO t VALUES (2)').rowcount) == 1
+    assert [r[0] for r in conn.execute('SELECT x FROM t')] == [2]
+    pool.release(conn)
@@ -0,0 +1,61 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import board
+import bot
+import engine
+from test_bot import _positions, _value
+
+
+def test_geometry_lines_and_incremental_wins():
+    g = board.geometry(15, 15, 5)
+    assert len(g.lines) == 2 * 15 * 11 + 2 * 11 * 11
+    assert max(len(t) for t in g.lines_through) == 20
+    cells = 0
+    for pos in (0, 16, 32, 48):          # four on the main diagonal
+        cells = g.play(cells, pos, 'O')
+    assert g.result_after(cells, 48, 'O') is None
+    cells = g.play(cells, 64, 'O')
+    assert g.result_after(cells, 64, 'O') == 'O' == g.winner(cells)
+    assert board.from_db(board.to_db(cells)) == cells
+    assert isinstance(board.to_db(cells), bytes)
+    # the classic geometry packs boards exactly like the 3x3 helpers
+    grid = ['X', 'O', '', '', 'X', '', 'O', '', 'X']
+    assert board.CLASSIC.from_list(grid) == board.from_list(grid)
+    assert board.CLASSIC.winner(board.from_list(grid)) == 'X'
+
+
+def test_search_plays_perfectly_on_3x3():
+    positions = []
+    _positions([''] * 9, 'X', positions)
+    for grid, player in random.Random(7).sample(positions, 150):
+        mv = engine.best_move(board.CLASSIC, board.from_list(grid), player, budget=None)
+        expected = _value(list(grid), player)
+        grid[mv] = player
+        assert -_value(grid, bot.other(player)) == expected
+
+
+def test_search_wins_blocks_and_respects_budget():
+    g = board.geometry(4, 4, 4)
+    row = g.from_list(['X', 'X', 'X', '', 'O', 'O', 'O', '', '', '', '', '', '', '', '', ''])
+    assert engine.best_move(g, row, 'X') == 3
+    assert engine.best_move(g, row, 'O') == 7
+
+    g = board.geometry(15, 15, 5)
+    cells = 0
+    for pos in (112, 113, 114):           # open three in the middle row
+        cells = g.play(cells, pos, 'X')
+    for pos in (97, 127):
+        cells = g.play(cells, pos, 'O')
+    cells = g.play(cells, 115, 'X')       # now an open four: O must block an end
+    start = time.perf_counter()
+    search = engine.Search(g, budget=0.3)
+    mv = search.best_move(cells, 'O')
+    assert time.perf_counter() - start < 1.0
+    assert mv in (111, 116)
+    reply = bot.reply(g, g.play(0, 112, 'X'), 'O', 0.2)
+    assert engine.near_masks(g)[112] >> reply & 1 and reply != 112
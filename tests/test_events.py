@@ -0,0 +1,62 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import events
+from app import app, get_broker
+from conftest import login as _login, add_study as _add_study
+
+
+def test_broker_fans_out_and_unsubscribes():
+    broker = events.LocalBroker()
+    a = broker.subscribe(['user:a'])
+    b = broker.subscribe(['user:a', 'user:b'])
+    assert broker.publish('user:a', 'game', {'id': 1}) == 2
+    assert a.get(timeout=0) == 'event: game\ndata: {"id":1}\n\n'
+    assert b.get(timeout=0) == 'event: game\ndata: {"id":1}\n\n'
+    a.close()
+    assert broker.publish('user:a', 'game', {}) == 1
+    b.close()
+    assert broker.subscriber_count() == 0
+
+
+def test_slow_subscriber_gets_resync_instead_of_blocking():
+    broker = events.LocalBroker(queue_size=2)
+    sub = broker.subscribe(['c'])
+    for i in range(5):
+        broker.publish('c', 'game', {'i': i})
+    assert sub.get(timeout=0) == events.RESYNC
+    assert sub.get(timeout=0) is None
+
+
+def test_membership_and_moves_are_pushed_to_owner(db_client):
+    _login(db_client, 'owner')
+    sid = _add_study(db_client, 'Private club', public=False)
+    gid = db_client.post('/api/games', json={'opponent': 'bot'}).get_json()['id']
+    with app.app_context():
+        owner = get_broker().subscribe(['user:owner'])
+
+    db_client.post(f'/api/games/{gid}/move', json={'pos': 0})
+    assert owner.get(timeout=0).startswith('event: game\n')
+
+    _login(db_client, 'member')
+    db_client.post(f'/study/{sid}/join')
+    message = owner.get(timeout=0)
+    assert message.startswith('event: membership\n')
+    assert '"status":"pending"' in message and '"pending_count":1' in message
+    owner.close()
+
+
+def test_event_stream_endpoint(db_client):
+    _login(db_client, 'viewer')
+    rv = db_client.get('/api/events')
+    assert rv.mimetype == 'text/event-stream'
+    chunks = iter(rv.response)
+    assert next(chunks).startswith(b'retry:')
+    with app.app_context():
+        get_broker().publish('user:viewer', 'game', {'id': 'g'})
+    assert next(chunks) == b'event: game\ndata: {"id":"g"}\n\n'
+    rv.close()
+    with app.app_context():
+        assert get_broker().subscriber_count() == 0
@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import app
+from conftest import login as _login
+
+
+@pytest.fixture
+def store_client(db_client, monkeypatch):
+    monkeypatch.setitem(app.config, 'GAME_STORE', True)
+    monkeypatch.setitem(app.config, 'GAME_STORE_FLUSH_INTERVAL', 0)   # flush only on demand
+    _login(db_client, 'alice')
+    return db_client
+
+
+def _row(gid):
+    with sqlite3.connect(app.config['DATABASE']) as conn:
+        return conn.execute('SELECT turn, status, version, (SELECT count(*) FROM game_moves WHERE game_id=?) '
+                            'FROM games WHERE id=?', (gid, gid)).fetchone()
+
+
+def _store():
+    return app.extensions['game_store']
+
+
+def test_moves_stay_in_memory_until_a_reader_or_the_end_of_the_game(store_client):
+    c = store_client
+    gid = c.post('/api/games', json={}).get_json()['id']
+    for pos in (0, 3):
+        game = c.post(f'/api/games/{gid}/move', json={'pos': pos}).get_json()['game']
+    assert game['board'][:4] == ['X', '', '', 'O'] and game['turn'] == 'X'
+    assert _row(gid) == ('X', 'playing', 0, 0)                  # nothing written yet
+    assert c.get(f'/api/games/{gid}').get_json()['game'] == game
+    assert c.post(f'/api/games/{gid}/move', json={'pos': 3}).get_json()['error'] == 'cell occupied'
+
+    etag = c.get(f'/api/games/{gid}').headers['ETag']
+    assert c.get('/api/games').get_json()[0]['board'] == game['board']   # listing flushes first
+    assert _row(gid) == ('X', 'playing', 1, 2)
+    assert c.get(f'/api/games/{gid}').headers['ETag'] != etag
+
+    for pos in (1, 4, 2):
+        game = c.post(f'/api/games/{gid}/move', json={'pos': pos}).get_json()['game']
+    assert game['status'] == 'X_wins'
+    assert _row(gid) == ('X', 'X_wins', 2, 5)                   # durable before the answer
+    assert _store().stats()['games'] == 0
+    assert c.post(f'/api/games/{gid}/move', json={'pos': 8}).get_json()['error'] == 'game finished'
+
+
+def test_least_recently_used_game_is_written_when_evicted(store_client, monkeypatch):
+    c = store_client
+    monkeypatch.setitem(app.config, 'GAME_STORE_SIZE', 1)
+    first, second = (c.post('/api/games', json={'opponent': 'bot'}).get_json()['id'] for _ in range(2))
+    c.post(f'/api/games/{first}/move', json={'pos': 4})
+    assert _row(first)[3] == 0
+    c.post(f'/api/games/{second}/move', json={'pos': 4})
+    assert _row(first) == ('X', 'playing', 1, 2) and _row(second)[3] == 0
+    stats = _store().stats()
+    assert (stats['games'], stats['evictions'], stats['misses']) == (1, 1, 2)
+
+
+def test_a_row_changed_underneath_is_dropped_not_overwritten(store_client):
+    c = store_client
+    gid = c.post('/api/games', json={}).get_json()['id']
+    c.post(f'/api/games/{gid}/move', json={'pos': 0})
+    with sqlite3.connect(app.config['DATABASE']) as conn:
+        conn.execute("UPDATE games SET status='draw' WHERE id=?", (gid,))
+    assert _store().flush() == 0 and _store().stats()['conflicts'] == 1
+    assert _row(gid)[:2] == ('X', 'draw')
+    assert c.post(f'/api/games/{gid}/move', json={'pos': 1}).get_json()['error'] == 'game finished'
+
+
+class _BrokenConnection:
+    in_transaction = False
+
+    def execute(self, *args):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_a_failed_write_is_logged_and_not_acknowledged(store_client, monkeypatch, caplog):
+    c = store_client
+    gid = c.post('/api/games', json={}).get_json()['id']
+    for pos in (0, 3, 1, 4):
+        c.post(f'/api/games/{gid}/move', json={'pos': pos})
+    store = _store()
+    connect = store._connect
+    monkeypatch.setattr(store, '_connect', lambda shard: _BrokenConnection())
+
+    rv = c.post(f'/api/games/{gid}/move', json={'pos': 2})           # would win, must be durable first
+    assert rv.status_code == 503 and rv.headers['Retry-After'] == '1'
+    assert 'flushing 1 game(s) to shard 0 failed' in caplog.text
+    assert _row(gid) == ('X', 'playing', 0, 0)
+    game = c.get(f'/api/games/{gid}').get_json()['game']
+    assert game['status'] == 'playing' and game['board'][2] == ''   # the winning move was undone
+    assert c.delete(f'/api/games/{gid}').status_code == 503           # evict() could not write it either
+    assert _row(gid)[1] == 'playing'
+
+    monkeypatch.setattr(store, '_connect', connect)
+    assert c.post(f'/api/games/{gid}/move', json={'pos': 2}).get_json()['game']['status'] == 'X_wins'
+    assert _row(gid) == ('X', 'X_wins', 1, 5)
@@ -0,0 +1,71 @@
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import maintenance
+from app import app
+from conftest import login as _login, add_study as _add_study
+
+
+def _poll(c, url, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = c.get(url).get_json()
+        if job['state'] in ('done', 'failed') or time.monotonic() > deadline:
+            return job
+        time.sleep(0.01)
+
+
+def _won_game(c):
+    gid = c.post('/api/games', json={}).get_json()['id']
+    for pos in (0, 3, 1, 4, 2):
+        game = c.post(f'/api/games/{gid}/move', json={'pos': pos}).get_json()['game']
+    assert game['status'] != 'playing'
+    return gid
+
+
+def test_clear_runs_as_a_chunked_job_with_progress(db_client, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAINTENANCE_CHUNK_ROWS', 2)
+    monkeypatch.setitem(app.config, 'MAINTENANCE_PAUSE', 0)
+    _login(db_client, 'alice')
+    for name in ('Algebra', 'Biology', 'Chemistry'):
+        _add_study(db_client, name)
+    db_client.post('/api/games', json={})
+    assert len(db_client.get('/api/studies/search').get_json()) == 3   # now cached
+    assert db_client.post('/admin/clear').status_code == 403
+
+    _login(db_client, 'admin')
+    rv = db_client.post('/admin/clear')
+    assert rv.status_code == 202 and rv.headers['Location'] == rv.get_json()['status_url']
+    job = _poll(db_client, rv.headers['Location'])
+    assert job['state'] == 'done' and job['finished_at']
+    assert {k: job['progress'][k] for k in ('studies', 'games', 'study_members')} == {
+        'studies': 3, 'games': 1, 'study_members': 3}
+    assert db_client.get('/api/studies/search').get_json() == []
+    assert db_client.get('/admin/jobs/nope').status_code == 404
+
+
+def test_archive_moves_old_finished_games_and_their_log(db_client, monkeypatch, tmp_path):
+    archive = str(tmp_path / 'archive.db')
+    monkeypatch.setitem(app.config, 'ARCHIVE_DATABASE', archive)
+    monkeypatch.setitem(app.config, 'MAINTENANCE_CHUNK_ROWS', 1)
+    monkeypatch.setitem(app.config, 'MAINTENANCE_PAUSE', 0)
+    _login(db_client, 'alice')
+    old, recent = _won_game(db_client), _won_game(db_client)
+    playing = db_client.post('/api/games', json={}).get_json()['id']
+    with sqlite3.connect(app.config['DATABASE']) as conn:
+        conn.execute("UPDATE games SET created_at=datetime('now', '-40 days') WHERE id IN (?, ?)", (old, playing))
+
+    job = maintenance.get_job(sqlite3.connect(app.config['DATABASE']), maintenance.get_worker(app).run('archive'))
+    assert job['state'] == 'done' and job['progress']['archived'] == 1
+    assert [g['id'] for g in db_client.get('/api/games').get_json()] == [recent, playing]
+
+    with sqlite3.connect(archive) as conn:
+        assert conn.execute('SELECT id, status FROM games').fetchall() == [(old, 'X_wins')]
+        assert conn.execute('SELECT count(*) FROM game_moves WHERE game_id=?', (old,)).fetchone()[0] == 5
+    with sqlite3.connect(app.config['DATABASE']) as conn:
+        assert conn.execute('SELECT count(*) FROM game_moves WHERE game_id=?', (old,)).fetchone()[0] == 0
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
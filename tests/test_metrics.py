@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import app
+from conftest import login
+import database
+import metrics
+
+
+@pytest.fixture
+def metrics_client(db_client):
+    app.config.update(METRICS_ENABLED=True, DB_CONNECTION_FACTORY=metrics.InstrumentedConnection)
+    database.close_pool(app)  # rebuild the pool with instrumented connections
+    app.extensions['metrics'] = metrics.Registry()
+    yield db_client
+    app.config.update(METRICS_ENABLED=False, DB_CONNECTION_FACTORY=None, PROFILE_SAMPLE_RATE=0.0, PROFILE_SLOW_MS=500)
+    database.close_pool(app)
+
+
+def test_metrics_disabled_by_default(db_client):
+    assert db_client.get('/metrics').status_code == 404
+
+
+def test_latency_and_sql_are_exported(metrics_client):
+    login(metrics_client)
+    gid = metrics_client.post('/api/games', json={'opponent': 'bot'}).get_json()['id']
+    metrics_client.post(f'/api/games/{gid}/move', json={'pos': 4})
+
+    rv = metrics_client.get('/metrics')
+    assert rv.status_code == 200 and rv.mimetype == 'text/plain'
+    text = rv.get_data(as_text=True)
+    assert 'studyhub_request_duration_seconds_count{endpoint="api_move",method="POST"} 1' in text
+    assert 'studyhub_responses_total{endpoint="api_move",status="200"} 1' in text
+    assert 'studyhub_sql_duration_seconds_count{endpoint="api_move",verb="UPDATE"}' in text
+    assert 'studyhub_sql_statements_per_request_bucket{endpoint="login",le="+Inf"}' in text
+    assert 'studyhub_db_pool_connections{state="open"}' in text
+
+
+def test_slow_sampled_requests_keep_a_profile(metrics_client):
+    app.config.update(PROFILE_SAMPLE_RATE=1.0, PROFILE_SLOW_MS=0)
+    login(metrics_client, 'admin')
+    profiles = metrics_client.get('/metrics/profiles').get_json()
+    assert profiles and profiles[0]['endpoint'] in ('register', 'login')
+    assert 'cumulative' in profiles[0]['stats']
+
+
+def test_histogram_buckets_are_cumulative():
+    hist = metrics.Histogram((0.1, 1.0))
+    for v in (0.05, 0.5, 5.0):
+        hist.observe(v)
+    lines = list(hist.lines('x', [('a', 'b')]))
+    assert lines[:3] == ['x_bucket{a="b",le="0.1"} 1', 'x_bucket{a="b",le="1.0"} 2', 'x_bucket{a="b",le="+Inf"} 3']
+    assert lines[-1] == 'x_count{a="b"} 3'
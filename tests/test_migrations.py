@@ -0,0 +1,108 @@
+import os
+import re
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import app, init_db
+import board
+import database
+import migrations
+
+
+def test_fresh_database_reaches_current_version_and_rerun_is_noop(tmp_path):
+    db = sqlite3.connect(str(tmp_path / 'm.db'))
+    assert migrations.migrate(db) == migrations.SCHEMA_VERSION
+    statements = []
+    db.set_trace_callback(statements.append)
+    assert migrations.migrate(db) == migrations.SCHEMA_VERSION
+    assert statements == ['PRAGMA user_version']
+
+
+def test_legacy_database_is_upgraded_in_place(tmp_path):
+    db = sqlite3.connect(str(tmp_path / 'legacy.db'))
+    db.executescript('''
+    CREATE TABLE users (username TEXT PRIMARY KEY, password TEXT NOT NULL);
+    CREATE TABLE studies (id TEXT PRIMARY KEY, username TEXT, name TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+    CREATE TABLE games (id TEXT PRIMARY KEY, username TEXT, board TEXT, turn TEXT, status TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+    CREATE TABLE study_members (study_id TEXT, username TEXT, joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (study_id, username));
+    INSERT INTO studies(id, username, name) VALUES ('s1', 'bob', 'Old study');
+    INSERT INTO games(id, username, board, turn, status) VALUES ('g1', 'bob', 'X,,,,O,,,,X', 'O', 'playing');
+    ''')
+    migrations.migrate(db)
+    assert migrations.schema_version(db) == migrations.SCHEMA_VERSION
+    cols = [r[1] for r in db.execute('PRAGMA table_info(studies)')]
+    assert {'description', 'schedule', 'public'} <= set(cols)
+    assert db.execute('SELECT name FROM studies').fetchall() == [('Old study',)]
+    cells, text = db.execute("SELECT cells, board FROM games WHERE id='g1'").fetchone()
+    assert text is None
+    assert board.to_list(cells) == ['X', '', '', '', 'O', '', '', '', 'X']
+    # games in progress get a snapshot to replay from
+    assert db.execute("SELECT ply, cells FROM game_snapshots WHERE game_id='g1'").fetchall() == [(3, cells)]
+
+
+@pytest.fixture
+def traced_client(tmp_path):
+    old = app.config['DATABASE']
+    database.close_pool(app)
+    app.extensions.pop('cache', None)
+    app.config.update(TESTING=True, DATABASE=str(tmp_path / 'plan.db'))
+    with app.app_context():
+        init_db()
+    database.close_pool(app)
+    statements = []
+    pool = database.get_pool(app)
+    connect = pool._connect
+
+    def traced_connect():
+        conn = connect()
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    pool._connect = traced_connect
+    with app.test_client() as c:
+        yield c, statements
+    database.close_pool(app)
+    app.config['DATABASE'] = old
+
+
+# a full pass over a table (or over a whole index) is what we are guarding
+# against; reading back a LIMITed subquery's rows is fine
+_FULL_SCAN = re.compile(r'^SCAN (?!.*VIRTUAL TABLE)(?!CONSTANT ROW)(?!\(subquery-\d+\))')
+
+
+def test_hot_queries_use_indexes(traced_client):
+    c, statements = traced_client
+    for name in ('owner', 'member'):
+        c.post('/register', data={'username': name, 'password': 'pw'})
+    c.post('/login', data={'username': 'owner', 'password': 'pw'})
+    sid = c.post('/add', data={'study_name': 'Algebra', 'public': 'on'},
+                 headers={'X-Requested-With': 'XMLHttpRequest'}).get_json()['id']
+    gid = c.post('/api/games', json={'opponent': 'bot'}).get_json()['id']
+    c.post('/login', data={'username': 'member', 'password': 'pw'})
+    c.post(f'/study/{sid}/join')
+    c.post('/login', data={'username': 'owner', 'password': 'pw'})
+    del statements[:]
+
+    c.get('/dashboard')
+    c.get('/api/owned_studies')
+    c.get('/api/studies/search')
+    c.get('/api/studies/search?q=alg')
+    c.get('/api/games')
+    c.get(f'/api/games/{gid}')
+    c.post(f'/api/games/{gid}/move', json={'pos': 0})
+    c.get(f'/study/{sid}/members')
+
+    db = sqlite3.connect(app.config['DATABASE'])
+    checked = 0
+    for sql in statements:
+        if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            continue
+        plan = [r[3] for r in db.execute('EXPLAIN QUERY PLAN ' + sql)]
+        scans = [line for line in plan if _FULL_SCAN.match(line)]
+        assert not scans, f'{sql}\n  -> {plan}'
+        checked += 1
+    assert checked >= 8
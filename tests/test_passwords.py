@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import maintenance
+from app import app, create_app
+from conftest import login
+import passwords
+
+
+@pytest.fixture
+def hashing(db_client):
+    old = {k: app.config[k] for k in ('PASSWORD_HASH_METHOD', 'PASSWORD_HASH_WORKERS', 'PASSWORD_HASH_MAX_PENDING')}
+    passwords.reset_hasher(app)
+    yield db_client
+    passwords.reset_hasher(app)
+    app.config.update(old)
+
+
+def _stored_hash(username):
+    db = sqlite3.connect(app.config['DATABASE'])
+    return db.execute('SELECT password FROM users WHERE username=?', (username,)).fetchone()[0]
+
+
+def test_method_normalization():
+    assert passwords.canonical_method('scrypt') == 'scrypt:32768:8:1'
+    assert passwords.canonical_method('pbkdf2:sha256:1000') == 'pbkdf2:sha256:1000'
+    assert not passwords.needs_rehash('pbkdf2:sha256:1000$salt$abc', 'pbkdf2:sha256:1000')
+    assert passwords.needs_rehash('pbkdf2:sha256:1000$salt$abc', 'scrypt')
+
+
+def test_process_pool_round_trip():
+    hasher = passwords.Hasher('pbkdf2:sha256:1000', workers=1)
+    try:
+        pwhash = hasher.hash('secret')
+        assert hasher.verify(pwhash, 'secret') == (True, None)
+        assert hasher.verify(pwhash, 'wrong') == (False, None)
+    finally:
+        hasher.shutdown()
+
+
+def test_timed_out_hash_keeps_its_slot_until_it_finishes():
+    hasher = passwords.Hasher('pbkdf2:sha256:1000', workers=1, max_pending=1, timeout=0.05)
+    try:
+        with pytest.raises(passwords.HasherBusy, match='timed out'):
+            hasher._run(time.sleep, 1.0)
+        with pytest.raises(passwords.HasherBusy, match='queue is full'):
+            hasher._run(time.sleep, 0)             # the first one still runs in the pool
+        deadline = time.monotonic() + 30
+        while not hasher._slots.acquire(timeout=0.05):
+            assert time.monotonic() < deadline
+        hasher._slots.release()
+        hasher.timeout = 30
+        assert hasher._run(time.sleep, 0) is None
+    finally:
+        hasher.shutdown()
+
+
+def test_login_upgrades_hash_when_parameters_change(hashing):
+    app.config.update(PASSWORD_HASH_METHOD='pbkdf2:sha256:1000', PASSWORD_HASH_WORKERS=0)
+    login(hashing, 'carol')
+    assert _stored_hash('carol').startswith('pbkdf2:sha256:1000$')
+
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+    passwords.reset_hasher(app)
+    hashing.get('/logout')
+    rv = hashing.post('/login', data={'username': 'carol', 'password': 'pw'}, follow_redirects=True)
+    assert b'Logged in successfully' in rv.data
+    assert _stored_hash('carol').startswith('pbkdf2:sha256:2000$')
+
+
+def test_full_hash_queue_answers_503(hashing):
+    app.config.update(PASSWORD_HASH_WORKERS=0, PASSWORD_HASH_MAX_PENDING=0)
+    rv = hashing.post('/register', data={'username': 'dave', 'password': 'pw'})
+    assert rv.status_code == 503
+    assert rv.headers['Retry-After'] == '1'
+
+
+def test_factory_app_hashes_with_its_own_settings(tmp_path):
+    passwords.reset_hasher(app)
+    other = create_app({'DATABASE': str(tmp_path / 'own.db'), 'PASSWORD_HASH_WORKERS': 0,
+                        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000'})
+    try:
+        assert other.test_client().post('/register', data={'username': 'erin', 'password': 'pw'}).status_code == 302
+        hasher = other.extensions['hasher']
+        assert hasher.workers == 0 and hasher._executor is None      # hashed inline
+        assert 'hasher' not in app.extensions
+        db = sqlite3.connect(other.config['DATABASE'])
+        assert db.execute("SELECT password FROM users WHERE username='erin'").fetchone()[0].startswith('pbkdf2:sha256:1000$')
+    finally:
+        passwords.reset_hasher(other)
+        maintenance.close_worker(other)
+        database.close_pool(other)
@@ -0,0 +1,98 @@
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import shards
+from app import app
+from conftest import login as _login
+
+
+def _count(path, table='games'):
+    with sqlite3.connect(path) as conn:
+        return conn.execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+
+
+@pytest.fixture
+def sharded(db_client, monkeypatch):
+    database.close_pool(app)
+    monkeypatch.setitem(app.config, 'GAME_SHARDS', 3)
+    _login(db_client, 'alice')
+    yield db_client
+    database.close_pool(app)
+
+
+def test_shard_for_is_stable_and_spreads_ids():
+    ids = [f'game-{i}' for i in range(3000)]
+    counts = [0, 0, 0]
+    for gid in ids:
+        counts[shards.shard_for(gid, 3)] += 1
+    assert min(counts) > 900
+    assert shards.shard_for('abc', 3) == shards.shard_for('abc', 3)
+    assert shards.shard_for('abc', 1) == 0
+
+
+def test_games_are_spread_over_shards_and_listed_in_one_order(sharded):
+    c = sharded
+    ids = [r['id'] for r in c.post('/api/games/batch', json={'games': [{}] * 30}).get_json()['results']]
+    paths = database.shard_paths(app.config['DATABASE'], 3)
+    assert [_count(p) for p in paths] == [sum(shards.shard_for(gid, 3) == i for gid in ids) for i in range(3)]
+    assert all(_count(p) for p in paths) and _count(app.config['DATABASE']) == 0
+
+    seen, cursor = [], None
+    while True:
+        rv = c.get('/api/games?limit=7' + (f'&cursor={cursor}' if cursor else ''))
+        seen += [g['id'] for g in rv.get_json()]
+        cursor = rv.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+    assert sorted(seen) == sorted(ids) and len(seen) == 30
+
+    a, b = ids[0], next(gid for gid in ids if shards.shard_for(gid, 3) != shards.shard_for(ids[0], 3))
+    out = c.post('/api/games/moves', json={'moves': [{'game': a, 'pos': 0}, {'game': b, 'pos': 4}]}).get_json()
+    assert [r['game']['board'].count('X') for r in out['results']] == [1, 1]
+    assert c.post(f'/api/games/{a}/move', json={'pos': 1}).get_json()['game']['turn'] == 'X'
+    assert [m['pos'] for m in (json.loads(line) for line in c.get(f'/api/games/{a}/moves').data.splitlines())] == [0, 1]
+    assert c.delete(f'/api/games/{b}').status_code == 200
+    assert c.get(f'/api/games/{b}').status_code == 404
+
+
+def test_rebalance_moves_games_and_their_log_to_the_new_layout(db_client, monkeypatch):
+    _login(db_client, 'alice')
+    ids = [r['id'] for r in db_client.post('/api/games/batch', json={'games': [{}] * 12}).get_json()['results']]
+    db_client.post(f'/api/games/{ids[0]}/move', json={'pos': 4})
+    main = app.config['DATABASE']
+    database.close_pool(app)
+    monkeypatch.setitem(app.config, 'GAME_SHARDS', 3)
+
+    result = app.test_cli_runner().invoke(args=['rebalance-games', '--from-shards', '1', '--chunk-rows', '5'])
+    assert result.exit_code == 0, result.output
+    assert 'moved 12 of 12 games into 3 shard(s)' in result.output
+    paths = database.shard_paths(main, 3)
+    assert _count(main) == 0 and sum(_count(p) for p in paths) == 12
+    assert _count(paths[shards.shard_for(ids[0], 3)], 'game_moves') == 1
+    assert _count(main, 'game_moves') == 0
+    assert db_client.get(f'/api/games/{ids[0]}').get_json()['game']['board'][4] == 'X'
+    assert len(db_client.get('/api/games?limit=50').get_json()) == 12
+    database.close_pool(app)
+
+
+def test_admin_clear_empties_every_shard(sharded, monkeypatch):
+    c = sharded
+    monkeypatch.setitem(app.config, 'MAINTENANCE_PAUSE', 0)
+    c.post('/api/games/batch', json={'games': [{}] * 9})
+    _login(c, 'admin')
+    url = c.post('/admin/clear').headers['Location']
+    for _ in range(500):
+        job = c.get(url).get_json()
+        if job['state'] in ('done', 'failed'):
+            break
+        time.sleep(0.01)
+    assert job['state'] == 'done' and job['progress']['games'] == 9
+    assert [_count(p) for p in database.shard_paths(app.config['DATABASE'], 3)] == [0, 0, 0]
@@ -0,0 +1,63 @@
+import gc
+import json
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import maintenance
+import migrations
+from app import create_app, get_db
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+_TIMED = '''
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+app.create_app()
+t2 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'create_app': t2 - t1}))
+'''
+
+
+def test_startup_is_timed_and_opens_no_database(tmp_path, record_property):
+    db = tmp_path / 'untouched.db'
+    out = subprocess.run([sys.executable, '-c', _TIMED], cwd=ROOT, check=True, capture_output=True, text=True,
+                         env=dict(os.environ, STUDY_HUB_DATABASE=str(db)))
+    timings = json.loads(out.stdout)
+    for name, seconds in timings.items():
+        record_property(f'startup_{name}_seconds', round(seconds, 4))
+    assert not db.exists()
+
+
+def test_preload_migrates_once_and_compiles_templates(tmp_path):
+    app = create_app({'DATABASE': str(tmp_path / 'pre.db')}, preload=True)
+    try:
+        assert gc.get_freeze_count() > 0
+        assert len(app.jinja_env.cache) == len(app.jinja_env.list_templates())
+        assert 'db_pool' not in app.extensions     # nothing for forked workers to inherit
+        assert (str(tmp_path / 'pre.db'), 1) in app.extensions['schema_ready']
+    finally:
+        gc.unfreeze()
+    try:
+        assert app.test_client().get('/api/studies/search').status_code == 200
+        with app.app_context():
+            assert migrations.schema_version(get_db()) == migrations.SCHEMA_VERSION
+    finally:
+        maintenance.close_worker(app)
+        database.close_pool(app)
+
+
+def test_first_request_migrates_a_fresh_database(tmp_path):
+    app = create_app({'DATABASE': str(tmp_path / 'lazy.db')})
+    try:
+        assert app.test_client().get('/api/studies/search').status_code == 200
+        with app.app_context():
+            assert migrations.schema_version(get_db()) == migrations.SCHEMA_VERSION
+    finally:
+        maintenance.close_worker(app)
+        database.close_pool(app)